@@ -5,8 +5,38 @@
 # SPDX-License-Identifier: MIT
 #
 
-from .wireguard_config import WireguardConfig, WireguardPeer
-from .wireguard_device import WireguardDevice
-from .wireguard_key import WireguardKey
+from __future__ import annotations
+
+from importlib import import_module
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .wireguard_config import WireguardConfig, WireguardPeer
+    from .wireguard_device import WireguardDevice
+    from .wireguard_key import WireguardKey
 
 __all__ = ["WireguardConfig", "WireguardDevice", "WireguardKey", "WireguardPeer"]
+
+# the public classes are imported on first use, so that importing a submodule
+# (i.e. wireguard_tools.cli for `wg-py genkey`) does not pull in everything
+_LAZY_IMPORTS = {
+    "WireguardConfig": ".wireguard_config",
+    "WireguardDevice": ".wireguard_device",
+    "WireguardKey": ".wireguard_key",
+    "WireguardPeer": ".wireguard_config",
+}
+
+
+def __getattr__(name: str) -> object:
+    try:
+        module = _LAZY_IMPORTS[name]
+    except KeyError:
+        msg = f"module {__name__!r} has no attribute {name!r}"
+        raise AttributeError(msg) from None
+    value = getattr(import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted([*globals(), *__all__])
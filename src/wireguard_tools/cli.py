@@ -10,42 +10,62 @@ from __future__ import annotations
 import argparse
 import os
 import sys
-from contextlib import closing
-from importlib.metadata import version
+from contextlib import closing, nullcontext, suppress
 from secrets import token_bytes
 from stat import S_IRWXO, S_ISREG
-from typing import Iterable
+from typing import TYPE_CHECKING, Any, Sequence
 
-from .wireguard_config import WireguardConfig
-from .wireguard_device import WireguardDevice
-from .wireguard_key import WireguardKey
+from .wireguard_device import DEVICE_TIMEOUT
+from .wireguard_key import (
+    WireguardKey,
+    derive_public_keys,
+    derive_public_keys_parallel,
+    public_key_executor,
+)
+
+if TYPE_CHECKING:
+    from .wireguard_config import WireguardConfig
+
+# Subcommands import what they need when they run, so that i.e. genkey does not
+# pay for attrs, segno or pyroute2.
+
+# number of keys generated and written at a time by genkey --count
+GENKEY_BATCH_SIZE = 1024
 
 
 def show(args: argparse.Namespace) -> int:
     """Show the current configuration and device information."""
-    try:
-        if args.interface is None:
-            devices: Iterable[WireguardDevice] = WireguardDevice.list()
-        else:
-            devices = [WireguardDevice.get(args.interface)]
-
-        for device in devices:
-            print(f"interface: {device.interface}")
-            print(device.get_config())
-            device.close()
-    except RuntimeError as exc:
-        print(exc, file=sys.stderr)
-        return 1
+    from .wireguard_device import WireguardDevice
+
+    if args.interface is None:
+        configs = WireguardDevice.get_all_configs(args.jobs, args.timeout)
     else:
-        return 0
+        try:
+            with closing(WireguardDevice.get(args.interface, args.timeout)) as device:
+                configs = {device.interface: device.get_config()}
+        except (OSError, RuntimeError) as exc:
+            print(exc, file=sys.stderr)
+            return 1
+
+    result = 0
+    for interface, config in configs.items():
+        if isinstance(config, Exception):
+            print(f"{interface}: {config}", file=sys.stderr)
+            result = 1
+            continue
+        print(f"interface: {interface}")
+        print(config)
+    return result
 
 
 def showconf(args: argparse.Namespace) -> int:
     """Show the configuration of a WireGuard interface, for use with `setconf`."""
+    from .wireguard_device import WireguardDevice
+
     try:
         with closing(WireguardDevice.get(args.interface)) as device:
             config = device.get_config()
-            print(config.to_wgconfig(), end="")
+            config.write_wgconfig(sys.stdout)
             return 0
     except RuntimeError as exc:
         print(exc, file=sys.stderr)
@@ -61,8 +81,10 @@ def set_(_args: argparse.Namespace) -> int:
 def setconf(args: argparse.Namespace) -> int:
     """Apply a configuration file to a WireGuard interface."""
     # XXX our device.set_config implicitly does a syncconf
+    from .wireguard_device import WireguardDevice
+
     try:
-        config = WireguardConfig.from_wgconfig(args.configfile)
+        config = _read_configfile(args)
         with closing(WireguardDevice.get(args.interface)) as device:
             device.set_config(config)
             return 0
@@ -79,16 +101,29 @@ def addconf(_args: argparse.Namespace) -> int:
 
 def syncconf(args: argparse.Namespace) -> int:
     """Synchronize a configuration file with a WireGuard interface."""
+    from .wireguard_device import WireguardDevice
+
     try:
-        config = WireguardConfig.from_wgconfig(args.configfile)
+        config = _read_configfile(args)
         with closing(WireguardDevice.get(args.interface)) as device:
-            device.set_config(config)
+            device.sync_config(config)
             return 0
     except RuntimeError as exc:
         print(exc, file=sys.stderr)
         return 1
 
 
+def _read_configfile(args: argparse.Namespace) -> WireguardConfig:
+    """Parse the configfile argument, through the parse cache if requested."""
+    from .wireguard_config import WireguardConfig
+
+    if args.parse_cache and args.configfile is not sys.stdin:
+        from .wireguard_cache import load_wgconfig
+
+        return load_wgconfig(args.configfile.name, configfile=args.configfile.buffer)
+    return WireguardConfig.from_wgconfig(args.configfile)
+
+
 def _check_stdout() -> None:
     """Check and warn if stdout is a world accessible file."""
     stat = os.fstat(sys.stdout.fileno())
@@ -96,11 +131,26 @@ def _check_stdout() -> None:
         print("Warning: writing to world accessible file.", file=sys.stderr)
 
 
-def genkey(_args: argparse.Namespace) -> int:
+def genkey(args: argparse.Namespace) -> int:
     """Generate a new private key and write it to stdout."""
     _check_stdout()
-    secret_key = WireguardKey.generate()
-    print(secret_key)
+    # a single process pool for all batches
+    executor = public_key_executor(args.count, args.jobs) if args.with_pubkey else None
+    with executor or nullcontext():
+        remaining = args.count
+        while remaining > 0:
+            secret_keys = WireguardKey.generate_many(min(remaining, GENKEY_BATCH_SIZE))
+            remaining -= len(secret_keys)
+            if args.with_pubkey:
+                public_keys = derive_public_keys(secret_keys, executor)
+                print(
+                    "\n".join(
+                        f"{secret_key} {public_key}"
+                        for secret_key, public_key in zip(secret_keys, public_keys)
+                    ),
+                )
+            else:
+                print("\n".join(str(secret_key) for secret_key in secret_keys))
     return 0
 
 
@@ -114,29 +164,127 @@ def genpsk(_args: argparse.Namespace) -> int:
     return 0
 
 
-def pubkey(_args: argparse.Namespace) -> int:
-    """Read a private key from stdin and write a public key to stdout."""
-    private_key = sys.stdin.read()
-    public_key = WireguardKey(private_key).public_key()
-    print(public_key)
+def pubkey(args: argparse.Namespace) -> int:
+    """Read private keys from stdin and write the public keys to stdout."""
+    private_keys = [WireguardKey(line) for line in sys.stdin.read().split()]
+    if not private_keys:
+        print("No private key found on stdin", file=sys.stderr)
+        return 1
+    public_keys = derive_public_keys_parallel(private_keys, args.jobs)
+    print("\n".join(str(public_key) for public_key in public_keys))
     return 0
 
 
 def strip(args: argparse.Namespace) -> int:
     """Output a configuration file with all wg-quick specific options removed."""
-    config = WireguardConfig.from_wgconfig(args.configfile)
-    print(config.to_wgconfig())
+    from .wireguard_config import WireguardConfig, WireguardPeer
+
+    records = WireguardConfig.iter_wgconfig(args.configfile)
+    interface = next(records)
+    assert isinstance(interface, WireguardConfig)
+    peers = (peer for peer in records if isinstance(peer, WireguardPeer))
+    interface.write_wgconfig(sys.stdout, peers)
     return 0
 
 
+def check(args: argparse.Namespace) -> int:
+    """Check a configuration file for allowed IPs claimed by more than one peer."""
+    from .wireguard_config import WireguardConfig, WireguardPeer
+    from .wireguard_routing import find_conflicts
+
+    records = WireguardConfig.iter_wgconfig(args.configfile)
+    next(records)
+    peers = (peer for peer in records if isinstance(peer, WireguardPeer))
+    conflicts = [
+        conflict
+        for conflict in find_conflicts(peers)
+        if conflict.duplicate or not args.allow_overlap
+    ]
+    for conflict in conflicts:
+        print(f"{args.configfile.name}: {conflict}")
+    return 1 if conflicts else 0
+
+
+def exporter(args: argparse.Namespace) -> int:
+    """Serve the peer statistics of WireGuard interfaces as Prometheus metrics."""
+    from pathlib import Path
+
+    from .wireguard_config import WireguardConfig
+    from .wireguard_exporter import WireguardExporter
+
+    # configuration files only provide the friendly_name/friendly_json labels
+    configs = {}
+    for configfile in args.config:
+        with configfile:
+            configs[Path(configfile.name).stem] = WireguardConfig.from_wgconfig(
+                configfile,
+            )
+
+    wg_exporter = WireguardExporter(args.interface, configs, args.timeout)
+    with suppress(KeyboardInterrupt):
+        wg_exporter.serve(args.listen_address, args.port, args.interval)
+    return 0
+
+
+def _version() -> str:
+    from importlib.metadata import version
+
+    return f"wireguard-tools {version('wireguard-tools')}"
+
+
+class _ArgumentParser(argparse.ArgumentParser):
+    """ArgumentParser that only looks up the package version for --help."""
+
+    def format_help(self) -> str:
+        if self.epilog is None:
+            self.epilog = _version()
+        return super().format_help()
+
+
+class _VersionAction(argparse.Action):
+    """Like action="version", but looks up the version when it is used."""
+
+    def __init__(self, option_strings: Sequence[str], dest: str, **kwargs: Any) -> None:
+        super().__init__(option_strings, dest, nargs=0, **kwargs)
+
+    def __call__(
+        self,
+        parser: argparse.ArgumentParser,
+        _namespace: argparse.Namespace,
+        _values: Any,
+        _option_string: str | None = None,
+    ) -> None:
+        print(_version())
+        parser.exit()
+
+
 def main() -> int:
-    version_str = f"wireguard-tools {version('wireguard-tools')}"
-    parser = argparse.ArgumentParser(epilog=version_str)
+    parser = _ArgumentParser()
+    parser.add_argument(
+        "--version",
+        action=_VersionAction,
+        default=argparse.SUPPRESS,
+        help="show program's version number and exit",
+    )
     parser.set_defaults(func=lambda _: parser.print_help())
 
-    sub = parser.add_subparsers(title="Available subcommands")
+    sub = parser.add_subparsers(
+        title="Available subcommands",
+        parser_class=argparse.ArgumentParser,
+    )
     show_parser = sub.add_parser("show", help=show.__doc__, description=show.__doc__)
     show_parser.add_argument("interface", nargs="?")
+    show_parser.add_argument(
+        "--jobs",
+        type=int,
+        help="number of devices queried at the same time",
+    )
+    show_parser.add_argument(
+        "--timeout",
+        type=float,
+        default=DEVICE_TIMEOUT,
+        help="seconds to wait on a device request before giving up on it",
+    )
     show_parser.set_defaults(func=show)
 
     showconf_parser = sub.add_parser(
@@ -157,6 +305,11 @@ def main() -> int:
     )
     setconf_parser.add_argument("interface")
     setconf_parser.add_argument("configfile", type=argparse.FileType("r"))
+    setconf_parser.add_argument(
+        "--parse-cache",
+        action="store_true",
+        help="reuse the parsed configuration while the file is unchanged",
+    )
     setconf_parser.set_defaults(func=setconf)
 
     addconf_parser = sub.add_parser(
@@ -175,6 +328,11 @@ def main() -> int:
     )
     syncconf_parser.add_argument("interface")
     syncconf_parser.add_argument("configfile", type=argparse.FileType("r"))
+    syncconf_parser.add_argument(
+        "--parse-cache",
+        action="store_true",
+        help="reuse the parsed configuration while the file is unchanged",
+    )
     syncconf_parser.set_defaults(func=syncconf)
 
     genkey_parser = sub.add_parser(
@@ -182,6 +340,22 @@ def main() -> int:
         help=genkey.__doc__,
         description=genkey.__doc__,
     )
+    genkey_parser.add_argument(
+        "--count",
+        type=int,
+        default=1,
+        help="number of private keys to generate",
+    )
+    genkey_parser.add_argument(
+        "--with-pubkey",
+        action="store_true",
+        help="write 'private public' key pairs",
+    )
+    genkey_parser.add_argument(
+        "--jobs",
+        type=int,
+        help="number of processes used to derive public keys",
+    )
     genkey_parser.set_defaults(func=genkey)
 
     genpsk_parser = sub.add_parser(
@@ -196,6 +370,11 @@ def main() -> int:
         help=pubkey.__doc__,
         description=pubkey.__doc__,
     )
+    pubkey_parser.add_argument(
+        "--jobs",
+        type=int,
+        help="number of processes used to derive public keys",
+    )
     pubkey_parser.set_defaults(func=pubkey)
 
     # from wg-quick
@@ -207,6 +386,64 @@ def main() -> int:
     strip_parser.add_argument("configfile", type=argparse.FileType("r"))
     strip_parser.set_defaults(func=strip)
 
+    check_parser = sub.add_parser(
+        "check",
+        help=check.__doc__,
+        description=check.__doc__,
+    )
+    check_parser.add_argument("configfile", type=argparse.FileType("r"))
+    check_parser.add_argument(
+        "--allow-overlap",
+        action="store_true",
+        help="only report duplicate prefixes, not nested ones",
+    )
+    check_parser.set_defaults(func=check)
+
+    exporter_parser = sub.add_parser(
+        "exporter",
+        help=exporter.__doc__,
+        description=exporter.__doc__,
+    )
+    exporter_parser.add_argument(
+        "interface",
+        nargs="*",
+        help="interfaces to export, all interfaces when none are given",
+    )
+    exporter_parser.add_argument(
+        "-c",
+        "--config",
+        type=argparse.FileType("r"),
+        action="append",
+        default=[],
+        help="configuration file with friendly names, i.e. /etc/wireguard/wg0.conf",
+    )
+    exporter_parser.add_argument(
+        "-l",
+        "--listen-address",
+        default="",
+        help="address to listen on (default: all addresses)",
+    )
+    exporter_parser.add_argument(
+        "-p",
+        "--port",
+        type=int,
+        default=9586,
+        help="port to listen on (default: 9586)",
+    )
+    exporter_parser.add_argument(
+        "--interval",
+        type=float,
+        default=5.0,
+        help="seconds between polls of the interfaces (default: 5)",
+    )
+    exporter_parser.add_argument(
+        "--timeout",
+        type=float,
+        default=DEVICE_TIMEOUT,
+        help="seconds to wait on a device request before giving up on it",
+    )
+    exporter_parser.set_defaults(func=exporter)
+
     args = parser.parse_args()
     result: int = args.func(args)
     return result
@@ -37,6 +37,7 @@ the same names.
 
 # Implements ladder multiplication as described in "Montgomery curves and the Montgomery
 # ladder" by Daniel J. Bernstein and Tanja Lange. https://eprint.iacr.org/2017/293.pdf
+# using the differential addition and doubling formulas from RFC7748 section 5.
 
 # Curve25519 is a Montgomery curve defined by:
 # y**2 = x**3 + A * x**2 + x  mod P
@@ -44,58 +45,60 @@ the same names.
 
 from __future__ import annotations
 
-from typing import Tuple
-
-Point = Tuple[int, int]
-
 RAW_KEY_LENGTH = 32
 P = 2**255 - 19
-_A = 486662
-
-
-def _point_add(point_n: Point, point_m: Point, point_diff: Point) -> Point:
-    """Given the projection of two points and their difference, return their sum."""
-    xn, zn = point_n
-    xm, zm = point_m
-    x_diff, z_diff = point_diff
-    x = (z_diff << 2) * (xm * xn - zm * zn) ** 2
-    z = (x_diff << 2) * (xm * zn - zm * xn) ** 2
-    return x % P, z % P
-
-
-def _point_double(point_n: Point) -> Point:
-    """Double a point provided in projective coordinates."""
-    xn, zn = point_n
-    xn2 = xn**2
-    zn2 = zn**2
-    x = (xn2 - zn2) ** 2
-    xzn = xn * zn
-    z = 4 * xzn * (xn2 + _A * xzn + zn2)
-    return x % P, z % P
-
-
-def _const_time_swap(a: Point, b: Point, *, swap: bool) -> tuple[Point, Point]:
-    """Swap two values in constant time."""
-    index = int(swap) * 2
-    temp = (a, b, b, a)
-    return temp[index], temp[index + 1]
+_A24 = 121665  # (A - 2) / 4, where A = 486662
 
 
 def _raw_curve25519(base: int, n: int) -> int:
-    """Raise the point base to the power n."""
-    zero = (1, 0)
-    one = (base, 1)
-    mP, m1P = zero, one
-
-    for i in reversed(range(256)):
-        bit = bool(n & (1 << i))
-        mP, m1P = _const_time_swap(mP, m1P, swap=bit)
-        mP, m1P = _point_double(mP), _point_add(mP, m1P, one)
-        mP, m1P = _const_time_swap(mP, m1P, swap=bit)
-
-    x, z = mP
-    inv_z = pow(z, P - 2, P)
-    return (x * inv_z) % P
+    """Raise the point base to the power n.
+
+    Montgomery ladder using the formulas from RFC7748 section 5, with all
+    intermediate values kept in local variables.
+    """
+    x1 = base
+    x2, z2 = 1, 0
+    x3, z3 = base, 1
+    swap = 0
+
+    for i in range(254, -1, -1):
+        bit = (n >> i) & 1
+        # conditional swap, mask is either 0 or all ones
+        mask = -(swap ^ bit)
+        dummy = mask & (x2 ^ x3)
+        x2 ^= dummy
+        x3 ^= dummy
+        dummy = mask & (z2 ^ z3)
+        z2 ^= dummy
+        z3 ^= dummy
+        swap = bit
+
+        a = x2 + z2
+        aa = a * a % P
+        b = x2 - z2
+        bb = b * b % P
+        e = aa - bb
+        c = x3 + z3
+        d = x3 - z3
+        da = d * a % P
+        cb = c * b % P
+        x3 = da + cb
+        x3 = x3 * x3 % P
+        z3 = da - cb
+        z3 = x1 * (z3 * z3 % P) % P
+        x2 = aa * bb % P
+        z2 = e * (aa + _A24 * e) % P
+
+    mask = -swap
+    dummy = mask & (x2 ^ x3)
+    x2 ^= dummy
+    dummy = mask & (z2 ^ z3)
+    z2 ^= dummy
+
+    # modular inverse through pow(z, -1, P) is much faster than the Fermat
+    # inverse pow(z, P - 2, P), zero has no inverse and maps to zero
+    inv_z = pow(z2, -1, P) if z2 else 0
+    return (x2 * inv_z) % P
 
 
 def _unpack_number(s: bytes) -> int:
@@ -0,0 +1,211 @@
+#
+# Pure Python reimplementation of wireguard-tools
+#
+# Copyright (c) 2022-2024 Carnegie Mellon University
+# SPDX-License-Identifier: MIT
+#
+"""Compact list of allowed IPs.
+
+Every IPv4Interface/IPv6Interface object costs a few hundred bytes, which adds
+up quickly with large peer tables. PackedAllowedIPs keeps the address family,
+prefix length and address of each entry in packed byte arrays and only creates
+ipaddress objects when an entry is accessed. Comparing two packed lists is a
+comparison of the underlying bytes.
+"""
+
+from __future__ import annotations
+
+from ipaddress import IPv4Interface, IPv6Interface, ip_interface
+from typing import Iterable, Iterator, MutableSequence, Tuple, Union, overload
+
+IPInterface = Union[IPv4Interface, IPv6Interface]
+
+# (version, network address with host bits masked, prefix length)
+NetworkKey = Tuple[int, int, int]
+
+_ADDRESS_SIZE = 16
+_MAX_PREFIXLEN = {4: 32, 6: 128}
+
+
+class PackedAllowedIPs(MutableSequence[IPInterface]):
+    """List of IPv4 and IPv6 interfaces, stored as packed columns."""
+
+    __slots__ = ("_addresses", "_prefixlens", "_versions")
+
+    def __init__(self, interfaces: Iterable[IPInterface | str] = ()) -> None:
+        self._versions = bytearray()
+        self._prefixlens = bytearray()
+        # addresses as 16 byte big-endian integers, including any host bits
+        self._addresses = bytearray()
+        self.extend(interfaces)
+
+    @staticmethod
+    def _pack(interface: IPInterface | str) -> tuple[int, int, bytes]:
+        if isinstance(interface, str):
+            interface = ip_interface(interface)
+        return (
+            interface.version,
+            interface.network.prefixlen,
+            int(interface).to_bytes(_ADDRESS_SIZE, "big"),
+        )
+
+    def _unpack(self, index: int) -> IPInterface:
+        start = index * _ADDRESS_SIZE
+        address = int.from_bytes(self._addresses[start : start + _ADDRESS_SIZE], "big")
+        if self._versions[index] == 4:  # noqa: PLR2004
+            return IPv4Interface((address, self._prefixlens[index]))
+        return IPv6Interface((address, self._prefixlens[index]))
+
+    def __len__(self) -> int:
+        return len(self._versions)
+
+    @overload
+    def __getitem__(self, index: int) -> IPInterface: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> PackedAllowedIPs: ...
+
+    def __getitem__(self, index: int | slice) -> IPInterface | PackedAllowedIPs:
+        if isinstance(index, slice):
+            return PackedAllowedIPs(list(self)[index])
+        return self._unpack(range(len(self))[index])
+
+    @overload
+    def __setitem__(self, index: int, value: IPInterface) -> None: ...
+
+    @overload
+    def __setitem__(self, index: slice, value: Iterable[IPInterface]) -> None: ...
+
+    def __setitem__(
+        self,
+        index: int | slice,
+        value: IPInterface | Iterable[IPInterface],
+    ) -> None:
+        if isinstance(index, slice):
+            assert not isinstance(value, (IPv4Interface, IPv6Interface))
+            interfaces = list(self)
+            interfaces[index] = value
+            self._replace(interfaces)
+            return
+        assert isinstance(value, (IPv4Interface, IPv6Interface))
+        index = range(len(self))[index]
+        version, prefixlen, address = self._pack(value)
+        self._versions[index] = version
+        self._prefixlens[index] = prefixlen
+        start = index * _ADDRESS_SIZE
+        self._addresses[start : start + _ADDRESS_SIZE] = address
+
+    def __delitem__(self, index: int | slice) -> None:
+        if isinstance(index, slice):
+            interfaces = list(self)
+            del interfaces[index]
+            self._replace(interfaces)
+            return
+        index = range(len(self))[index]
+        del self._versions[index]
+        del self._prefixlens[index]
+        start = index * _ADDRESS_SIZE
+        del self._addresses[start : start + _ADDRESS_SIZE]
+
+    def insert(self, index: int, value: IPInterface | str) -> None:
+        index = min(max(index + len(self) if index < 0 else index, 0), len(self))
+        version, prefixlen, address = self._pack(value)
+        self._versions.insert(index, version)
+        self._prefixlens.insert(index, prefixlen)
+        start = index * _ADDRESS_SIZE
+        self._addresses[start:start] = address
+
+    def append(self, value: IPInterface | str) -> None:
+        version, prefixlen, address = self._pack(value)
+        self._versions.append(version)
+        self._prefixlens.append(prefixlen)
+        self._addresses += address
+
+    def append_packed(self, version: int, prefixlen: int, address: bytes) -> None:
+        """Append an entry as yielded by iter_packed, without creating objects."""
+        max_prefixlen = _MAX_PREFIXLEN.get(version)
+        if max_prefixlen is None or prefixlen > max_prefixlen:
+            msg = f"Invalid allowed IP entry: IPv{version} /{prefixlen}"
+            raise ValueError(msg)
+        self._versions.append(version)
+        self._prefixlens.append(prefixlen)
+        self._addresses += address.rjust(_ADDRESS_SIZE, b"\0")
+
+    def extend(self, values: Iterable[IPInterface | str]) -> None:
+        for value in values:
+            self.append(value)
+
+    def _replace(self, interfaces: Iterable[IPInterface]) -> None:
+        self._versions.clear()
+        self._prefixlens.clear()
+        self._addresses.clear()
+        self.extend(interfaces)
+
+    def __iter__(self) -> Iterator[IPInterface]:
+        from_bytes = int.from_bytes
+        addresses = self._addresses
+        for index, (version, prefixlen) in enumerate(
+            zip(self._versions, self._prefixlens),
+        ):
+            start = index * _ADDRESS_SIZE
+            address = from_bytes(addresses[start : start + _ADDRESS_SIZE], "big")
+            if version == 4:  # noqa: PLR2004
+                yield IPv4Interface((address, prefixlen))
+            else:
+                yield IPv6Interface((address, prefixlen))
+
+    def iter_packed(self) -> Iterator[tuple[int, int, bytes]]:
+        """Yield (version, prefixlen, packed address) without creating objects."""
+        addresses = self._addresses
+        for index, (version, prefixlen) in enumerate(
+            zip(self._versions, self._prefixlens),
+        ):
+            end = (index + 1) * _ADDRESS_SIZE
+            start = end - (4 if version == 4 else _ADDRESS_SIZE)  # noqa: PLR2004
+            yield version, prefixlen, bytes(addresses[start:end])
+
+    def network_keys(self) -> list[NetworkKey]:
+        """Return the network of each entry as a (version, network, prefixlen).
+
+        Host bits are masked, like the kernel does, so these can be compared
+        with set operations, i.e. to find which allowed IPs changed.
+        """
+        from_bytes = int.from_bytes
+        addresses = self._addresses
+        networks = []
+        for index, (version, prefixlen) in enumerate(
+            zip(self._versions, self._prefixlens),
+        ):
+            start = index * _ADDRESS_SIZE
+            address = from_bytes(addresses[start : start + _ADDRESS_SIZE], "big")
+            hostbits = _MAX_PREFIXLEN[version] - prefixlen
+            networks.append((version, address >> hostbits << hostbits, prefixlen))
+        return networks
+
+    def networks(self) -> set[NetworkKey]:
+        """Return the set of networks, see network_keys."""
+        return set(self.network_keys())
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, PackedAllowedIPs):
+            return (
+                self._versions == other._versions
+                and self._prefixlens == other._prefixlens
+                and self._addresses == other._addresses
+            )
+        if isinstance(other, list):
+            return len(self) == len(other) and list(self) == other
+        return NotImplemented
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def __repr__(self) -> str:
+        return f"PackedAllowedIPs({[str(interface) for interface in self]!r})"
+
+    def __sizeof__(self) -> int:
+        return (
+            object.__sizeof__(self)
+            + self._versions.__sizeof__()
+            + self._prefixlens.__sizeof__()
+            + self._addresses.__sizeof__()
+        )
@@ -0,0 +1,398 @@
+#
+# Pure Python reimplementation of wireguard-tools
+#
+# Copyright (c) 2022-2024 Carnegie Mellon University
+# SPDX-License-Identifier: MIT
+#
+"""Compact binary serialization of WireGuard configurations.
+
+A serialized config or peer starts with the 4 byte magic, a format version
+and a record type byte. Keys are stored as raw 32 byte values, addresses as
+packed bytes with a family tag, and all integers (ports, counts, lengths, ...)
+as unsigned LEB128 varints. Optional values are marked in a leading varint
+with presence flags.
+
+Decoding works on a memoryview of the input, so large buffers are parsed in
+place without slicing copies. The allowed IPs of decoded peers are returned
+as PackedAllowedIPs, no ipaddress objects are created for them.
+"""
+
+from __future__ import annotations
+
+import json
+import struct
+from ipaddress import IPv4Address, IPv4Interface, IPv6Address, IPv6Interface
+from typing import Sequence, Union
+
+from .wireguard_allowedips import PackedAllowedIPs
+from .wireguard_config import WireguardConfig, WireguardPeer
+from .wireguard_key import WireguardKey
+
+BINARY_MAGIC = b"WGPY"
+BINARY_FORMAT_VERSION = 1
+
+_RECORD_CONFIG = ord("C")
+_RECORD_PEER = ord("P")
+
+# presence flags of optional config values
+_CONFIG_PRIVATE_KEY = 1 << 0
+_CONFIG_FWMARK = 1 << 1
+_CONFIG_LISTEN_PORT = 1 << 2
+_CONFIG_MTU = 1 << 3
+_CONFIG_TABLE = 1 << 4
+_CONFIG_SAVECONFIG = 1 << 5
+
+# presence flags of optional peer values
+_PEER_PRESHARED_KEY = 1 << 0
+_PEER_ENDPOINT_IPV4 = 1 << 1
+_PEER_ENDPOINT_IPV6 = 1 << 2
+_PEER_ENDPOINT_HOSTNAME = 1 << 3
+_PEER_ENDPOINT_PORT = 1 << 4
+_PEER_KEEPALIVE = 1 << 5
+_PEER_FRIENDLY_NAME = 1 << 6
+_PEER_FRIENDLY_JSON = 1 << 7
+_PEER_LAST_HANDSHAKE = 1 << 8
+_PEER_RX_BYTES = 1 << 9
+_PEER_TX_BYTES = 1 << 10
+
+_DOUBLE = struct.Struct("<d")
+
+Buffer = Union[bytes, bytearray, memoryview]
+IPAddress = Union[IPv4Address, IPv6Address]
+IPInterface = Union[IPv4Interface, IPv6Interface]
+
+
+class _Writer:
+    def __init__(self, record_type: int) -> None:
+        self.out = bytearray(BINARY_MAGIC)
+        self.out.append(BINARY_FORMAT_VERSION)
+        self.out.append(record_type)
+
+    def varint(self, value: int) -> None:
+        if value < 0:
+            msg = f"Cannot encode negative value {value}"
+            raise ValueError(msg)
+        out = self.out
+        while value > 0x7F:  # noqa: PLR2004
+            out.append(value & 0x7F | 0x80)
+            value >>= 7
+        out.append(value)
+
+    def string(self, value: str) -> None:
+        data = value.encode("utf-8")
+        self.varint(len(data))
+        self.out += data
+
+    def strings(self, values: list[str]) -> None:
+        self.varint(len(values))
+        for value in values:
+            self.string(value)
+
+    def address(self, address: IPAddress) -> None:
+        self.out.append(address.version)
+        self.out += address.packed
+
+    def interfaces(self, interfaces: Sequence[IPInterface]) -> None:
+        self.varint(len(interfaces))
+        out = self.out
+        if isinstance(interfaces, PackedAllowedIPs):
+            for version, prefixlen, address in interfaces.iter_packed():
+                out.append(version)
+                out.append(prefixlen)
+                out += address
+            return
+        for interface in interfaces:
+            out.append(interface.version)
+            out.append(interface.network.prefixlen)
+            out += interface.packed
+
+    def config(self, config: WireguardConfig) -> None:
+        flags = 0
+        if config.private_key is not None:
+            flags |= _CONFIG_PRIVATE_KEY
+        if config.fwmark is not None:
+            flags |= _CONFIG_FWMARK
+        if config.listen_port is not None:
+            flags |= _CONFIG_LISTEN_PORT
+        if config.mtu is not None:
+            flags |= _CONFIG_MTU
+        if config.table is not None:
+            flags |= _CONFIG_TABLE
+        if config.saveconfig:
+            flags |= _CONFIG_SAVECONFIG
+        self.varint(flags)
+
+        if config.private_key is not None:
+            self.out += config.private_key.keydata
+        if config.fwmark is not None:
+            self.varint(config.fwmark)
+        if config.listen_port is not None:
+            self.varint(config.listen_port)
+        if config.mtu is not None:
+            self.varint(config.mtu)
+        if config.table is not None:
+            self.string(config.table)
+
+        self.interfaces(config.addresses)
+        self.varint(len(config.dns_servers))
+        for address in config.dns_servers:
+            self.address(address)
+        self.strings(config.search_domains)
+        self.strings(config.preup)
+        self.strings(config.postup)
+        self.strings(config.predown)
+        self.strings(config.postdown)
+        self.strings(config.included_applications)
+        self.strings(config.excluded_applications)
+
+        self.varint(len(config.peers))
+        for peer in config.peers.values():
+            self.peer(peer)
+
+    def peer(self, peer: WireguardPeer) -> None:
+        endpoint_host = peer.endpoint_host
+        flags = 0
+        if peer.preshared_key is not None:
+            flags |= _PEER_PRESHARED_KEY
+        if isinstance(endpoint_host, IPv4Address):
+            flags |= _PEER_ENDPOINT_IPV4
+        elif isinstance(endpoint_host, IPv6Address):
+            flags |= _PEER_ENDPOINT_IPV6
+        elif endpoint_host is not None:
+            flags |= _PEER_ENDPOINT_HOSTNAME
+        if peer.endpoint_port is not None:
+            flags |= _PEER_ENDPOINT_PORT
+        if peer.persistent_keepalive is not None:
+            flags |= _PEER_KEEPALIVE
+        if peer.friendly_name is not None:
+            flags |= _PEER_FRIENDLY_NAME
+        if peer.friendly_json is not None:
+            flags |= _PEER_FRIENDLY_JSON
+        if peer.last_handshake is not None:
+            flags |= _PEER_LAST_HANDSHAKE
+        if peer.rx_bytes is not None:
+            flags |= _PEER_RX_BYTES
+        if peer.tx_bytes is not None:
+            flags |= _PEER_TX_BYTES
+        self.varint(flags)
+
+        out = self.out
+        out += peer.public_key.keydata
+        if peer.preshared_key is not None:
+            out += peer.preshared_key.keydata
+        if isinstance(endpoint_host, (IPv4Address, IPv6Address)):
+            out += endpoint_host.packed
+        elif endpoint_host is not None:
+            self.string(endpoint_host)
+        if peer.endpoint_port is not None:
+            self.varint(peer.endpoint_port)
+        if peer.persistent_keepalive is not None:
+            self.varint(peer.persistent_keepalive)
+        self.interfaces(peer.allowed_ips)
+        if peer.friendly_name is not None:
+            self.string(peer.friendly_name)
+        if peer.friendly_json is not None:
+            self.string(json.dumps(peer.friendly_json))
+        if peer.last_handshake is not None:
+            out += _DOUBLE.pack(peer.last_handshake)
+        if peer.rx_bytes is not None:
+            self.varint(peer.rx_bytes)
+        if peer.tx_bytes is not None:
+            self.varint(peer.tx_bytes)
+
+
+class _Reader:
+    def __init__(self, data: Buffer, record_type: int) -> None:
+        self.view = memoryview(data)
+        header = len(BINARY_MAGIC) + 2
+        if len(self.view) < header or self.view[: len(BINARY_MAGIC)] != BINARY_MAGIC:
+            msg = "Not a binary WireGuard configuration"
+            raise ValueError(msg)
+        version, found_type = self.view[len(BINARY_MAGIC) : header]
+        if version != BINARY_FORMAT_VERSION:
+            msg = f"Unsupported binary format version {version}"
+            raise ValueError(msg)
+        if found_type != record_type:
+            msg = f"Unexpected binary record type {chr(found_type)!r}"
+            raise ValueError(msg)
+        self.offset = header
+
+    def varint(self) -> int:
+        view, offset = self.view, self.offset
+        result = shift = 0
+        while True:
+            byte = view[offset]
+            offset += 1
+            result |= (byte & 0x7F) << shift
+            if byte < 0x80:  # noqa: PLR2004
+                self.offset = offset
+                return result
+            shift += 7
+
+    def raw(self, length: int) -> memoryview:
+        start = self.offset
+        end = self.offset = start + length
+        if end > len(self.view):
+            raise IndexError(end)
+        return self.view[start:end]
+
+    def key(self) -> bytes:
+        return self.raw(32).tobytes()
+
+    def string(self) -> str:
+        return str(self.raw(self.varint()), "utf-8")
+
+    def strings(self) -> list[str]:
+        return [self.string() for _ in range(self.varint())]
+
+    def address(self) -> IPAddress:
+        version = self.raw(1)[0]
+        if version == 4:  # noqa: PLR2004
+            return IPv4Address(int.from_bytes(self.raw(4), "big"))
+        return IPv6Address(int.from_bytes(self.raw(16), "big"))
+
+    def interfaces(self) -> list[IPInterface]:
+        count = self.varint()
+        # hot path, inlines the reads for each (version, prefixlen, address)
+        view, offset = self.view, self.offset
+        interfaces: list[IPInterface] = []
+        for _ in range(count):
+            version = view[offset]
+            prefixlen = view[offset + 1]
+            if version == 4:  # noqa: PLR2004
+                end = offset + 6
+                address = int.from_bytes(view[offset + 2 : end], "big")
+                interfaces.append(IPv4Interface((address, prefixlen)))
+            else:
+                end = offset + 18
+                address = int.from_bytes(view[offset + 2 : end], "big")
+                interfaces.append(IPv6Interface((address, prefixlen)))
+            offset = end
+        if offset > len(view):
+            raise IndexError(offset)
+        self.offset = offset
+        return interfaces
+
+    def allowed_ips(self) -> PackedAllowedIPs:
+        # same layout as interfaces, but kept packed instead of creating an
+        # ipaddress object for every entry
+        count = self.varint()
+        view, offset = self.view, self.offset
+        allowed_ips = PackedAllowedIPs()
+        append_packed = allowed_ips.append_packed
+        for _ in range(count):
+            version = view[offset]
+            end = offset + (6 if version == 4 else 18)  # noqa: PLR2004
+            if end > len(view):
+                raise IndexError(end)
+            append_packed(version, view[offset + 1], view[offset + 2 : end].tobytes())
+            offset = end
+        self.offset = offset
+        return allowed_ips
+
+    def config(self) -> WireguardConfig:
+        flags = self.varint()
+        config = WireguardConfig()
+        if flags & _CONFIG_PRIVATE_KEY:
+            config.private_key = WireguardKey(self.key())
+        if flags & _CONFIG_FWMARK:
+            config.fwmark = self.varint()
+        if flags & _CONFIG_LISTEN_PORT:
+            config.listen_port = self.varint()
+        if flags & _CONFIG_MTU:
+            config.mtu = self.varint()
+        if flags & _CONFIG_TABLE:
+            config.table = self.string()
+        config.saveconfig = bool(flags & _CONFIG_SAVECONFIG)
+
+        config.addresses = self.interfaces()
+        config.dns_servers = [self.address() for _ in range(self.varint())]
+        config.search_domains = self.strings()
+        config.preup = self.strings()
+        config.postup = self.strings()
+        config.predown = self.strings()
+        config.postdown = self.strings()
+        config.included_applications = self.strings()
+        config.excluded_applications = self.strings()
+
+        for _ in range(self.varint()):
+            config.add_peer(self.peer())
+        return config
+
+    def peer(self) -> WireguardPeer:
+        flags = self.varint()
+        public_key = WireguardKey.intern(self.key())
+        preshared_key = None
+        if flags & _PEER_PRESHARED_KEY:
+            preshared_key = WireguardKey(self.key())
+        endpoint_host: IPAddress | str | None = None
+        if flags & _PEER_ENDPOINT_IPV4:
+            endpoint_host = IPv4Address(int.from_bytes(self.raw(4), "big"))
+        elif flags & _PEER_ENDPOINT_IPV6:
+            endpoint_host = IPv6Address(int.from_bytes(self.raw(16), "big"))
+        elif flags & _PEER_ENDPOINT_HOSTNAME:
+            endpoint_host = self.string()
+        endpoint_port = self.varint() if flags & _PEER_ENDPOINT_PORT else None
+        keepalive = self.varint() if flags & _PEER_KEEPALIVE else None
+        allowed_ips = self.allowed_ips()
+        friendly_name = self.string() if flags & _PEER_FRIENDLY_NAME else None
+        friendly_json = (
+            json.loads(self.string()) if flags & _PEER_FRIENDLY_JSON else None
+        )
+        last_handshake = None
+        if flags & _PEER_LAST_HANDSHAKE:
+            (last_handshake,) = _DOUBLE.unpack(self.raw(_DOUBLE.size))
+        rx_bytes = self.varint() if flags & _PEER_RX_BYTES else None
+        tx_bytes = self.varint() if flags & _PEER_TX_BYTES else None
+        return WireguardPeer.from_trusted(
+            public_key,
+            preshared_key=preshared_key,
+            endpoint_host=endpoint_host,
+            endpoint_port=endpoint_port,
+            persistent_keepalive=keepalive,
+            allowed_ips=allowed_ips,
+            friendly_name=friendly_name,
+            friendly_json=friendly_json,
+            last_handshake=last_handshake,
+            rx_bytes=rx_bytes,
+            tx_bytes=tx_bytes,
+        )
+
+    def done(self) -> None:
+        if self.offset != len(self.view):
+            msg = "Unexpected trailing data after binary record"
+            raise ValueError(msg)
+
+
+def config_to_bytes(config: WireguardConfig) -> bytes:
+    writer = _Writer(_RECORD_CONFIG)
+    writer.config(config)
+    return bytes(writer.out)
+
+
+def config_from_bytes(data: Buffer) -> WireguardConfig:
+    reader = _Reader(data, _RECORD_CONFIG)
+    try:
+        config = reader.config()
+    except IndexError:
+        msg = "Truncated binary WireGuard configuration"
+        raise ValueError(msg) from None
+    reader.done()
+    return config
+
+
+def peer_to_bytes(peer: WireguardPeer) -> bytes:
+    writer = _Writer(_RECORD_PEER)
+    writer.peer(peer)
+    return bytes(writer.out)
+
+
+def peer_from_bytes(data: Buffer) -> WireguardPeer:
+    reader = _Reader(data, _RECORD_PEER)
+    try:
+        peer = reader.peer()
+    except IndexError:
+        msg = "Truncated binary WireGuard peer"
+        raise ValueError(msg) from None
+    reader.done()
+    return peer
@@ -0,0 +1,313 @@
+#
+# Pure Python reimplementation of wireguard-tools
+#
+# Copyright (c) 2022-2024 Carnegie Mellon University
+# SPDX-License-Identifier: MIT
+#
+"""Persistent cache of parsed configuration files.
+
+load_wgconfig keeps a binary snapshot of each parsed configuration in a cache
+directory, and reuses it as long as the path, mtime, size and content hash of
+the configuration file still match. Snapshots contain the private key, so the
+cache directory and snapshots are only accessible by their owner, and cached
+files that anyone else could have modified are ignored.
+"""
+
+from __future__ import annotations
+
+import gc
+import hashlib
+import marshal
+import os
+import struct
+import tempfile
+import threading
+from contextlib import contextmanager, nullcontext, suppress
+from io import StringIO
+from ipaddress import IPv4Address, IPv4Interface, IPv6Address, IPv6Interface
+from pathlib import Path
+from stat import S_ISDIR, S_ISREG
+from typing import Any, BinaryIO, Iterator, Tuple, Union
+
+from .wireguard_config import WireguardConfig, WireguardPeer
+from .wireguard_key import WireguardKey
+
+# bump when the snapshot layout changes, older snapshots are ignored
+CACHE_FORMAT_VERSION = 1
+
+# magic, format version, mtime_ns and size of the config file, sha256 digest
+_HEADER = struct.Struct("<8sHqq32s")
+_MAGIC = b"wgpy\x00snp"
+
+_ADDRESS_TYPES = {4: IPv4Address, 6: IPv6Address}
+_INTERFACE_TYPES = {4: IPv4Interface, 6: IPv6Interface}
+
+PackedAddress = Tuple[int, int]
+PackedInterface = Tuple[int, int, int]
+IPAddress = Union[IPv4Address, IPv6Address]
+IPInterface = Union[IPv4Interface, IPv6Interface]
+
+
+def default_cache_dir() -> Path:
+    """Return the per-user cache directory, following the XDG convention."""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home, "wireguard-tools")
+
+
+def load_wgconfig(
+    path: str | os.PathLike[str],
+    cache_dir: str | os.PathLike[str] | None = None,
+    *,
+    configfile: BinaryIO | None = None,
+    pause_gc: bool = False,
+) -> WireguardConfig:
+    """Parse a configuration file, reusing a cached snapshot when unchanged.
+
+    When the configuration file is already open, pass it as configfile. It is
+    then read and checked through the open file, and path only names the
+    snapshot. Anything but a regular file is parsed without the cache.
+
+    With pause_gc, the garbage collector of the whole process is disabled
+    while a snapshot is rebuilt. This speeds up loading large snapshots, but
+    other threads get no collections during that time either.
+    """
+    if configfile is None:
+        with Path(path).open("rb") as opened:
+            return _load_wgconfig(path, cache_dir, opened, pause_gc=pause_gc)
+    return _load_wgconfig(path, cache_dir, configfile, pause_gc=pause_gc)
+
+
+def _load_wgconfig(
+    path: str | os.PathLike[str],
+    cache_dir: str | os.PathLike[str] | None,
+    configfile: BinaryIO,
+    *,
+    pause_gc: bool,
+) -> WireguardConfig:
+    stat = os.fstat(configfile.fileno())
+    data = configfile.read()
+    if not S_ISREG(stat.st_mode):
+        return WireguardConfig.from_wgconfig(StringIO(data.decode("utf-8")))
+
+    path = Path(path).resolve()
+    cache_dir = default_cache_dir() if cache_dir is None else Path(cache_dir)
+    cache_path = cache_dir / f"{hashlib.sha256(bytes(path)).hexdigest()}.snapshot"
+
+    snapshot = _read_snapshot(cache_path)
+    header = None
+    if snapshot is not None and len(snapshot) >= _HEADER.size:
+        header = _HEADER.unpack_from(snapshot)
+
+    digest = hashlib.sha256(data).digest()
+
+    if snapshot is not None and header == (
+        _MAGIC,
+        CACHE_FORMAT_VERSION,
+        stat.st_mtime_ns,
+        stat.st_size,
+        digest,
+    ):
+        paused = _gc_paused() if pause_gc else nullcontext()
+        with suppress(EOFError, KeyError, TypeError, ValueError), paused:
+            return _load_config(marshal.loads(snapshot[_HEADER.size :]))  # noqa: S302
+
+    config = WireguardConfig.from_wgconfig(StringIO(data.decode("utf-8")))
+
+    header_bytes = _HEADER.pack(
+        _MAGIC,
+        CACHE_FORMAT_VERSION,
+        stat.st_mtime_ns,
+        stat.st_size,
+        digest,
+    )
+    # failing to update the cache should never prevent using the config
+    with suppress(OSError):
+        _write_snapshot(cache_path, header_bytes + marshal.dumps(_dump_config(config)))
+    return config
+
+
+# number of loads that currently pause the garbage collector, and whether it
+# was enabled before the first of them
+_gc_pauses = 0
+_gc_was_enabled = False
+_gc_lock = threading.Lock()
+
+
+@contextmanager
+def _gc_paused() -> Iterator[None]:
+    # rebuilding a snapshot allocates many objects but creates no reference
+    # cycles, repeated garbage collection passes would only slow it down.
+    # Only the last of several nested or concurrent pauses restores the state
+    # the collector had before the first one.
+    global _gc_pauses, _gc_was_enabled  # noqa: PLW0603
+    with _gc_lock:
+        if not _gc_pauses:
+            _gc_was_enabled = gc.isenabled()
+            gc.disable()
+        _gc_pauses += 1
+    try:
+        yield
+    finally:
+        with _gc_lock:
+            _gc_pauses -= 1
+            if not _gc_pauses and _gc_was_enabled:
+                gc.enable()
+
+
+def _is_private(stat: os.stat_result) -> bool:
+    return stat.st_uid == os.getuid() and not stat.st_mode & 0o077
+
+
+def _read_snapshot(cache_path: Path) -> bytes | None:
+    try:
+        fd = os.open(cache_path, os.O_RDONLY | os.O_NOFOLLOW)
+    except OSError:
+        return None
+    with os.fdopen(fd, "rb") as snapshot:
+        stat = os.fstat(fd)
+        if not S_ISREG(stat.st_mode) or not _is_private(stat):
+            return None
+        return snapshot.read()
+
+
+def _write_snapshot(cache_path: Path, snapshot: bytes) -> None:
+    cache_dir = cache_path.parent
+    cache_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+    stat = cache_dir.lstat()
+    if not S_ISDIR(stat.st_mode) or not _is_private(stat):
+        return
+
+    # mkstemp creates the file with 0600 permissions
+    fd, tmpname = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as tmpfile:
+            tmpfile.write(snapshot)
+        Path(tmpname).replace(cache_path)
+    except BaseException:
+        Path(tmpname).unlink()
+        raise
+
+
+def _dump_address(address: IPAddress) -> PackedAddress:
+    return address.version, int(address)
+
+
+def _dump_interface(interface: IPInterface) -> PackedInterface:
+    return interface.version, int(interface), interface.network.prefixlen
+
+
+def _load_address(packed: PackedAddress) -> IPAddress:
+    version, address = packed
+    return _ADDRESS_TYPES[version](address)  # type: ignore[return-value]
+
+
+def _load_interface(packed: PackedInterface) -> IPInterface:
+    version, address, prefixlen = packed
+    return _INTERFACE_TYPES[version]((address, prefixlen))  # type: ignore[return-value]
+
+
+def _dump_peer(peer: WireguardPeer) -> tuple[Any, ...]:
+    endpoint_host = peer.endpoint_host
+    return (
+        peer.public_key.keydata,
+        None if peer.preshared_key is None else peer.preshared_key.keydata,
+        (
+            endpoint_host
+            if endpoint_host is None or isinstance(endpoint_host, str)
+            else _dump_address(endpoint_host)
+        ),
+        peer.endpoint_port,
+        peer.persistent_keepalive,
+        [_dump_interface(interface) for interface in peer.allowed_ips],
+        peer.friendly_name,
+        peer.friendly_json,
+    )
+
+
+def _load_peer(packed: tuple[Any, ...]) -> WireguardPeer:
+    (
+        public_key,
+        preshared_key,
+        endpoint_host,
+        endpoint_port,
+        persistent_keepalive,
+        allowed_ips,
+        friendly_name,
+        friendly_json,
+    ) = packed
+    return WireguardPeer.from_trusted(
+        WireguardKey.intern(public_key),
+        preshared_key=None if preshared_key is None else WireguardKey(preshared_key),
+        endpoint_host=(
+            endpoint_host
+            if endpoint_host is None or isinstance(endpoint_host, str)
+            else _load_address(endpoint_host)
+        ),
+        endpoint_port=endpoint_port,
+        persistent_keepalive=persistent_keepalive,
+        allowed_ips=[_load_interface(interface) for interface in allowed_ips],
+        friendly_name=friendly_name,
+        friendly_json=friendly_json,
+    )
+
+
+def _dump_config(config: WireguardConfig) -> tuple[Any, ...]:
+    return (
+        None if config.private_key is None else config.private_key.keydata,
+        config.fwmark,
+        config.listen_port,
+        [_dump_interface(interface) for interface in config.addresses],
+        [_dump_address(address) for address in config.dns_servers],
+        config.search_domains,
+        config.mtu,
+        config.table,
+        config.preup,
+        config.postup,
+        config.predown,
+        config.postdown,
+        config.saveconfig,
+        config.included_applications,
+        config.excluded_applications,
+        [_dump_peer(peer) for peer in config.peers.values()],
+    )
+
+
+def _load_config(packed: tuple[Any, ...]) -> WireguardConfig:
+    (
+        private_key,
+        fwmark,
+        listen_port,
+        addresses,
+        dns_servers,
+        search_domains,
+        mtu,
+        table,
+        preup,
+        postup,
+        predown,
+        postdown,
+        saveconfig,
+        included_applications,
+        excluded_applications,
+        peers,
+    ) = packed
+    config = WireguardConfig(
+        private_key=private_key,
+        fwmark=fwmark,
+        listen_port=listen_port,
+        addresses=[_load_interface(interface) for interface in addresses],
+        dns_servers=[_load_address(address) for address in dns_servers],
+        search_domains=search_domains,
+        mtu=mtu,
+        table=table,
+        preup=preup,
+        postup=postup,
+        predown=predown,
+        postdown=postdown,
+        saveconfig=saveconfig,
+        included_applications=included_applications,
+        excluded_applications=excluded_applications,
+    )
+    for packed_peer in peers:
+        config.add_peer(_load_peer(packed_peer))
+    return config
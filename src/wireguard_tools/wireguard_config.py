@@ -8,7 +8,6 @@
 from __future__ import annotations
 
 import json
-import re
 from ipaddress import (
     IPv4Address,
     IPv4Interface,
@@ -17,18 +16,48 @@ from ipaddress import (
     ip_address,
     ip_interface,
 )
-from typing import Any, Sequence, TextIO, TypeVar, Union
+from itertools import chain
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Iterable,
+    Iterator,
+    MutableSequence,
+    Sequence,
+    TextIO,
+    TypeVar,
+    Union,
+)
 
 from attrs import asdict, define, field
 from attrs.converters import optional
 from attrs.setters import convert as setters_convert
-from segno import QRCode, make_qr
 
+from .wireguard_allowedips import PackedAllowedIPs
 from .wireguard_key import WireguardKey
 
+if TYPE_CHECKING:
+    from segno import QRCode
+
+    from .wireguard_routing import AllowedIPsConflict, AllowedIPsIndex
+
 SimpleJsonTypes = Union[str, int, float, bool, None]
 T = TypeVar("T")
 
+# amount of text collected by write_wgconfig before writing it out
+WGCONFIG_WRITE_BUFFER_SIZE = 16384
+
+# bypasses the attrs on_setattr converters
+_setattr = object.__setattr__
+
+
+def _wireguard_key(value: str | bytes | WireguardKey) -> WireguardKey:
+    # keys are immutable, so an existing (possibly interned) key can be shared
+    if isinstance(value, WireguardKey):
+        return value
+    return WireguardKey(value)
+
 
 def _ipaddress_or_host(
     host: IPv4Address | IPv6Address | str,
@@ -49,15 +78,85 @@ def _list_of_ipaddress(
 
 def _list_of_ipinterface(
     hosts: Sequence[IPv4Interface | IPv6Interface | str],
-) -> Sequence[IPv4Interface | IPv6Interface]:
+) -> MutableSequence[IPv4Interface | IPv6Interface]:
+    # packed lists are kept as is, they always hold interface objects
+    if isinstance(hosts, PackedAllowedIPs):
+        return hosts
     return [ip_interface(host) for host in hosts]
 
 
+def _split_ip_interfaces(value: str) -> list[IPv4Interface | IPv6Interface]:
+    # pick the address family directly instead of letting ip_interface try both
+    return [
+        IPv6Interface(addr) if ":" in addr else IPv4Interface(addr)
+        for addr in (item.strip() for item in value.split(","))
+    ]
+
+
+def _split_strings(value: str) -> list[str]:
+    return [item.strip() for item in value.split(",")]
+
+
+# config file keys (lowercased) -> (attribute, parser, whether values accumulate)
+_PEER_KEYS: dict[str, tuple[str, Callable[[str], Any], bool]] = {
+    "publickey": ("public_key", WireguardKey.intern, False),
+    "presharedkey": ("preshared_key", WireguardKey, False),
+    "persistentkeepalive": ("persistent_keepalive", int, False),
+    "allowedips": ("allowed_ips", _split_ip_interfaces, True),
+    "# friendly_name": ("friendly_name", str, False),
+    "# friendly_json": ("friendly_json", json.loads, False),
+}
+# streamed peers are not kept around, don't fill the key intern cache with them
+_STREAMING_PEER_KEYS = {
+    **_PEER_KEYS,
+    "publickey": ("public_key", WireguardKey, False),
+}
+_INTERFACE_KEYS: dict[str, tuple[str, Callable[[str], Any], bool]] = {
+    "privatekey": ("private_key", WireguardKey, False),
+    "fwmark": ("fwmark", int, False),
+    "listenport": ("listen_port", int, False),
+    # wg-quick specific extensions
+    "address": ("addresses", _split_ip_interfaces, True),
+    "mtu": ("mtu", int, False),
+    "table": ("table", str, False),
+    "preup": ("preup", lambda value: [value], True),
+    "postup": ("postup", lambda value: [value], True),
+    "predown": ("predown", lambda value: [value], True),
+    "postdown": ("postdown", lambda value: [value], True),
+    "saveconfig": ("saveconfig", lambda value: value == "true", False),
+    # wireguard-android specific extensions
+    "includedapplications": ("included_applications", _split_strings, True),
+    "excludedapplications": ("excluded_applications", _split_strings, True),
+}
+
+
+def _parse_peer_line(
+    conf: dict[str, Any],
+    key: str,
+    value: str,
+    peer_keys: dict[str, tuple[str, Callable[[str], Any], bool]] = _PEER_KEYS,
+) -> None:
+    """Add a key/value from a [Peer] section to the peer's keyword arguments."""
+    if key == "endpoint":
+        host, port = value.rsplit(":", 1)
+        conf["endpoint_host"] = _ipaddress_or_host(host)
+        conf["endpoint_port"] = int(port)
+        return
+    try:
+        attribute, parse, multiple = peer_keys[key]
+    except KeyError:
+        return
+    if multiple:
+        conf.setdefault(attribute, []).extend(parse(value))
+    else:
+        conf[attribute] = parse(value)
+
+
 @define(on_setattr=setters_convert)
 class WireguardPeer:
-    public_key: WireguardKey = field(converter=WireguardKey)
+    public_key: WireguardKey = field(converter=_wireguard_key)
     preshared_key: WireguardKey | None = field(
-        converter=optional(WireguardKey),
+        converter=optional(_wireguard_key),
         default=None,
     )
     endpoint_host: IPv4Address | IPv6Address | str | None = field(
@@ -66,7 +165,7 @@ class WireguardPeer:
     )
     endpoint_port: int | None = field(converter=optional(int), default=None)
     persistent_keepalive: int | None = field(converter=optional(int), default=None)
-    allowed_ips: list[IPv4Interface | IPv6Interface] = field(
+    allowed_ips: MutableSequence[IPv4Interface | IPv6Interface] = field(
         converter=_list_of_ipinterface,
         factory=list,
     )
@@ -83,6 +182,41 @@ class WireguardPeer:
     rx_bytes: int | None = field(converter=optional(int), default=None, eq=False)
     tx_bytes: int | None = field(converter=optional(int), default=None, eq=False)
 
+    @classmethod
+    def from_trusted(
+        cls,
+        public_key: WireguardKey,
+        *,
+        preshared_key: WireguardKey | None = None,
+        endpoint_host: IPv4Address | IPv6Address | str | None = None,
+        endpoint_port: int | None = None,
+        persistent_keepalive: int | None = None,
+        allowed_ips: MutableSequence[IPv4Interface | IPv6Interface] | None = None,
+        friendly_name: str | None = None,
+        friendly_json: dict[str, SimpleJsonTypes] | None = None,
+        last_handshake: float | None = None,
+        rx_bytes: int | None = None,
+        tx_bytes: int | None = None,
+    ) -> WireguardPeer:
+        """Create a peer from values that already have the correct types.
+
+        Skips the attribute converters, meant for values decoded from a device
+        or config file where every value has been parsed already.
+        """
+        peer = cls.__new__(cls)
+        _setattr(peer, "public_key", public_key)
+        _setattr(peer, "preshared_key", preshared_key)
+        _setattr(peer, "endpoint_host", endpoint_host)
+        _setattr(peer, "endpoint_port", endpoint_port)
+        _setattr(peer, "persistent_keepalive", persistent_keepalive)
+        _setattr(peer, "allowed_ips", [] if allowed_ips is None else allowed_ips)
+        _setattr(peer, "friendly_name", friendly_name)
+        _setattr(peer, "friendly_json", friendly_json)
+        _setattr(peer, "last_handshake", last_handshake)
+        _setattr(peer, "rx_bytes", rx_bytes)
+        _setattr(peer, "tx_bytes", tx_bytes)
+        return peer
+
     @classmethod
     def from_dict(cls, config_dict: dict[str, Any]) -> WireguardPeer:
         endpoint = config_dict.pop("endpoint", None)
@@ -96,7 +230,9 @@ class WireguardPeer:
         def _filter(_attr: Any, value: Any) -> bool:
             return value is not None
 
-        def _serializer(_instance: type, _field: Any, value: T) -> T | str:
+        def _serializer(_instance: type, _field: Any, value: T) -> T | str | list[str]:
+            if isinstance(value, PackedAllowedIPs):
+                return [str(addr) for addr in value]
             if isinstance(
                 value,
                 (IPv4Address, IPv4Interface, IPv6Address, IPv6Interface, WireguardKey),
@@ -107,29 +243,24 @@ class WireguardPeer:
         return asdict(self, filter=_filter, value_serializer=_serializer)
 
     @classmethod
-    def from_wgconfig(cls, config: Sequence[tuple[str, str]]) -> WireguardPeer:
+    def from_wgconfig(cls, config: Iterable[tuple[str, str]]) -> WireguardPeer:
         conf: dict[str, Any] = {}
-        for key_, value in config:
-            key = key_.lower()
-            if key == "publickey":
-                conf["public_key"] = WireguardKey(value)
-            elif key == "presharedkey":
-                conf["preshared_key"] = WireguardKey(value)
-            elif key == "endpoint":
-                host, port = value.rsplit(":", 1)
-                conf["endpoint_host"] = host
-                conf["endpoint_port"] = int(port)
-            elif key == "persistentkeepalive":
-                conf["persistent_keepalive"] = int(value)
-            elif key == "allowedips":
-                conf.setdefault("allowed_ips", []).extend(
-                    ip_interface(addr.strip()) for addr in value.split(",")
-                )
-            elif key == "# friendly_name":
-                conf["friendly_name"] = value
-            elif key == "# friendly_json":
-                conf["friendly_json"] = json.loads(value)
-        return cls(**conf)
+        for key, value in config:
+            _parse_peer_line(conf, key.lower(), value)
+        return _peer_from_conf(conf)
+
+    def to_bytes(self) -> bytes:
+        """Serialize the peer to the compact binary format."""
+        from .wireguard_binary import peer_to_bytes
+
+        return peer_to_bytes(self)
+
+    @classmethod
+    def from_bytes(cls, data: bytes | bytearray | memoryview) -> WireguardPeer:
+        """Deserialize a peer from the compact binary format."""
+        from .wireguard_binary import peer_from_bytes
+
+        return peer_from_bytes(data)
 
     def as_wgconfig_snippet(self) -> list[str]:
         conf = ["\n[Peer]"]
@@ -170,10 +301,17 @@ class WireguardPeer:
         return "\n".join(desc)
 
 
+def _peer_from_conf(conf: dict[str, Any]) -> WireguardPeer:
+    if "public_key" not in conf:
+        msg = "[Peer] section without a PublicKey"
+        raise ValueError(msg)
+    return WireguardPeer.from_trusted(**conf)
+
+
 @define(on_setattr=setters_convert)
 class WireguardConfig:
     private_key: WireguardKey | None = field(
-        converter=optional(WireguardKey),
+        converter=optional(_wireguard_key),
         default=None,
         repr=lambda _: "(hidden)",
     )
@@ -203,6 +341,14 @@ class WireguardConfig:
     included_applications: list[str] = field(factory=list)
     excluded_applications: list[str] = field(factory=list)
 
+    # built on first use by allowed_ips_index, then kept up to date
+    _allowed_ips_index: AllowedIPsIndex | None = field(
+        default=None,
+        init=False,
+        eq=False,
+        repr=False,
+    )
+
     @classmethod
     def from_dict(cls, config_dict: dict[str, Any]) -> WireguardConfig:
         config_dict = config_dict.copy()
@@ -221,14 +367,16 @@ class WireguardConfig:
         return config
 
     def asdict(self) -> dict[str, Any]:
-        def _filter(_attr: Any, value: Any) -> bool:
-            return value is not None
+        def _filter(attr: Any, value: Any) -> bool:
+            return attr.init and value is not None
 
         def _serializer(
             _instance: type,
             _field: Any,
             value: T,
-        ) -> list[dict[str, Any]] | T | str:
+        ) -> list[dict[str, Any]] | T | str | list[str]:
+            if isinstance(value, PackedAllowedIPs):
+                return [str(addr) for addr in value]
             if isinstance(value, dict):
                 return list(value.values())
             if isinstance(
@@ -240,76 +388,116 @@ class WireguardConfig:
 
         return asdict(self, filter=_filter, value_serializer=_serializer)
 
+    def to_bytes(self) -> bytes:
+        """Serialize the configuration to the compact binary format."""
+        from .wireguard_binary import config_to_bytes
+
+        return config_to_bytes(self)
+
     @classmethod
-    def from_wgconfig(cls, configfile: TextIO) -> WireguardConfig:
-        text = configfile.read()
-        _pre, *parts = re.split(
-            r"^\[(Interface|Peer)\]$",
-            text,
-            flags=re.IGNORECASE | re.MULTILINE,
-        )
-        sections = [section.lower() for section in parts[0::2]]
-        if sections.count("interface") > 1:
-            msg = "More than one [Interface] section in config file"
-            raise ValueError(msg)
+    def from_bytes(cls, data: bytes | bytearray | memoryview) -> WireguardConfig:
+        """Deserialize a configuration from the compact binary format."""
+        from .wireguard_binary import config_from_bytes
+
+        return config_from_bytes(data)
 
+    @classmethod
+    def from_wgconfig(cls, configfile: TextIO) -> WireguardConfig:
         config = cls()
-        for section, content in zip(sections, parts[1::2]):
-            key_value = [
-                (match.group(1), match.group(3))
-                for match in re.finditer(
-                    r"^((# )?\w+)\s*=\s*(.+)$",
-                    content,
-                    re.MULTILINE,
-                )
-            ]
-            if section == "interface":
-                config._update_from_conf(key_value)
-            else:
-                peer = WireguardPeer.from_wgconfig(key_value)
-                config.add_peer(peer)
+        for peer in config._parse_wgconfig(configfile):
+            config.add_peer(peer)
         return config
 
-    def _update_from_conf(self, key_value: Sequence[tuple[str, str]]) -> None:
-        for key_, value in key_value:
-            key = key_.lower()
-            if key == "privatekey":
-                self.private_key = WireguardKey(value)
-            elif key == "fwmark":
-                self.fwmark = int(value)
-            elif key == "listenport":
-                self.listen_port = int(value)
-            # wg-quick specific extensions
-            elif key == "address":
-                self.addresses.extend(
-                    ip_interface(addr.strip()) for addr in value.split(",")
-                )
-            elif key == "dns":
-                for item in value.split(","):
-                    self._add_dns_entry(item.strip())
-            elif key == "mtu":
-                self.mtu = int(value)
-            elif key == "table":
-                self.table = value
-            elif key == "preup":
-                self.preup.append(value)
-            elif key == "postup":
-                self.postup.append(value)
-            elif key == "predown":
-                self.predown.append(value)
-            elif key == "postdown":
-                self.postdown.append(value)
-            elif key == "saveconfig":
-                self.saveconfig = value == "true"
-            # wireguard-android specific extensions
-            elif key == "includedapplications":
-                self.included_applications.extend(
-                    item.strip() for item in value.split(",")
-                )
-            elif key == "excludedapplications":
-                self.excluded_applications.extend(
-                    item.strip() for item in value.split(",")
-                )
+    @classmethod
+    def iter_wgconfig(
+        cls,
+        configfile: Iterable[str],
+    ) -> Iterator[WireguardConfig | WireguardPeer]:
+        """Parse a config file lazily, without collecting the peers.
+
+        First yields a WireguardConfig with the [Interface] settings and no
+        peers, followed by each WireguardPeer as soon as it has been parsed.
+        When a [Peer] section comes before the [Interface] section, the
+        interface settings are only known at the end of the file and all
+        peers are parsed before the config is yielded.
+        """
+        lines = iter(configfile)
+        head = []
+        header = None
+        for line in lines:
+            head.append(line)
+            header = line.strip().lower()
+            if header in ("[interface]", "[peer]"):
+                break
+
+        config = cls()
+        peers = config._parse_wgconfig(chain(head, lines), _STREAMING_PEER_KEYS)
+        if header == "[peer]":
+            peers = iter(list(peers))
+        first_peer = next(peers, None)
+        yield config
+        if first_peer is not None:
+            yield first_peer
+        yield from peers
+
+    def _parse_wgconfig(
+        self,
+        configfile: Iterable[str],
+        peer_keys: dict[str, tuple[str, Callable[[str], Any], bool]] = _PEER_KEYS,
+    ) -> Iterator[WireguardPeer]:
+        """Parse a config file in a single pass over its lines.
+
+        Settings from the [Interface] section are applied to this config,
+        each [Peer] is yielded as soon as its section ends.
+        """
+        section = None
+        seen_interface = False
+        peer: dict[str, Any] = {}
+        for rawline in configfile:
+            line = rawline.strip()
+            if not line:
+                continue
+
+            if line[0] == "[":
+                header = line.lower()
+                if header not in ("[interface]", "[peer]"):
+                    continue
+                if section == "[peer]":
+                    yield _peer_from_conf(peer)
+                if header == "[interface]":
+                    if seen_interface:
+                        msg = "More than one [Interface] section in config file"
+                        raise ValueError(msg)
+                    seen_interface = True
+                section = header
+                peer = {}
+                continue
+
+            key, sep, value = line.partition("=")
+            value = value.lstrip()
+            if not sep or not value:
+                continue
+            if section == "[peer]":
+                _parse_peer_line(peer, key.rstrip().lower(), value, peer_keys)
+            elif section == "[interface]":
+                self._parse_interface_line(key.rstrip().lower(), value)
+
+        if section == "[peer]":
+            yield _peer_from_conf(peer)
+
+    def _parse_interface_line(self, key: str, value: str) -> None:
+        if key == "dns":
+            for item in value.split(","):
+                self._add_dns_entry(item.strip())
+            return
+        try:
+            attribute, parse, multiple = _INTERFACE_KEYS[key]
+        except KeyError:
+            return
+        if multiple:
+            getattr(self, attribute).extend(parse(value))
+        else:
+            setattr(self, attribute, parse(value))
 
     def _add_dns_entry(self, item: str) -> None:
         try:
@@ -318,12 +506,79 @@ class WireguardConfig:
             self.search_domains.append(item)
 
     def add_peer(self, peer: WireguardPeer) -> None:
+        if self._allowed_ips_index is not None:
+            old_peer = self.peers.get(peer.public_key)
+            if old_peer is not None:
+                self._allowed_ips_index.del_peer(old_peer)
+            self._allowed_ips_index.add_peer(peer)
         self.peers[peer.public_key] = peer
 
     def del_peer(self, peer_key: WireguardKey) -> None:
-        del self.peers[peer_key]
+        peer = self.peers.pop(peer_key)
+        if self._allowed_ips_index is not None:
+            self._allowed_ips_index.del_peer(peer)
+
+    def allowed_ips_index(self) -> AllowedIPsIndex:
+        """Return an index to find the peer that routes a destination address.
+
+        The index is built on first use and updated by add_peer and del_peer,
+        peers that are changed in place have to be added again.
+        """
+        if self._allowed_ips_index is None:
+            from .wireguard_routing import AllowedIPsIndex
+
+            self._allowed_ips_index = AllowedIPsIndex(self.peers.values())
+        return self._allowed_ips_index
+
+    def find_allowed_ips_conflicts(self) -> list[AllowedIPsConflict]:
+        """Find allowed IPs that are duplicated or overlap between peers."""
+        from .wireguard_routing import find_conflicts
+
+        return find_conflicts(self.peers.values())
+
+    def iter_wgconfig_lines(
+        self,
+        peers: Iterable[WireguardPeer] | None = None,
+        *,
+        wgquick_format: bool = False,
+    ) -> Iterator[str]:
+        """Yield the config file as newline terminated chunks of text.
+
+        The interface section and each peer section are yielded as separate
+        chunks. Uses the given peers instead of our own when passed, this can
+        be an iterator (i.e. from iter_wgconfig) to stream peers without
+        holding all of them.
+        """
+        if peers is None:
+            peers = self.peers.values()
+        interface = self._interface_wgconfig(wgquick_format=wgquick_format)
+        yield "\n".join(interface) + "\n"
+        for peer in peers:
+            yield "\n".join(peer.as_wgconfig_snippet()) + "\n"
+
+    def write_wgconfig(
+        self,
+        fileobj: TextIO,
+        peers: Iterable[WireguardPeer] | None = None,
+        *,
+        wgquick_format: bool = False,
+    ) -> None:
+        """Write the config file in blocks of about WGCONFIG_WRITE_BUFFER_SIZE."""
+        buffer: list[str] = []
+        buffered = 0
+        for chunk in self.iter_wgconfig_lines(peers, wgquick_format=wgquick_format):
+            buffer.append(chunk)
+            buffered += len(chunk)
+            if buffered >= WGCONFIG_WRITE_BUFFER_SIZE:
+                fileobj.write("".join(buffer))
+                buffer.clear()
+                buffered = 0
+        fileobj.write("".join(buffer))
 
     def to_wgconfig(self, *, wgquick_format: bool = False) -> str:
+        return "".join(self.iter_wgconfig_lines(wgquick_format=wgquick_format))
+
+    def _interface_wgconfig(self, *, wgquick_format: bool) -> list[str]:
         conf = ["[Interface]"]
         if self.private_key is not None:
             conf.append(f"PrivateKey = {self.private_key}")
@@ -353,10 +608,7 @@ class WireguardConfig:
             if self.excluded_applications:
                 apps = ", ".join(self.excluded_applications)
                 conf.append(f"ExcludedApplications = {apps}")
-        for peer in self.peers.values():
-            conf.extend(peer.as_wgconfig_snippet())
-        conf.append("")
-        return "\n".join(conf)
+        return conf
 
     def to_resolvconf(self, opt_ndots: int | None = None) -> str:
         conf = [f"nameserver {addr}" for addr in self.dns_servers]
@@ -369,6 +621,8 @@ class WireguardConfig:
         return "\n".join(conf)
 
     def to_qrcode(self) -> QRCode:
+        from segno import make_qr
+
         config = self.to_wgconfig(wgquick_format=True)
         return make_qr(config, mode="byte", encoding="utf-8", eci=True)
 
@@ -8,11 +8,21 @@
 from __future__ import annotations
 
 from abc import ABC, abstractmethod
-from contextlib import suppress
-from typing import TYPE_CHECKING, Iterator
+from contextlib import closing, suppress
+from typing import TYPE_CHECKING, AsyncIterator, Dict, Iterator, Union
 
 if TYPE_CHECKING:
+    from types import TracebackType
+
     from .wireguard_config import WireguardConfig
+    from .wireguard_diff import WireguardConfigDiff
+    from .wireguard_stats import WireguardPeerStats
+
+# default per-device timeout and worker count for get_all_configs
+DEVICE_TIMEOUT = 5.0
+DEVICE_MAX_WORKERS = 16
+
+DeviceConfigs = Dict[str, Union["WireguardConfig", Exception]]
 
 
 class WireguardDevice(ABC):
@@ -22,20 +32,58 @@ class WireguardDevice(ABC):
     def close(self) -> None:
         return None
 
+    # limit how long a request may block, when the backend supports it
+    def set_timeout(self, timeout: float | None) -> None:  # noqa: ARG002
+        return None
+
     @abstractmethod
     def get_config(self) -> WireguardConfig: ...
 
     @abstractmethod
-    def set_config(self, config: WireguardConfig) -> None: ...
+    def set_config(self, config: WireguardConfig) -> WireguardConfigDiff | None: ...
+
+    def sync_config(self, config: WireguardConfig) -> WireguardConfigDiff | None:
+        """Only apply the changes between the device and the new configuration.
+
+        Backends that do not replace the whole device configuration in
+        set_config override this.
+        """
+        return self.set_config(config)
+
+    def get_peer_stats(self) -> WireguardPeerStats:
+        """Return only the transfer counters and handshakes of all peers.
+
+        Backends override this to avoid decoding the rest of the peers.
+        """
+        from .wireguard_stats import WireguardPeerStats
+
+        return WireguardPeerStats.from_config(self.get_config())
 
     @classmethod
-    def get(cls, ifname: str) -> WireguardDevice:
-        from .wireguard_netlink import WireguardNetlinkDevice
+    def get(cls, ifname: str, timeout: float | None = None) -> WireguardDevice:
+        """Open a device, timeout is passed on to set_timeout."""
         from .wireguard_uapi import WireguardUAPIDevice
 
         with suppress(FileNotFoundError):
-            return WireguardUAPIDevice(ifname)
-        return WireguardNetlinkDevice(ifname)
+            return WireguardUAPIDevice(ifname, timeout)
+
+        # only load pyroute2 when we actually need to talk to the kernel
+        from .wireguard_netlink import WireguardNetlinkDevice
+
+        device = WireguardNetlinkDevice(ifname)
+        device.set_timeout(timeout)
+        return device
+
+    @classmethod
+    def list_interfaces(cls) -> list[str]:
+        """Names of the devices returned by list(), without opening them."""
+        from .wireguard_netlink import WireguardNetlinkDevice
+        from .wireguard_uapi import WireguardUAPIDevice
+
+        return [
+            *WireguardNetlinkDevice.list_interfaces(),
+            *WireguardUAPIDevice.list_interfaces(),
+        ]
 
     @classmethod
     def list(cls) -> Iterator[WireguardDevice]:
@@ -44,3 +92,103 @@ class WireguardDevice(ABC):
 
         yield from WireguardNetlinkDevice.list()
         yield from WireguardUAPIDevice.list()
+
+    @classmethod
+    def get_all_configs(
+        cls,
+        max_workers: int | None = None,
+        timeout: float | None = DEVICE_TIMEOUT,
+    ) -> DeviceConfigs:
+        """Query the configuration of all devices concurrently.
+
+        Results are returned in the same order as list(). Devices are opened
+        by the worker threads, a device that cannot be opened or queried maps
+        to the exception that was raised instead of a configuration. The
+        timeout limits how long any single connect, send or receive on a
+        device may block, it is not a deadline for the whole query.
+        """
+        interfaces = cls.list_interfaces()
+        if not interfaces:
+            return {}
+
+        def query(interface: str) -> WireguardConfig | Exception:
+            try:
+                with closing(cls.get(interface, timeout)) as device:
+                    return device.get_config()
+            except Exception as exc:  # noqa: BLE001
+                return exc
+
+        workers = max_workers or min(len(interfaces), DEVICE_MAX_WORKERS)
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # map returns the results in the order of the interfaces
+            return dict(zip(interfaces, executor.map(query, interfaces)))
+
+
+class AsyncWireguardDevice(ABC):
+    """Asyncio version of WireguardDevice.
+
+    Devices are created with the async get and list classmethods, which
+    connect to the device without blocking the event loop.
+    """
+
+    def __init__(self, interface: str) -> None:
+        self.interface = interface
+
+    async def close(self) -> None:
+        return None
+
+    async def __aenter__(self) -> AsyncWireguardDevice:  # noqa: PYI034
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        await self.close()
+
+    @abstractmethod
+    async def get_config(self) -> WireguardConfig: ...
+
+    @abstractmethod
+    async def set_config(
+        self,
+        config: WireguardConfig,
+    ) -> WireguardConfigDiff | None: ...
+
+    async def sync_config(
+        self,
+        config: WireguardConfig,
+    ) -> WireguardConfigDiff | None:
+        """Only apply the changes between the device and the new configuration."""
+        return await self.set_config(config)
+
+    async def get_peer_stats(self) -> WireguardPeerStats:
+        """Return only the transfer counters and handshakes of all peers."""
+        from .wireguard_stats import WireguardPeerStats
+
+        return WireguardPeerStats.from_config(await self.get_config())
+
+    @classmethod
+    async def get(cls, ifname: str) -> AsyncWireguardDevice:
+        from .wireguard_uapi import AsyncWireguardUAPIDevice
+
+        with suppress(FileNotFoundError):
+            return await AsyncWireguardUAPIDevice.connect(ifname)
+
+        from .wireguard_netlink import AsyncWireguardNetlinkDevice
+
+        return await AsyncWireguardNetlinkDevice.connect(ifname)
+
+    @classmethod
+    async def list(cls) -> AsyncIterator[AsyncWireguardDevice]:
+        from .wireguard_netlink import AsyncWireguardNetlinkDevice
+        from .wireguard_uapi import AsyncWireguardUAPIDevice
+
+        async for netlink_device in AsyncWireguardNetlinkDevice.list():
+            yield netlink_device
+        async for uapi_device in AsyncWireguardUAPIDevice.list():
+            yield uapi_device
@@ -0,0 +1,228 @@
+#
+# Pure Python reimplementation of wireguard-tools
+#
+# Copyright (c) 2022-2024 Carnegie Mellon University
+# SPDX-License-Identifier: MIT
+#
+"""Compute the minimal set of changes between two WireGuard configurations.
+
+The resulting WireguardConfigDiff only contains the device settings and peers
+that actually differ, and for each changed peer only the fields that changed,
+which allows device backends to apply a new configuration without touching
+peers that are already up to date.
+"""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Iterable, Sequence
+
+from attrs import define, field
+
+from .wireguard_allowedips import PackedAllowedIPs
+from .wireguard_key import WireguardKey
+
+if TYPE_CHECKING:
+    from ipaddress import (
+        IPv4Address,
+        IPv4Interface,
+        IPv4Network,
+        IPv6Address,
+        IPv6Interface,
+        IPv6Network,
+    )
+
+    from .wireguard_config import WireguardConfig, WireguardPeer
+
+# An all-zero preshared key is how the kernel and UAPI clear a preshared key
+ZERO_KEY = WireguardKey(bytes(32))
+
+
+@define
+class WireguardPeerDelta:
+    """Changes to apply to a single peer.
+
+    Fields that are None are left unchanged on the device. For changed peers
+    allowed_ips only lists the addresses to add, unless replace_allowed_ips is
+    set in which case it is the complete new list.
+    """
+
+    public_key: WireguardKey
+    remove: bool = False
+    update_only: bool = False
+    preshared_key: WireguardKey | None = None
+    endpoint_host: IPv4Address | IPv6Address | str | None = None
+    endpoint_port: int | None = None
+    persistent_keepalive: int | None = None
+    replace_allowed_ips: bool = False
+    allowed_ips: list[IPv4Interface | IPv6Interface] = field(factory=list)
+
+    @property
+    def added(self) -> bool:
+        return not self.remove and not self.update_only
+
+
+@define
+class WireguardConfigDiff:
+    """Summary of the changes needed to turn one configuration into another."""
+
+    private_key: WireguardKey | None = None
+    listen_port: int | None = None
+    fwmark: int | None = None
+    peers: list[WireguardPeerDelta] = field(factory=list)
+
+    @property
+    def added(self) -> list[WireguardPeerDelta]:
+        return [delta for delta in self.peers if delta.added]
+
+    @property
+    def removed(self) -> list[WireguardPeerDelta]:
+        return [delta for delta in self.peers if delta.remove]
+
+    @property
+    def changed(self) -> list[WireguardPeerDelta]:
+        return [delta for delta in self.peers if delta.update_only]
+
+    @property
+    def device_changed(self) -> bool:
+        return (
+            self.private_key is not None
+            or self.listen_port is not None
+            or self.fwmark is not None
+        )
+
+    def __bool__(self) -> bool:
+        return self.device_changed or bool(self.peers)
+
+    def __str__(self) -> str:
+        added = removed = changed = 0
+        for delta in self.peers:
+            if delta.remove:
+                removed += 1
+            elif delta.update_only:
+                changed += 1
+            else:
+                added += 1
+        device = "device updated" if self.device_changed else "device unchanged"
+        return (
+            f"{device}, {added} peers added, {removed} peers removed, "
+            f"{changed} peers changed"
+        )
+
+
+def _networks(
+    allowed_ips: Iterable[IPv4Interface | IPv6Interface],
+) -> set[IPv4Network | IPv6Network]:
+    # the kernel masks host bits, so compare the networks and not the addresses
+    return {addr.network for addr in allowed_ips}
+
+
+def _allowed_ips_delta(
+    current: Sequence[IPv4Interface | IPv6Interface],
+    new: Sequence[IPv4Interface | IPv6Interface],
+) -> tuple[bool, list[IPv4Interface | IPv6Interface]] | None:
+    """Compare allowed ips, returns (replace, allowed ips to send) or None."""
+    if isinstance(current, PackedAllowedIPs) and isinstance(new, PackedAllowedIPs):
+        # compare the packed columns, only the entries that end up in the
+        # delta are turned into ipaddress objects
+        current_keys = current.networks()
+        new_keys = new.network_keys()
+        new_key_set = set(new_keys)
+        if current_keys == new_key_set:
+            return None
+        if current_keys.issubset(new_key_set):
+            return False, [
+                new[index]
+                for index, key in enumerate(new_keys)
+                if key not in current_keys
+            ]
+        return True, list(new)
+
+    current_networks = _networks(current)
+    new_networks = _networks(new)
+    if current_networks == new_networks:
+        return None
+    if current_networks.issubset(new_networks):
+        # only additions, no need to replace the existing allowed ips
+        return False, [addr for addr in new if addr.network not in current_networks]
+    return True, list(new)
+
+
+def diff_peer(
+    current: WireguardPeer,
+    new: WireguardPeer,
+) -> WireguardPeerDelta | None:
+    """Return the changes that turn the current peer into the new one.
+
+    Only compares attributes that are stored on the device, so friendly tags
+    and statistics are ignored. Returns None if there is nothing to change.
+    """
+    delta = WireguardPeerDelta(public_key=new.public_key, update_only=True)
+    changed = False
+
+    current_psk = current.preshared_key or None
+    new_psk = new.preshared_key or None
+    if current_psk != new_psk:
+        delta.preshared_key = new_psk if new_psk is not None else ZERO_KEY
+        changed = True
+
+    if new.endpoint_host is not None and (
+        current.endpoint_host != new.endpoint_host
+        or current.endpoint_port != new.endpoint_port
+    ):
+        delta.endpoint_host = new.endpoint_host
+        delta.endpoint_port = new.endpoint_port
+        changed = True
+
+    if (current.persistent_keepalive or 0) != (new.persistent_keepalive or 0):
+        delta.persistent_keepalive = new.persistent_keepalive or 0
+        changed = True
+
+    allowed_ips = _allowed_ips_delta(current.allowed_ips, new.allowed_ips)
+    if allowed_ips is not None:
+        delta.replace_allowed_ips, delta.allowed_ips = allowed_ips
+        changed = True
+
+    return delta if changed else None
+
+
+def _peer_added(peer: WireguardPeer) -> WireguardPeerDelta:
+    return WireguardPeerDelta(
+        public_key=peer.public_key,
+        preshared_key=peer.preshared_key or None,
+        endpoint_host=peer.endpoint_host,
+        endpoint_port=peer.endpoint_port if peer.endpoint_host is not None else None,
+        persistent_keepalive=peer.persistent_keepalive or None,
+        allowed_ips=list(peer.allowed_ips),
+    )
+
+
+def diff_config(current: WireguardConfig, new: WireguardConfig) -> WireguardConfigDiff:
+    """Compute the minimal set of changes from the current to the new config.
+
+    Device settings that are not set (None) in the new configuration are left
+    unchanged. Peers are removed first, followed by changed and new peers.
+    """
+    diff = WireguardConfigDiff()
+
+    if new.private_key is not None and new.private_key != current.private_key:
+        diff.private_key = new.private_key
+    if new.listen_port is not None and new.listen_port != current.listen_port:
+        diff.listen_port = new.listen_port
+    if new.fwmark is not None and new.fwmark != (current.fwmark or 0):
+        diff.fwmark = new.fwmark
+
+    diff.peers.extend(
+        WireguardPeerDelta(public_key=key, remove=True)
+        for key in current.peers
+        if key not in new.peers
+    )
+
+    for key, peer in new.peers.items():
+        current_peer = current.peers.get(key)
+        if current_peer is None:
+            diff.peers.append(_peer_added(peer))
+        else:
+            delta = diff_peer(current_peer, peer)
+            if delta is not None:
+                diff.peers.append(delta)
+    return diff
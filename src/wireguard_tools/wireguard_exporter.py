@@ -0,0 +1,308 @@
+#
+# Pure Python reimplementation of wireguard-tools
+#
+# Copyright (c) 2022-2024 Carnegie Mellon University
+# SPDX-License-Identifier: MIT
+#
+"""Prometheus exporter for the peer statistics of WireGuard devices.
+
+Devices are polled on a schedule with get_peer_stats and the exposition text
+is rendered once per poll, scrapes are answered from that cached text. The
+metric lines of each peer are kept between polls and only the peers whose
+counters or handshake changed are rendered again.
+
+The metric names and friendly_name/friendly_json labels match those of
+prometheus-wireguard-exporter. wireguard_device_up and
+wireguard_poll_errors_total show when the exported values are stale, the
+peers of a device that could not be polled are left out.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import re
+import threading
+from base64 import standard_b64encode
+from contextlib import closing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import TYPE_CHECKING, Any, Iterator, Sequence, Tuple
+
+from .wireguard_device import DEVICE_TIMEOUT, WireguardDevice
+from .wireguard_key import WireguardKey
+
+if TYPE_CHECKING:
+    from .wireguard_config import WireguardConfig
+    from .wireguard_stats import WireguardPeerStats
+
+# default port of prometheus-wireguard-exporter
+EXPORTER_PORT = 9586
+EXPORTER_INTERVAL = 5.0
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# (name, type, help) of the exported metric families
+METRICS = (
+    ("wireguard_sent_bytes_total", "counter", "Bytes sent to the peer"),
+    ("wireguard_received_bytes_total", "counter", "Bytes received from the peer"),
+    (
+        "wireguard_latest_handshake_seconds",
+        "gauge",
+        "UNIX timestamp seconds of the last handshake",
+    ),
+)
+
+# (name, type, help) of the metric families about the exporter itself
+STATUS_METRICS = (
+    (
+        "wireguard_device_up",
+        "gauge",
+        "Whether the last poll of the interface succeeded",
+    ),
+    (
+        "wireguard_poll_errors_total",
+        "counter",
+        "Polls that failed before all interfaces were collected",
+    ),
+)
+
+# (sent bytes, received bytes, last handshake)
+PeerValues = Tuple[int, int, float]
+SeriesKey = Tuple[str, bytes]
+
+_KEY_SIZE = 32
+_BUILTIN_LABELS = ("interface", "public_key", "friendly_name")
+_INVALID_LABEL_CHARS = re.compile(r"[^a-zA-Z0-9_]")
+
+
+logger = logging.getLogger(__name__)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_name(name: str) -> str | None:
+    """Turn a friendly_json key into a valid label name, None to skip it."""
+    label = _INVALID_LABEL_CHARS.sub("_", name)
+    # label names starting with __ are reserved for Prometheus internal use
+    if not label or label.startswith("__"):
+        return None
+    # and label names cannot start with a digit
+    if label[0].isdigit():
+        label = f"_{label}"
+    return label
+
+
+class _PeerSeries:
+    """Label set and rendered metric lines of a single peer."""
+
+    __slots__ = ("labels", "lines", "values")
+
+    def __init__(self, labels: str) -> None:
+        self.labels = labels
+        self.values: PeerValues | None = None
+        self.lines: tuple[str, ...] = ()
+
+    def update(self, values: PeerValues) -> None:
+        self.values = values
+        self.lines = tuple(
+            f"{name}{{{self.labels}}} {value}\n"
+            for (name, _, _), value in zip(METRICS, values)
+        )
+
+
+class WireguardExporter:
+    """Collect peer statistics and render them in the Prometheus text format.
+
+    Without interfaces all devices are exported. configs maps interface names
+    to their configuration, which is only used for the friendly labels.
+    """
+
+    def __init__(
+        self,
+        interfaces: Sequence[str] = (),
+        configs: dict[str, WireguardConfig] | None = None,
+        timeout: float | None = DEVICE_TIMEOUT,
+    ) -> None:
+        self.interfaces = interfaces
+        self.configs = configs or {}
+        self.timeout = timeout
+        # devices that failed during the last poll
+        self.errors: dict[str, Exception] = {}
+        # polls that raised instead of returning
+        self.poll_errors = 0
+        self._series: dict[SeriesKey, _PeerSeries] = {}
+        self._status: tuple[str, ...] = ()
+        self._text = self._render()
+
+    def _collect(self) -> Iterator[tuple[str, WireguardPeerStats | None]]:
+        """Yield the statistics of each interface, None when it failed."""
+        for interface in self.interfaces or WireguardDevice.list_interfaces():
+            yield interface, self._get_peer_stats(interface)
+
+    def _get_peer_stats(self, interface: str) -> WireguardPeerStats | None:
+        # a stale socket, a netlink error or an unparsable response only
+        # affects this interface
+        try:
+            with closing(WireguardDevice.get(interface, self.timeout)) as device:
+                return device.get_peer_stats()
+        except Exception as exc:  # noqa: BLE001
+            self.errors[interface] = exc
+            return None
+
+    def _labels(self, interface: str, keydata: bytes) -> str:
+        public_key = standard_b64encode(keydata).decode("utf-8")
+        labels = [f'interface="{_escape(interface)}"', f'public_key="{public_key}"']
+
+        config = self.configs.get(interface)
+        peer = config.peers.get(WireguardKey(keydata)) if config else None
+        if peer is not None and peer.friendly_name is not None:
+            labels.append(f'friendly_name="{_escape(peer.friendly_name)}"')
+        if peer is not None and peer.friendly_json is not None:
+            # a repeated label name makes the whole exposition invalid
+            seen = set(_BUILTIN_LABELS)
+            for name, value in peer.friendly_json.items():
+                label = _label_name(name)
+                if label is None or label in seen:
+                    continue
+                seen.add(label)
+                text = value if isinstance(value, str) else json.dumps(value)
+                labels.append(f'{label}="{_escape(text)}"')
+        return ",".join(labels)
+
+    def poll(self) -> int:
+        """Poll the devices and update the cached exposition text.
+
+        Returns the number of peers that were rendered again. When listing
+        the interfaces fails, the error is counted in poll_errors and raised.
+        """
+        try:
+            return self._poll()
+        except Exception:
+            self.poll_errors += 1
+            self._text = self._render()
+            raise
+
+    def _poll(self) -> int:
+        self.errors = {}
+        series = self._series
+        seen: set[SeriesKey] = set()
+        rendered = 0
+        status = []
+
+        for interface, stats in self._collect():
+            status.append(
+                f'wireguard_device_up{{interface="{_escape(interface)}"}} '
+                f"{0 if stats is None else 1}\n",
+            )
+            if stats is None:
+                continue
+            public_keys = stats.public_keys
+            for index, values in enumerate(
+                zip(stats.tx_bytes, stats.rx_bytes, stats.last_handshake),
+            ):
+                start = index * _KEY_SIZE
+                key = (interface, bytes(public_keys[start : start + _KEY_SIZE]))
+                seen.add(key)
+
+                peer_series = series.get(key)
+                if peer_series is None:
+                    peer_series = series[key] = _PeerSeries(
+                        self._labels(interface, key[1]),
+                    )
+                if peer_series.values != values:
+                    peer_series.update(values)
+                    rendered += 1
+
+        removed = series.keys() - seen
+        for key in removed:
+            del series[key]
+
+        if rendered or removed or tuple(status) != self._status:
+            self._status = tuple(status)
+            self._text = self._render()
+        return rendered
+
+    def _render(self) -> bytes:
+        parts = []
+        for family, (name, metric_type, description) in enumerate(METRICS):
+            parts.append(f"# HELP {name} {description}\n# TYPE {name} {metric_type}\n")
+            parts.extend(series.lines[family] for series in self._series.values())
+        (up, up_type, up_help), (errors, errors_type, errors_help) = STATUS_METRICS
+        parts.append(f"# HELP {up} {up_help}\n# TYPE {up} {up_type}\n")
+        parts.extend(self._status)
+        parts.append(f"# HELP {errors} {errors_help}\n# TYPE {errors} {errors_type}\n")
+        parts.append(f"{errors} {self.poll_errors}\n")
+        return "".join(parts).encode("utf-8")
+
+    def metrics(self) -> bytes:
+        """Return the exposition text rendered by the last poll."""
+        return self._text
+
+    def make_server(
+        self,
+        address: str = "",
+        port: int = EXPORTER_PORT,
+    ) -> _MetricsServer:
+        """Create an HTTP server that answers /metrics from the cached text."""
+        return _MetricsServer((address, port), self)
+
+    def serve(
+        self,
+        address: str = "",
+        port: int = EXPORTER_PORT,
+        interval: float = EXPORTER_INTERVAL,
+    ) -> None:
+        """Poll every interval seconds and serve /metrics until interrupted.
+
+        A failed poll is logged and the next one is attempted on schedule.
+        """
+        stop = threading.Event()
+
+        def poll() -> None:
+            try:
+                self.poll()
+            except Exception:
+                logger.exception("Polling the WireGuard interfaces failed")
+
+        def poller() -> None:
+            while not stop.wait(interval):
+                poll()
+
+        poll()
+
+        thread = threading.Thread(target=poller, daemon=True)
+        with self.make_server(address, port) as server:
+            thread.start()
+            try:
+                server.serve_forever()
+            finally:
+                stop.set()
+                thread.join()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        assert isinstance(self.server, _MetricsServer)
+        if self.path.partition("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.exporter.metrics()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # no log line for every scrape
+    def log_message(self, format: str, *args: Any) -> None:  # noqa: A002, ARG002
+        return None
+
+
+class _MetricsServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], exporter: WireguardExporter) -> None:
+        self.exporter = exporter
+        super().__init__(address, _MetricsHandler)
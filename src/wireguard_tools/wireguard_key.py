@@ -8,20 +8,138 @@
 
 The constructor will parse from various base64 and hex encodings. There are
 also class methods to generate new private keys and derive public keys.
+
+The string encodings of a key are computed on first use and cached. Public
+keys that are seen repeatedly can be shared through WireguardKey.intern.
 """
 
 from __future__ import annotations
 
+import os
 from base64 import standard_b64encode, urlsafe_b64decode, urlsafe_b64encode
+from functools import lru_cache
 from secrets import token_bytes
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, Sequence
 
 from attrs import define, field
 
 from .curve25519 import RAW_KEY_LENGTH, X25519PrivateKey
 
+if TYPE_CHECKING:
+    from concurrent.futures import Executor, ProcessPoolExecutor
+
 # Length of a wireguard key when encoded as a hexadecimal string
 HEX_KEY_LENGTH = 64
 
+# Maximum number of keys kept alive by WireguardKey.intern
+KEY_INTERN_CACHE_SIZE = 65536
+
+# Smallest batch of keys for which public_key_executor starts a process
+# pool, depending on whether we are using the (slow) pure Python X25519
+PARALLEL_DERIVE_MIN_KEYS = 64
+PARALLEL_DERIVE_MIN_KEYS_FAST = 16384
+
+# bypasses the frozen attrs class to fill in cached values
+_setattr = object.__setattr__
+
+
+def _pure_public_key(private_bytes: bytes) -> bytes:
+    return X25519PrivateKey.from_private_bytes(private_bytes).public_key()
+
+
+@lru_cache(maxsize=None)
+def _public_key_function() -> Callable[[bytes], bytes]:
+    """Return the fastest available function to derive X25519 public keys.
+
+    Uses the X25519 implementation from the cryptography package when it is
+    installed, and falls back to the pure Python implementation otherwise.
+    """
+    try:
+        from cryptography.hazmat.primitives.asymmetric import x25519
+        from cryptography.hazmat.primitives.serialization import (
+            Encoding,
+            PublicFormat,
+        )
+    except ImportError:
+        return _pure_public_key
+
+    def _public_key(private_bytes: bytes) -> bytes:
+        private_key = x25519.X25519PrivateKey.from_private_bytes(private_bytes)
+        return private_key.public_key().public_bytes(Encoding.Raw, PublicFormat.Raw)
+
+    return _public_key
+
+
+def _derive_public_bytes(private_bytes: bytes) -> bytes:
+    # module level function so it can be pickled for a process pool
+    return _public_key_function()(private_bytes)
+
+
+def derive_public_keys(
+    private_keys: Iterable[WireguardKey],
+    executor: Executor | None = None,
+    chunksize: int = 64,
+) -> Iterator[WireguardKey]:
+    """Derive public keys for a batch of private keys, in order.
+
+    The X25519 implementation is only selected once for the whole batch. When
+    an executor (i.e. a ProcessPoolExecutor) is passed, the derivations are
+    spread over its workers in chunks of chunksize keys.
+    """
+    private_bytes = (private_key.keydata for private_key in private_keys)
+    if executor is None:
+        public_key = _public_key_function()
+        public_bytes: Iterable[bytes] = map(public_key, private_bytes)
+    else:
+        public_bytes = executor.map(
+            _derive_public_bytes,
+            private_bytes,
+            chunksize=chunksize,
+        )
+    for keydata in public_bytes:
+        yield WireguardKey(keydata)
+
+
+def public_key_executor(
+    nkeys: int,
+    max_workers: int | None = None,
+) -> ProcessPoolExecutor | None:
+    """Start a process pool to derive the public keys of nkeys private keys.
+
+    Returns None when deriving them serially is faster, because starting a
+    process pool costs more than it saves for small batches. The threshold is
+    much higher when the fast X25519 implementation from the cryptography
+    package is available.
+    """
+    workers = max_workers or os.cpu_count() or 1
+    min_keys = (
+        PARALLEL_DERIVE_MIN_KEYS
+        if _public_key_function() is _pure_public_key
+        else PARALLEL_DERIVE_MIN_KEYS_FAST
+    )
+    if workers == 1 or nkeys < min_keys:
+        return None
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    return ProcessPoolExecutor(max_workers=workers)
+
+
+def derive_public_keys_parallel(
+    private_keys: Sequence[WireguardKey],
+    max_workers: int | None = None,
+) -> list[WireguardKey]:
+    """Derive public keys for a batch of private keys using all cores."""
+    executor = public_key_executor(len(private_keys), max_workers)
+    if executor is None:
+        return list(derive_public_keys(private_keys))
+
+    # a few chunks per worker to balance the load
+    workers = max_workers or os.cpu_count() or 1
+    chunksize = max(1, len(private_keys) // (workers * 4))
+    with executor:
+        return list(derive_public_keys(private_keys, executor, chunksize))
+
 
 def convert_wireguard_key(value: str | bytes | WireguardKey) -> bytes:
     """Decode a wireguard key to its byte string form.
@@ -46,12 +164,27 @@ def convert_wireguard_key(value: str | bytes | WireguardKey) -> bytes:
     return raw_key
 
 
-@define(frozen=True)
+@define(frozen=True, cache_hash=True)
 class WireguardKey:
     """Representation of a WireGuard key."""
 
     keydata: bytes = field(converter=convert_wireguard_key)
 
+    # lazily computed encodings
+    _base64: str | None = field(init=False, default=None, eq=False, repr=False)
+    _urlsafe: str | None = field(init=False, default=None, eq=False, repr=False)
+    _hex: str | None = field(init=False, default=None, eq=False, repr=False)
+
+    @classmethod
+    def intern(cls, value: str | bytes | WireguardKey) -> WireguardKey:
+        """Return a shared instance for the key.
+
+        Equal keys parsed from different sources become the same object, and
+        their cached encodings and hash are reused. The cache is bounded by
+        KEY_INTERN_CACHE_SIZE, only use this for public keys.
+        """
+        return _intern_key(convert_wireguard_key(value))
+
     @classmethod
     def generate(cls) -> WireguardKey:
         """Generate a new private key."""
@@ -60,9 +193,20 @@ class WireguardKey:
         private_bytes = X25519PrivateKey.from_private_bytes(random_data).private_bytes()
         return cls(private_bytes)
 
+    @classmethod
+    def generate_many(cls, count: int) -> list[WireguardKey]:
+        """Generate a batch of new private keys."""
+        random_data = token_bytes(RAW_KEY_LENGTH * count)
+        keys = []
+        for offset in range(0, len(random_data), RAW_KEY_LENGTH):
+            data = random_data[offset : offset + RAW_KEY_LENGTH]
+            private_bytes = X25519PrivateKey.from_private_bytes(data).private_bytes()
+            keys.append(cls(private_bytes))
+        return keys
+
     def public_key(self) -> WireguardKey:
         """Derive public key from private key."""
-        public_bytes = X25519PrivateKey.from_private_bytes(self.keydata).public_key()
+        public_bytes = _public_key_function()(self.keydata)
         return WireguardKey(public_bytes)
 
     def __bool__(self) -> bool:
@@ -73,14 +217,31 @@ class WireguardKey:
 
     def __str__(self) -> str:
         """Return a base64 encoded representation of the key."""
-        return standard_b64encode(self.keydata).decode("utf-8")
+        encoded = self._base64
+        if encoded is None:
+            encoded = standard_b64encode(self.keydata).decode("utf-8")
+            _setattr(self, "_base64", encoded)
+        return encoded
 
     @property
     def urlsafe(self) -> str:
         """Return a urlsafe base64 encoded representation of the key."""
-        return urlsafe_b64encode(self.keydata).decode("utf-8").rstrip("=")
+        encoded = self._urlsafe
+        if encoded is None:
+            encoded = urlsafe_b64encode(self.keydata).decode("utf-8").rstrip("=")
+            _setattr(self, "_urlsafe", encoded)
+        return encoded
 
     @property
     def hex(self) -> str:
         """Return a hexadecimal encoded representation of the key."""
-        return self.keydata.hex()
+        encoded = self._hex
+        if encoded is None:
+            encoded = self.keydata.hex()
+            _setattr(self, "_hex", encoded)
+        return encoded
+
+
+@lru_cache(maxsize=KEY_INTERN_CACHE_SIZE)
+def _intern_key(keydata: bytes) -> WireguardKey:
+    return WireguardKey(keydata)
@@ -7,122 +7,494 @@
 
 from __future__ import annotations
 
+import asyncio
+import threading
+import weakref
+from binascii import a2b_base64
 from collections import defaultdict
-from typing import Any, Iterator
+from ipaddress import IPv4Interface, IPv6Interface, ip_address, ip_interface
+from socket import AF_INET, AF_INET6
+from typing import Any, AsyncIterator, Iterator
 
 import pyroute2
+from attrs import evolve
+from pyroute2.netlink import NLM_F_ACK, NLM_F_REQUEST
+from pyroute2.netlink.generic.wireguard import (
+    WG_CMD_SET_DEVICE,
+    WG_GENL_VERSION,
+    WGPEER_F_REMOVE_ME,
+    WGPEER_F_REPLACE_ALLOWEDIPS,
+    WGPEER_F_UPDATE_ONLY,
+    wgmsg,
+)
 
 from .wireguard_config import WireguardConfig, WireguardPeer
-from .wireguard_device import WireguardDevice
+from .wireguard_device import AsyncWireguardDevice, WireguardDevice
+from .wireguard_diff import WireguardConfigDiff, WireguardPeerDelta, diff_config
 from .wireguard_key import WireguardKey
+from .wireguard_stats import WireguardPeerStats
 
+# Nested netlink attributes have a 16-bit length field, all peers in a message
+# are nested in a single WGDEVICE_A_PEERS attribute.
+NETLINK_MAX_MESSAGE_SIZE = 0xFFFF
 
-class WireguardNetlinkDevice(WireguardDevice):
-    def __init__(self, interface: str) -> None:
-        super().__init__(interface)
+# netlink header + generic netlink header
+_NLMSG_HEADER_SIZE = 16 + 4
+
+
+def _nla_size(payload: int) -> int:
+    """Size of an aligned netlink attribute with the given payload length."""
+    return 4 + ((payload + 3) & ~3)
+
+
+def _msg_size(interface: str, diff: WireguardConfigDiff | None = None) -> int:
+    """Size of a WG_CMD_SET_DEVICE message without any peers."""
+    size = _NLMSG_HEADER_SIZE + _nla_size(len(interface) + 1) + _nla_size(0)
+    if diff is not None:
+        if diff.private_key is not None:
+            size += _nla_size(32)
+        if diff.listen_port is not None:
+            size += _nla_size(2)
+        if diff.fwmark is not None:
+            size += _nla_size(4)
+    return size
+
+
+def _peer_size(delta: WireguardPeerDelta) -> int:
+    """Size of the encoded WGDEVICE_A_PEERS entry for a peer."""
+    size = _nla_size(0) + _nla_size(32) + _nla_size(4)
+    if delta.remove:
+        return size
+    if delta.preshared_key is not None:
+        size += _nla_size(32)
+    if delta.endpoint_host is not None and delta.endpoint_port is not None:
+        # sockaddr_in or sockaddr_in6
+        size += _nla_size(28 if ":" in str(delta.endpoint_host) else 16)
+    if delta.persistent_keepalive is not None:
+        size += _nla_size(2)
+    if delta.allowed_ips or delta.replace_allowed_ips:
+        size += _nla_size(0)
+        size += sum(_allowed_ip_size(addr) for addr in delta.allowed_ips)
+    return size
+
+
+def _allowed_ip_size(addr: IPv4Interface | IPv6Interface) -> int:
+    """Size of the encoded WGPEER_A_ALLOWEDIPS entry for an address."""
+    return _nla_size(_nla_size(2) + _nla_size(len(addr.ip.packed)) + _nla_size(1))
+
+
+def _split_peer(
+    delta: WireguardPeerDelta,
+    max_size: int,
+) -> Iterator[WireguardPeerDelta]:
+    """Split a peer with too many allowed ips to fit in a single message.
+
+    The first part carries all peer attributes and flags, following parts only
+    append the remaining allowed ips to the (now existing) peer.
+    """
+    if _peer_size(delta) <= max_size:
+        yield delta
+        return
+
+    part = evolve(delta, allowed_ips=[])
+    size = _peer_size(evolve(part, replace_allowed_ips=False)) + _nla_size(0)
+    for addr in delta.allowed_ips:
+        addr_size = _allowed_ip_size(addr)
+        if part.allowed_ips and size + addr_size > max_size:
+            yield part
+            part = WireguardPeerDelta(public_key=delta.public_key, update_only=True)
+            size = _peer_size(part) + _nla_size(0)
+        part.allowed_ips.append(addr)
+        size += addr_size
+    yield part
+
+
+def _peer_attrs(delta: WireguardPeerDelta) -> list[list[Any]]:
+    """Build the WGPEER_A_* attributes for a peer delta."""
+    attrs: list[list[Any]] = [["WGPEER_A_PUBLIC_KEY", str(delta.public_key)]]
+    if delta.remove:
+        attrs.append(["WGPEER_A_FLAGS", WGPEER_F_REMOVE_ME])
+        return attrs
+
+    flags = 0
+    if delta.update_only:
+        flags |= WGPEER_F_UPDATE_ONLY
+    if delta.replace_allowed_ips:
+        flags |= WGPEER_F_REPLACE_ALLOWEDIPS
+    attrs.append(["WGPEER_A_FLAGS", flags])
+
+    if delta.preshared_key is not None:
+        attrs.append(["WGPEER_A_PRESHARED_KEY", str(delta.preshared_key)])
+    if delta.endpoint_host is not None and delta.endpoint_port is not None:
+        endpoint = {"addr": str(delta.endpoint_host), "port": delta.endpoint_port}
+        attrs.append(["WGPEER_A_ENDPOINT", endpoint])
+    if delta.persistent_keepalive is not None:
+        attrs.append(
+            ["WGPEER_A_PERSISTENT_KEEPALIVE_INTERVAL", delta.persistent_keepalive],
+        )
+    if delta.allowed_ips or delta.replace_allowed_ips:
+        allowed_ips = [
+            {
+                "attrs": [
+                    [
+                        "WGALLOWEDIP_A_FAMILY",
+                        AF_INET if isinstance(addr, IPv4Interface) else AF_INET6,
+                    ],
+                    ["WGALLOWEDIP_A_IPADDR", addr.ip.packed],
+                    ["WGALLOWEDIP_A_CIDR_MASK", addr.network.prefixlen],
+                ],
+            }
+            for addr in delta.allowed_ips
+        ]
+        attrs.append(["WGPEER_A_ALLOWEDIPS", allowed_ips])
+    return attrs
+
+
+def _config_from_info(info: list[Any]) -> WireguardConfig:
+    """Build a WireguardConfig from the (multipart) WG_CMD_GET_DEVICE response."""
+    attrs = dict(info[0]["attrs"])
+
+    try:
+        private_key = WireguardKey(attrs["WGDEVICE_A_PRIVATE_KEY"].decode("utf-8"))
+    except KeyError:
+        private_key = None
+
+    wgconfig = WireguardConfig(
+        private_key=private_key,
+        fwmark=attrs["WGDEVICE_A_FWMARK"] or None,
+        listen_port=attrs["WGDEVICE_A_LISTEN_PORT"] or None,
+    )
+
+    peer_attrs_by_pubkey: dict[bytes, dict[str, Any]] = {}
+    allowed_ips_by_pubkey: defaultdict[bytes, list[Any]] = defaultdict(list)
+
+    for peer_attrs in (
+        dict(peer["attrs"])
+        for part in info
+        for peer in part.get("WGDEVICE_A_PEERS", [])
+    ):
+        # peers with many allowed IPs continue in the next part, which only
+        # repeats the public key
+        public_key = peer_attrs["WGPEER_A_PUBLIC_KEY"]
+        peer_attrs_by_pubkey.setdefault(public_key, peer_attrs)
+        allowed_ips_by_pubkey[public_key].extend(
+            peer_attrs.get("WGPEER_A_ALLOWEDIPS", []),
+        )
+
+    for public_key, peer_attrs in peer_attrs_by_pubkey.items():
+        preshared_key = peer_attrs["WGPEER_A_PRESHARED_KEY"].decode("utf-8")
+        endpoint = peer_attrs.get("WGPEER_A_ENDPOINT")
+        last_handshake = peer_attrs.get("WGPEER_A_LAST_HANDSHAKE_TIME")
+        peer = WireguardPeer.from_trusted(
+            public_key=WireguardKey.intern(
+                peer_attrs["WGPEER_A_PUBLIC_KEY"].decode("utf-8"),
+            ),
+            preshared_key=WireguardKey(preshared_key) if preshared_key else None,
+            endpoint_host=ip_address(endpoint["addr"]) if endpoint else None,
+            endpoint_port=endpoint["port"] if endpoint else None,
+            persistent_keepalive=peer_attrs["WGPEER_A_PERSISTENT_KEEPALIVE_INTERVAL"]
+            or None,
+            allowed_ips=[
+                ip_interface(allowed_ip["addr"])
+                for allowed_ip in allowed_ips_by_pubkey[public_key]
+            ],
+            last_handshake=(
+                float(last_handshake["tv_sec"]) if last_handshake else None
+            ),
+            rx_bytes=peer_attrs.get("WGPEER_A_RX_BYTES"),
+            tx_bytes=peer_attrs.get("WGPEER_A_TX_BYTES"),
+        )
+        wgconfig.add_peer(peer)
+    return wgconfig
+
+
+class _SetDeviceMessages:
+    """Build WG_CMD_SET_DEVICE messages, shared by the netlink devices."""
+
+    interface: str
+    max_message_size = NETLINK_MAX_MESSAGE_SIZE
+
+    def _new_set_device_msg(self, diff: WireguardConfigDiff | None = None) -> wgmsg:
+        msg = wgmsg()
+        msg["cmd"] = WG_CMD_SET_DEVICE
+        msg["version"] = WG_GENL_VERSION
+        msg["attrs"].append(["WGDEVICE_A_IFNAME", self.interface])
+        if diff is not None:
+            if diff.private_key is not None:
+                msg["attrs"].append(["WGDEVICE_A_PRIVATE_KEY", str(diff.private_key)])
+            if diff.listen_port is not None:
+                msg["attrs"].append(["WGDEVICE_A_LISTEN_PORT", diff.listen_port])
+            if diff.fwmark is not None:
+                msg["attrs"].append(["WGDEVICE_A_FWMARK", diff.fwmark])
+        return msg
+
+    def _set_device_messages(self, diff: WireguardConfigDiff) -> Iterator[wgmsg]:
+        """Pack the changes into as few WG_CMD_SET_DEVICE messages as possible.
+
+        A new message is started whenever the next peer would push the encoded
+        message over max_message_size, peers that do not fit in a message by
+        themselves have their allowed ips split over several messages.
+        """
+        msg = self._new_set_device_msg(diff)
+        size = _msg_size(self.interface, diff)
+        max_peer_size = self.max_message_size - size
+        peers: list[dict[str, Any]] = []
+
+        for delta in diff.peers:
+            for part in _split_peer(delta, max_peer_size):
+                peer_size = _peer_size(part)
+                if peers and size + peer_size > self.max_message_size:
+                    msg["attrs"].append(["WGDEVICE_A_PEERS", peers])
+                    yield msg
+                    msg = self._new_set_device_msg()
+                    size = _msg_size(self.interface)
+                    peers = []
+                peers.append({"attrs": _peer_attrs(part)})
+                size += peer_size
+
+        if peers:
+            msg["attrs"].append(["WGDEVICE_A_PEERS", peers])
+            yield msg
+        elif diff.device_changed:
+            yield msg
+
+
+def _wireguard_ifnames() -> list[str]:
+    """Names of the WireGuard interfaces, from a single RTM_GETLINK dump.
+
+    The dump asks the kernel to only return links of kind wireguard, which is
+    a lot cheaper than loading every interface into a pyroute2.NDB.
+    """
+    with pyroute2.IPRoute() as ipr:
+        return [
+            link.get_attr("IFLA_IFNAME") for link in ipr.link("dump", kind="wireguard")
+        ]
+
+
+class _ThreadWireGuard:
+    """The pyroute2.WireGuard socket of a thread and the devices using it."""
+
+    __slots__ = ("__weakref__", "close", "users", "wg")
+
+    def __init__(self) -> None:
         self.wg = pyroute2.WireGuard()
+        self.users = 0
+        # also closes the socket when it is dropped along with its thread
+        self.close = weakref.finalize(self, self.wg.close)
+
+
+class _SharedWireGuard(threading.local):
+    """Reference counted pyroute2.WireGuard sockets, shared by netlink devices.
+
+    pyroute2 sockets may only be used from the thread that created them, so
+    each thread keeps its own socket in thread local storage. It is opened for
+    the first device of the thread and closed with the last one. When the last
+    device is closed by another thread, the socket stays open for the thread
+    that owns it and is closed when that thread ends.
+    """
+
+    # shared by all threads, devices may be closed by any of them
+    _lock = threading.Lock()
+
+    def __init__(self) -> None:
+        self.current: _ThreadWireGuard | None = None
+
+    def acquire(self) -> _ThreadWireGuard:
+        with self._lock:
+            if self.current is None:
+                self.current = _ThreadWireGuard()
+            self.current.users += 1
+            return self.current
+
+    def release(self, shared: _ThreadWireGuard) -> None:
+        with self._lock:
+            shared.users -= 1
+            if shared.users == 0 and shared is self.current:
+                self.current = None
+                shared.close()
+
+
+_shared_wireguard = _SharedWireGuard()
+
+
+def _peer_stats_from_info(info: list[Any]) -> WireguardPeerStats:
+    """Collect the peer statistics from a WG_CMD_GET_DEVICE response.
+
+    Skips decoding allowed IPs, endpoints and keys other than the public key.
+    """
+    stats = WireguardPeerStats()
+    seen: set[bytes] = set()
+    for part in info:
+        for peer in part.get("WGDEVICE_A_PEERS", []):
+            peer_attrs = dict(peer["attrs"])
+            public_key = peer_attrs["WGPEER_A_PUBLIC_KEY"]
+            # peers with many allowed IPs continue in the next part
+            if public_key in seen:
+                continue
+            seen.add(public_key)
+
+            last_handshake = peer_attrs.get("WGPEER_A_LAST_HANDSHAKE_TIME")
+            stats.append(
+                a2b_base64(public_key),
+                peer_attrs.get("WGPEER_A_RX_BYTES") or 0,
+                peer_attrs.get("WGPEER_A_TX_BYTES") or 0,
+                last_handshake["tv_sec"] + last_handshake.get("tv_nsec", 0) * 1e-9
+                if last_handshake
+                else 0.0,
+            )
+    return stats
+
+
+class WireguardNetlinkDevice(_SetDeviceMessages, WireguardDevice):
+    def __init__(self, interface: str, wg: Any = None) -> None:
+        """Use the shared netlink socket, or the given pyroute2.WireGuard socket.
+
+        A socket that is passed in is not closed when the device is closed.
+        """
+        super().__init__(interface)
+        self._shared: _ThreadWireGuard | None = None
+        if wg is None:
+            self._shared = _shared_wireguard.acquire()
+            wg = self._shared.wg
+        self.wg = wg
+        # one request and its responses at a time on the socket
+        self._request_lock = threading.Lock()
 
     def close(self) -> None:
-        self.wg.close()
+        if self._shared is not None:
+            shared, self._shared = self._shared, None
+            _shared_wireguard.release(shared)
 
     def get_config(self) -> WireguardConfig:
+        return _config_from_info(self._info())
+
+    def get_peer_stats(self) -> WireguardPeerStats:
+        return _peer_stats_from_info(self._info())
+
+    def _info(self) -> list[Any]:
         try:
-            info = self.wg.info(self.interface)
-            attrs = dict(info[0]["attrs"])
+            with self._request_lock:
+                info: list[Any] = self.wg.info(self.interface)
         except pyroute2.netlink.exceptions.NetlinkError as exc:
             msg = f"Unable to access interface: {exc.args[1]}"
             raise RuntimeError(msg) from exc
+        return info
 
-        try:
-            private_key = WireguardKey(attrs["WGDEVICE_A_PRIVATE_KEY"].decode("utf-8"))
-        except KeyError:
-            private_key = None
-
-        wgconfig = WireguardConfig(
-            private_key=private_key,
-            fwmark=attrs["WGDEVICE_A_FWMARK"] or None,
-            listen_port=attrs["WGDEVICE_A_LISTEN_PORT"] or None,
-        )
+    def set_config(self, config: WireguardConfig) -> WireguardConfigDiff:
+        """Apply only the changes between the device and the new configuration.
 
-        peer_attrs_by_pubkey: defaultdict[bytes, dict[str, Any]] = defaultdict(dict)
-
-        for peer_attrs in (
-            dict(peer["attrs"])
-            for part in info
-            for peer in part.get("WGDEVICE_A_PEERS", [])
-        ):
-            peer_attrs_by_pubkey[peer_attrs["WGPEER_A_PUBLIC_KEY"]].update(peer_attrs)
-
-        for peer_attrs in peer_attrs_by_pubkey.values():
-            preshared_key = peer_attrs["WGPEER_A_PRESHARED_KEY"].decode("utf-8")
-            peer = WireguardPeer(
-                public_key=peer_attrs["WGPEER_A_PUBLIC_KEY"].decode("utf-8"),
-                preshared_key=WireguardKey(preshared_key) if preshared_key else None,
-                endpoint_host=peer_attrs.get("WGPEER_A_ENDPOINT", {}).get("addr"),
-                endpoint_port=peer_attrs.get("WGPEER_A_ENDPOINT", {}).get("port"),
-                persistent_keepalive=peer_attrs[
-                    "WGPEER_A_PERSISTENT_KEEPALIVE_INTERVAL"
-                ]
-                or None,
-                allowed_ips=[
-                    allowed_ip["addr"]
-                    for allowed_ip in peer_attrs.get("WGPEER_A_ALLOWEDIPS", [])
-                ],
-                last_handshake=peer_attrs.get("WGPEER_A_LAST_HANDSHAKE_TIME", {}).get(
-                    "tv_sec",
-                ),
-                rx_bytes=peer_attrs.get("WGPEER_A_RX_BYTES"),
-                tx_bytes=peer_attrs.get("WGPEER_A_TX_BYTES"),
-            )
-            wgconfig.add_peer(peer)
-        return wgconfig
-
-    def set_config(self, config: WireguardConfig) -> None:
-        current_config = self.get_config()
-
-        # set/update the configuration
-        self.wg.set(
-            interface=self.interface,
-            private_key=str(config.private_key) if config.private_key else None,
-            listen_port=config.listen_port,
-            fwmark=config.fwmark,
-        )
+        Returns a summary of the changes that were sent to the kernel.
+        """
+        diff = diff_config(self.get_config(), config)
+        self.apply_diff(diff)
+        return diff
+
+    def apply_diff(self, diff: WireguardConfigDiff) -> None:
+        """Send a set of changes to the kernel in as few messages as possible.
 
-        cur_peers = set(current_config.peers)
-        new_peers = set(config.peers)
-
-        # remove peers that are no longer in the configuration
-        for key in cur_peers.difference(new_peers):
-            self.wg.set(self.interface, peer={"public_key": str(key), "remove": True})
-
-        # update any changed peers
-        for key in cur_peers.intersection(new_peers):
-            peer = config.peers[key]
-            if peer != current_config.peers[key]:
-                self.wg.set(self.interface, peer=self._wg_set_peer_arg(peer))
-
-        # add any new peers
-        for key in new_peers.difference(cur_peers):
-            peer = config.peers[key]
-            self.wg.set(self.interface, peer=self._wg_set_peer_arg(peer))
-
-    def _wg_set_peer_arg(self, peer: WireguardPeer) -> dict[str, str | int | list[str]]:
-        peer_dict: dict[str, str | int | list[str]] = {
-            "public_key": str(peer.public_key),
-        }
-        if peer.endpoint_host is not None and peer.endpoint_port is not None:
-            peer_dict["endpoint_addr"] = str(peer.endpoint_host)
-            peer_dict["endpoint_port"] = peer.endpoint_port
-        if peer.preshared_key is not None:
-            peer_dict["preshared_key"] = str(peer.preshared_key)
-        if peer.persistent_keepalive is not None:
-            peer_dict["persistent_keepalive"] = peer.persistent_keepalive
-        peer_dict["allowed_ips"] = [str(addr) for addr in peer.allowed_ips]
-        return peer_dict
+        Can be used directly to bulk load peers into a freshly created device,
+        i.e. apply_diff(diff_config(WireguardConfig(), config)).
+        """
+        try:
+            with self._request_lock:
+                for request in self._set_device_messages(diff):
+                    self.wg.nlm_request(
+                        request,
+                        msg_type=self.wg.prid,
+                        msg_flags=NLM_F_REQUEST | NLM_F_ACK,
+                    )
+        except pyroute2.netlink.exceptions.NetlinkError as exc:
+            msg = f"Unable to configure interface: {exc.args[1]}"
+            raise RuntimeError(msg) from exc
+
+    @classmethod
+    def list_interfaces(cls) -> list[str]:
+        return _wireguard_ifnames()
 
     @classmethod
     def list(cls) -> Iterator[WireguardNetlinkDevice]:
-        with pyroute2.NDB() as ndb:
-            for nic in ndb.interfaces:
-                if nic.kind == "wireguard":
-                    yield cls(nic.ifname)
+        for ifname in _wireguard_ifnames():
+            yield cls(ifname)
+
+
+class AsyncWireguardNetlinkDevice(_SetDeviceMessages, AsyncWireguardDevice):
+    """Netlink device on top of pyroute2's asyncio WireGuard socket."""
+
+    def __init__(self, interface: str, wg: Any) -> None:
+        super().__init__(interface)
+        self.wg = wg
+        # keep requests and their responses on the socket from interleaving
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    async def connect(cls, interface: str) -> AsyncWireguardNetlinkDevice:
+        try:
+            from pyroute2 import AsyncWireGuard
+        except ImportError:
+            msg = "AsyncWireguardNetlinkDevice requires pyroute2 0.9 or later"
+            raise RuntimeError(msg) from None
+
+        wg = AsyncWireGuard()
+        try:
+            await wg.setup_endpoint()
+        except pyroute2.netlink.exceptions.NetlinkError as exc:
+            wg.close()
+            msg = f"Unable to access interface: {exc.args[1]}"
+            raise RuntimeError(msg) from exc
+        return cls(interface, wg)
+
+    async def close(self) -> None:
+        self.wg.close()
+
+    async def get_config(self) -> WireguardConfig:
+        return _config_from_info(await self._info())
+
+    async def get_peer_stats(self) -> WireguardPeerStats:
+        return _peer_stats_from_info(await self._info())
+
+    async def _info(self) -> list[Any]:
+        try:
+            async with self._lock:
+                return [msg async for msg in await self.wg.info(self.interface)]
+        except pyroute2.netlink.exceptions.NetlinkError as exc:
+            msg = f"Unable to access interface: {exc.args[1]}"
+            raise RuntimeError(msg) from exc
+
+    async def set_config(self, config: WireguardConfig) -> WireguardConfigDiff:
+        """Apply only the changes between the device and the new configuration."""
+        diff = diff_config(await self.get_config(), config)
+        await self.apply_diff(diff)
+        return diff
+
+    async def apply_diff(self, diff: WireguardConfigDiff) -> None:
+        """Send a set of changes to the kernel in as few messages as possible."""
+        try:
+            async with self._lock:
+                for request in self._set_device_messages(diff):
+                    response = await self.wg.nlm_request(
+                        request,
+                        msg_type=self.wg.prid,
+                        msg_flags=NLM_F_REQUEST | NLM_F_ACK,
+                    )
+                    # errors are raised while reading the acknowledgement
+                    async for _ in response:
+                        pass
+        except pyroute2.netlink.exceptions.NetlinkError as exc:
+            msg = f"Unable to configure interface: {exc.args[1]}"
+            raise RuntimeError(msg) from exc
+
+    @classmethod
+    async def list(cls) -> AsyncIterator[AsyncWireguardNetlinkDevice]:
+        try:
+            from pyroute2 import AsyncIPRoute
+        except ImportError:
+            msg = "AsyncWireguardNetlinkDevice requires pyroute2 0.9 or later"
+            raise RuntimeError(msg) from None
+
+        async with AsyncIPRoute() as ipr:
+            ifnames = [
+                link.get_attr("IFLA_IFNAME")
+                async for link in await ipr.link("dump", kind="wireguard")
+            ]
+        for ifname in ifnames:
+            yield await cls.connect(ifname)
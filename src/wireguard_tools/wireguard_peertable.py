@@ -0,0 +1,157 @@
+#
+# Pure Python reimplementation of wireguard-tools
+#
+# Copyright (c) 2022-2024 Carnegie Mellon University
+# SPDX-License-Identifier: MIT
+#
+"""Read-only, memory-mapped table of peers.
+
+The file starts with a fixed header, followed by the sorted 32 byte public
+keys of all peers, an array of count + 1 record offsets, and the peers
+themselves in the binary format from wireguard_binary. Opening a table only
+maps the file, lookups are a binary search over the key array, and a
+WireguardPeer is only decoded when it is accessed.
+"""
+
+from __future__ import annotations
+
+import mmap
+import os
+import struct
+import tempfile
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterable, Iterator, Mapping
+
+from .curve25519 import RAW_KEY_LENGTH
+from .wireguard_config import WireguardPeer
+from .wireguard_key import WireguardKey
+
+if TYPE_CHECKING:
+    from types import TracebackType
+
+PEERTABLE_MAGIC = b"WGPT"
+PEERTABLE_FORMAT_VERSION = 1
+
+# magic, format version, number of peers
+_HEADER = struct.Struct("<4sB3xQ")
+_OFFSET = struct.Struct("<Q")
+
+
+class WireguardPeerTable(Mapping[WireguardKey, WireguardPeer]):
+    """Read-only mapping of public keys to peers, backed by a mapped file."""
+
+    def __init__(self, path: str | os.PathLike[str]) -> None:
+        with Path(path).open("rb") as fh:
+            self._mmap = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self._mmap) < _HEADER.size:
+            self._mmap.close()
+            msg = f"{path} is not a WireGuard peer table"
+            raise ValueError(msg)
+        magic, version, count = _HEADER.unpack_from(self._mmap)
+        if magic != PEERTABLE_MAGIC or version != PEERTABLE_FORMAT_VERSION:
+            self._mmap.close()
+            msg = f"{path} is not a WireGuard peer table"
+            raise ValueError(msg)
+
+        self._count: int = count
+        self._keys_offset = _HEADER.size
+        self._offsets_offset = self._keys_offset + count * RAW_KEY_LENGTH
+        self._data_offset = self._offsets_offset + (count + 1) * _OFFSET.size
+        if self._data_offset > len(self._mmap) or (
+            self._data_offset
+            + _OFFSET.unpack_from(self._mmap, self._data_offset - _OFFSET.size)[0]
+            != len(self._mmap)
+        ):
+            self._mmap.close()
+            msg = f"{path} is truncated or corrupted"
+            raise ValueError(msg)
+
+    @classmethod
+    def write(
+        cls,
+        path: str | os.PathLike[str],
+        peers: Iterable[WireguardPeer],
+    ) -> None:
+        """Create a peer table file, replacing any existing file atomically.
+
+        When the same public key occurs more than once the last peer wins.
+        """
+        records = {peer.public_key.keydata: peer.to_bytes() for peer in peers}
+        keys = sorted(records)
+
+        path = Path(path)
+        fd, tmpname = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                fh.write(
+                    _HEADER.pack(PEERTABLE_MAGIC, PEERTABLE_FORMAT_VERSION, len(keys)),
+                )
+                fh.writelines(keys)
+                offset = 0
+                for keydata in keys:
+                    fh.write(_OFFSET.pack(offset))
+                    offset += len(records[keydata])
+                fh.write(_OFFSET.pack(offset))
+                fh.writelines(records[keydata] for keydata in keys)
+            Path(tmpname).replace(path)
+        except BaseException:
+            Path(tmpname).unlink()
+            raise
+
+    def close(self) -> None:
+        self._mmap.close()
+
+    def __enter__(self) -> WireguardPeerTable:  # noqa: PYI034
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self.close()
+
+    def _key_at(self, index: int) -> bytes:
+        start = self._keys_offset + index * RAW_KEY_LENGTH
+        return self._mmap[start : start + RAW_KEY_LENGTH]
+
+    def _find(self, key: WireguardKey) -> int:
+        """Binary search for the index of a public key, -1 if not found."""
+        keydata = key.keydata
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._key_at(middle) < keydata:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self._count and self._key_at(low) == keydata:
+            return low
+        return -1
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self) -> Iterator[WireguardKey]:
+        for index in range(self._count):
+            yield WireguardKey(self._key_at(index))
+
+    def __contains__(self, key: object) -> bool:
+        return isinstance(key, WireguardKey) and self._find(key) != -1
+
+    def __getitem__(self, key: WireguardKey) -> WireguardPeer:
+        # like a dict, lookups of anything that is not a key are just missing
+        index = self._find(key) if isinstance(key, WireguardKey) else -1
+        if index == -1:
+            raise KeyError(key)
+        start, end = struct.unpack_from(
+            "<QQ",
+            self._mmap,
+            self._offsets_offset + index * _OFFSET.size,
+        )
+        # decode a copy, a view into the mmap that is kept alive by the
+        # traceback of a decoding error would make close() fail
+        record = self._mmap[self._data_offset + start : self._data_offset + end]
+        return WireguardPeer.from_bytes(record)
@@ -0,0 +1,217 @@
+#
+# Pure Python reimplementation of wireguard-tools
+#
+# Copyright (c) 2022-2024 Carnegie Mellon University
+# SPDX-License-Identifier: MIT
+#
+"""Longest-prefix-match index over the allowed IPs of peers.
+
+This answers the same cryptokey routing question as the kernel, which peer
+would a packet for a given destination address be sent to.
+
+Instead of a bit-wise trie, which is slow to walk in Python, the prefixes of
+each address family are kept in one hash table per prefix length. A lookup
+masks the address for each prefix length in use, from longest to shortest,
+so it costs at most one dict lookup per distinct prefix length.
+
+find_conflicts detects peers with duplicate or overlapping allowed IPs.
+"""
+
+from __future__ import annotations
+
+import socket
+from ipaddress import IPv4Address, IPv4Interface, IPv6Address, IPv6Interface
+from typing import TYPE_CHECKING, Iterable, Union
+
+from attrs import define
+
+if TYPE_CHECKING:
+    from .wireguard_config import WireguardPeer
+    from .wireguard_key import WireguardKey
+
+Address = Union[IPv4Address, IPv6Address, str]
+
+_MAX_PREFIXLEN = {socket.AF_INET: 32, socket.AF_INET6: 128}
+
+
+class _PrefixTable:
+    """Prefixes of one address family, grouped by prefix length."""
+
+    def __init__(self, max_prefixlen: int) -> None:
+        self.max_prefixlen = max_prefixlen
+        self.by_prefixlen: dict[int, dict[int, WireguardKey]] = {}
+        # (prefixlen, netmask, prefixes) of the lengths in use, longest first
+        self.search_order: list[tuple[int, int, dict[int, WireguardKey]]] = []
+
+    def _netmask(self, prefixlen: int) -> int:
+        hostbits = self.max_prefixlen - prefixlen
+        return ((1 << self.max_prefixlen) - 1) >> hostbits << hostbits
+
+    def _update_search_order(self) -> None:
+        self.search_order = [
+            (prefixlen, self._netmask(prefixlen), prefixes)
+            for prefixlen, prefixes in sorted(self.by_prefixlen.items(), reverse=True)
+        ]
+
+    def add(self, network: int, prefixlen: int, public_key: WireguardKey) -> None:
+        prefixes = self.by_prefixlen.get(prefixlen)
+        if prefixes is None:
+            prefixes = self.by_prefixlen[prefixlen] = {}
+            self._update_search_order()
+        prefixes[network] = public_key
+
+    def remove(self, network: int, prefixlen: int, public_key: WireguardKey) -> None:
+        prefixes = self.by_prefixlen.get(prefixlen)
+        # the prefix may since have been taken over by another peer
+        if prefixes is None or prefixes.get(network) != public_key:
+            return
+        del prefixes[network]
+        if not prefixes:
+            del self.by_prefixlen[prefixlen]
+            self._update_search_order()
+
+    def lookup(self, address: int) -> WireguardKey | None:
+        for _prefixlen, netmask, prefixes in self.search_order:
+            public_key = prefixes.get(address & netmask)
+            if public_key is not None:
+                return public_key
+        return None
+
+
+class AllowedIPsIndex:
+    """Map destination addresses to the peer whose allowed IPs route them.
+
+    When more than one peer claims the same prefix, the last one added wins,
+    just like the kernel moves the prefix to the most recently configured peer.
+    """
+
+    def __init__(self, peers: Iterable[WireguardPeer] = ()) -> None:
+        self._tables = {
+            family: _PrefixTable(max_prefixlen)
+            for family, max_prefixlen in _MAX_PREFIXLEN.items()
+        }
+        for peer in peers:
+            self.add_peer(peer)
+
+    def _prefixes(self, peer: WireguardPeer) -> Iterable[tuple[_PrefixTable, int, int]]:
+        for interface in peer.allowed_ips:
+            network = interface.network
+            table = self._tables[
+                socket.AF_INET if network.version == 4 else socket.AF_INET6  # noqa: PLR2004
+            ]
+            yield table, int(network.network_address), network.prefixlen
+
+    def add_peer(self, peer: WireguardPeer) -> None:
+        """Route the peer's allowed IPs to it."""
+        for table, network, prefixlen in self._prefixes(peer):
+            table.add(network, prefixlen, peer.public_key)
+
+    def del_peer(self, peer: WireguardPeer) -> None:
+        """Remove the prefixes that are still routed to the peer."""
+        for table, network, prefixlen in self._prefixes(peer):
+            table.remove(network, prefixlen, peer.public_key)
+
+    def lookup(self, address: Address) -> WireguardKey | None:
+        """Return the public key of the peer that address is routed to."""
+        return self.lookup_many([address])[0]
+
+    def lookup_many(self, addresses: Iterable[Address]) -> list[WireguardKey | None]:
+        """Route a batch of addresses (i.e. from a log file) in one call.
+
+        Addresses can be ipaddress objects or strings.
+        """
+        ipv4 = self._tables[socket.AF_INET].lookup
+        ipv6 = self._tables[socket.AF_INET6].lookup
+        inet_pton = socket.inet_pton
+        from_bytes = int.from_bytes
+
+        results: list[WireguardKey | None] = []
+        for address in addresses:
+            if isinstance(address, str):
+                try:
+                    if ":" in address:
+                        packed = from_bytes(inet_pton(socket.AF_INET6, address), "big")
+                        results.append(ipv6(packed))
+                    else:
+                        packed = from_bytes(inet_pton(socket.AF_INET, address), "big")
+                        results.append(ipv4(packed))
+                except OSError:
+                    msg = f"{address!r} does not appear to be an IPv4 or IPv6 address"
+                    raise ValueError(msg) from None
+            elif address.version == 4:  # noqa: PLR2004
+                results.append(ipv4(int(address)))
+            else:
+                results.append(ipv6(int(address)))
+        return results
+
+
+@define(frozen=True)
+class AllowedIPsConflict:
+    """An allowed IP of a peer that is also covered by another peer's."""
+
+    public_key: WireguardKey
+    allowed_ip: IPv4Interface | IPv6Interface
+    # the other peer's prefix is the same or a shorter prefix
+    other_public_key: WireguardKey
+    other_allowed_ip: IPv4Interface | IPv6Interface
+
+    @property
+    def duplicate(self) -> bool:
+        """Both peers claim the same prefix, only the last one gets it."""
+        return self.allowed_ip.network == self.other_allowed_ip.network
+
+    def __str__(self) -> str:
+        relation = "duplicates" if self.duplicate else "overlaps with"
+        return (
+            f"{self.allowed_ip} of peer {self.public_key} {relation} "
+            f"{self.other_allowed_ip} of peer {self.other_public_key}"
+        )
+
+
+def find_conflicts(peers: Iterable[WireguardPeer]) -> list[AllowedIPsConflict]:
+    """Find allowed IPs that are claimed by more than one peer.
+
+    Two prefixes are either disjoint or one contains the other. So after
+    sorting by network address and prefix length, a single sweep with a stack
+    of the enclosing prefixes finds every prefix that is covered by one from
+    another peer. Duplicates are reported against the earlier peer.
+    """
+    prefixes = []
+    for order, peer in enumerate(peers):
+        for interface in peer.allowed_ips:
+            network = interface.network
+            first = int(network.network_address)
+            hostbits = network.max_prefixlen - network.prefixlen
+            last = first | ((1 << hostbits) - 1)
+            prefixes.append(
+                (
+                    network.version,
+                    first,
+                    network.prefixlen,
+                    order,
+                    last,
+                    peer.public_key,
+                    interface,
+                ),
+            )
+    prefixes.sort()
+
+    conflicts = []
+    # (version, last address, public key, interface) of the enclosing prefixes
+    stack: list[tuple[int, int, WireguardKey, IPv4Interface | IPv6Interface]] = []
+    for version, first, _prefixlen, _order, last, public_key, interface in prefixes:
+        while stack and (stack[-1][0] != version or stack[-1][1] < first):
+            stack.pop()
+        for _version, _last, other_public_key, other_interface in reversed(stack):
+            if other_public_key != public_key:
+                conflicts.append(
+                    AllowedIPsConflict(
+                        public_key,
+                        interface,
+                        other_public_key,
+                        other_interface,
+                    ),
+                )
+                break
+        stack.append((version, last, public_key, interface))
+    return conflicts
@@ -0,0 +1,82 @@
+#
+# Pure Python reimplementation of wireguard-tools
+#
+# Copyright (c) 2022-2024 Carnegie Mellon University
+# SPDX-License-Identifier: MIT
+#
+"""Transfer counters and handshake times of all peers of a device.
+
+Monitoring only needs a few numbers per peer, WireguardPeerStats keeps those
+in parallel arrays so that polling a device does not have to build peer
+objects, keys or ipaddress objects for every peer.
+"""
+
+from __future__ import annotations
+
+from array import array
+from typing import TYPE_CHECKING, Iterator, Tuple
+
+from attrs import define, field
+
+from .wireguard_key import WireguardKey
+
+if TYPE_CHECKING:
+    from .wireguard_config import WireguardConfig
+
+# (public key, rx bytes, tx bytes, last handshake)
+PeerStat = Tuple[WireguardKey, int, int, float]
+
+_KEY_SIZE = 32
+
+
+@define
+class WireguardPeerStats:
+    """Columns of per-peer statistics.
+
+    public_keys holds the raw 32 byte keys back to back, entry i of rx_bytes,
+    tx_bytes and last_handshake belongs to the i-th key. A last_handshake of
+    0.0 means that there has not been a handshake yet.
+    """
+
+    public_keys: bytearray = field(factory=bytearray)
+    rx_bytes: array[int] = field(factory=lambda: array("Q"))
+    tx_bytes: array[int] = field(factory=lambda: array("Q"))
+    last_handshake: array[float] = field(factory=lambda: array("d"))
+
+    def __len__(self) -> int:
+        return len(self.rx_bytes)
+
+    def append(
+        self,
+        public_key: bytes,
+        rx_bytes: int = 0,
+        tx_bytes: int = 0,
+        last_handshake: float = 0.0,
+    ) -> None:
+        self.public_keys += public_key
+        self.rx_bytes.append(rx_bytes)
+        self.tx_bytes.append(tx_bytes)
+        self.last_handshake.append(last_handshake)
+
+    def public_key(self, index: int) -> WireguardKey:
+        start = range(len(self))[index] * _KEY_SIZE
+        return WireguardKey(bytes(self.public_keys[start : start + _KEY_SIZE]))
+
+    def __iter__(self) -> Iterator[PeerStat]:
+        for index, (rx_bytes, tx_bytes, last_handshake) in enumerate(
+            zip(self.rx_bytes, self.tx_bytes, self.last_handshake),
+        ):
+            yield self.public_key(index), rx_bytes, tx_bytes, last_handshake
+
+    @classmethod
+    def from_config(cls, config: WireguardConfig) -> WireguardPeerStats:
+        """Collect the statistics of the peers of a device configuration."""
+        stats = cls()
+        for peer in config.peers.values():
+            stats.append(
+                peer.public_key.keydata,
+                peer.rx_bytes or 0,
+                peer.tx_bytes or 0,
+                peer.last_handshake or 0.0,
+            )
+        return stats
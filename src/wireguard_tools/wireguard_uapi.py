@@ -7,156 +7,630 @@
 
 from __future__ import annotations
 
+import asyncio
 import socket
+import time
+from contextlib import suppress
+from functools import partial
 from ipaddress import ip_address, ip_interface
 from pathlib import Path
-from typing import TYPE_CHECKING, Iterator
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    AsyncIterator,
+    Callable,
+    Iterator,
+    Protocol,
+    TypeVar,
+)
+
+from attrs import define
 
 from .wireguard_config import WireguardConfig, WireguardPeer
-from .wireguard_device import WireguardDevice
+from .wireguard_device import AsyncWireguardDevice, WireguardDevice
+from .wireguard_diff import WireguardConfigDiff, diff_config
 from .wireguard_key import WireguardKey
+from .wireguard_stats import WireguardPeerStats
 
 if TYPE_CHECKING:
     import os
+    from ipaddress import IPv4Address, IPv6Address
 
 WG_UAPI_SOCKET_DIR = Path("/var/run/wireguard")
 
+# size of the reusable receive buffer
+UAPI_RECV_BUFFER_SIZE = 65536
 
-class WireguardUAPIDevice(WireguardDevice):
-    def __init__(self, uapi_path: str | os.PathLike[str]) -> None:
-        self.uapi_path = (
-            WG_UAPI_SOCKET_DIR.joinpath(uapi_path).with_suffix(".sock")
-            if isinstance(uapi_path, str)
-            else Path(uapi_path)
-        )
-        if not self.uapi_path.exists():
-            msg = f"Unable to access interface: {uapi_path} not found."
-            raise FileNotFoundError(msg)
 
+def _uapi_socket_path(uapi_path: str | os.PathLike[str]) -> Path:
+    """Find the UAPI socket for an interface name or socket path."""
+    path = (
+        WG_UAPI_SOCKET_DIR.joinpath(uapi_path).with_suffix(".sock")
+        if isinstance(uapi_path, str)
+        else Path(uapi_path)
+    )
+    if not path.exists():
+        msg = f"Unable to access interface: {uapi_path} not found."
+        raise FileNotFoundError(msg)
+    return path
+
+
+def _uapi_interfaces() -> list[str]:
+    return [socket_path.stem for socket_path in WG_UAPI_SOCKET_DIR.glob("*.sock")]
+
+
+_T = TypeVar("_T")
+_T_co = TypeVar("_T_co", covariant=True)
+
+
+class _ResponseParser(Protocol[_T_co]):
+    """Consumes the key/value pairs of a get response."""
+
+    def feed(self, key: str, value: str) -> None: ...
+
+    def finish(self) -> _T_co: ...
+
+
+class _UAPIConfigParser:
+    """Build a WireguardConfig from the key/value pairs of a get response."""
+
+    def __init__(self, device_class: str) -> None:
+        self.device_class = device_class
+        self.config = WireguardConfig()
+        # collect already parsed peer attributes, the peer is created when
+        # the next peer starts or when the response ends
+        self.peer: dict[str, Any] | None = None
+
+    def feed(self, key: str, value: str) -> None:
+        config, peer = self.config, self.peer
+
+        # interface
+        if key == "private_key":
+            config.private_key = WireguardKey(value)
+        elif key in ["listen_port", "fwmark"]:
+            setattr(config, key, int(value))
+
+        # peer
+        elif key == "public_key":
+            if peer is not None:
+                config.add_peer(WireguardPeer.from_trusted(**peer))
+            self.peer = {"public_key": WireguardKey.intern(value), "allowed_ips": []}
+        elif key == "preshared_key":
+            assert peer is not None
+            peer["preshared_key"] = WireguardKey(value) if value else None
+        elif key == "endpoint":
+            assert peer is not None
+            addr, port = value.rsplit(":", 1)
+            peer["endpoint_host"] = ip_address(addr.lstrip("[").rstrip("]"))
+            peer["endpoint_port"] = int(port)
+        elif key == "persistent_keepalive_interval":
+            assert peer is not None
+            peer["persistent_keepalive"] = int(value)
+        elif key == "allowed_ip":
+            assert peer is not None
+            peer["allowed_ips"].append(ip_interface(value))
+
+        # device statistics
+        elif key == "last_handshake_time_sec":
+            assert peer is not None
+            peer["last_handshake"] = int(value) * 1e0
+        elif key == "last_handshake_time_nsec":
+            assert peer is not None
+            if "last_handshake" in peer:
+                peer["last_handshake"] += int(value) * 1e-9
+        elif key in ["rx_bytes", "tx_bytes"]:
+            assert peer is not None
+            peer[key] = int(value)
+
+        # misc
+        elif key in ["protocol_version", "errno"]:
+            _check_get_status(f"{self.device_class}.get_config", key, value)
+
+    def finish(self) -> WireguardConfig:
+        if self.peer is not None:
+            self.config.add_peer(WireguardPeer.from_trusted(**self.peer))
+            self.peer = None
+        return self.config
+
+
+class _PeerStatsParser:
+    """Collect only the peer statistics from the key/value pairs of a get response.
+
+    Everything else, i.e. allowed IPs and endpoints, is skipped unparsed.
+    """
+
+    def __init__(self, device_class: str) -> None:
+        self.device_class = device_class
+        self.stats = WireguardPeerStats()
+
+    def feed(self, key: str, value: str) -> None:
+        stats = self.stats
+        if key == "public_key":
+            stats.append(bytes.fromhex(value))
+        elif key == "rx_bytes":
+            stats.rx_bytes[-1] = int(value)
+        elif key == "tx_bytes":
+            stats.tx_bytes[-1] = int(value)
+        elif key == "last_handshake_time_sec":
+            stats.last_handshake[-1] = int(value)
+        elif key == "last_handshake_time_nsec":
+            stats.last_handshake[-1] += int(value) * 1e-9
+        elif key in ["protocol_version", "errno"]:
+            _check_get_status(f"{self.device_class}.get_peer_stats", key, value)
+
+    def finish(self) -> WireguardPeerStats:
+        return self.stats
+
+
+def _check_get_status(method: str, key: str, value: str) -> None:
+    if key == "protocol_version":
+        version = int(value)
+        if version != 1:
+            msg = f"{method} unexpected protocol {version}"
+            raise RuntimeError(msg)
+    else:
+        errno = int(value)
+        if errno != 0:
+            msg = f"{method} failed with {errno}"
+            raise RuntimeError(msg)
+
+
+def _endpoint_line(host: IPv4Address | IPv6Address | str, port: int | None) -> str:
+    # should resolve hostname for endpoint here
+    assert not isinstance(host, str)
+    endpoint = f"[{host}]" if host.version == 6 else str(host)  # noqa: PLR2004
+    return f"endpoint={endpoint}:{port}"
+
+
+def _set_request(diff: WireguardConfigDiff, *, replace_peers: bool = False) -> bytes:
+    """Encode a set request that applies the changes in diff."""
+    uapi = ["set=1"]
+    if diff.private_key is not None:
+        uapi.append(f"private_key={diff.private_key.hex}")
+    if diff.listen_port is not None:
+        uapi.append(f"listen_port={diff.listen_port}")
+    if diff.fwmark is not None:
+        uapi.append(f"fwmark={diff.fwmark}")
+
+    if replace_peers:
+        uapi.append("replace_peers=true")
+    for delta in diff.peers:
+        uapi.append(f"public_key={delta.public_key.hex}")
+        if delta.remove:
+            uapi.append("remove=true")
+            continue
+        if delta.update_only:
+            uapi.append("update_only=true")
+        if delta.preshared_key is not None:
+            uapi.append(f"preshared_key={delta.preshared_key.hex}")
+        if delta.endpoint_host is not None:
+            uapi.append(_endpoint_line(delta.endpoint_host, delta.endpoint_port))
+        if delta.persistent_keepalive is not None:
+            uapi.append(
+                f"persistent_keepalive_interval={delta.persistent_keepalive}",
+            )
+        if delta.replace_allowed_ips:
+            uapi.append("replace_allowed_ips=true")
+        uapi.extend([f"allowed_ip={address}" for address in delta.allowed_ips])
+
+    uapi.append("\n")
+    return "\n".join(uapi).encode()
+
+
+def _replace_request(config: WireguardConfig) -> bytes:
+    """Encode a set request that replaces the device configuration.
+
+    Every value that is set is sent, including zeros such as fwmark=0 that
+    clear the current setting of the device.
+    """
+    uapi = ["set=1"]
+    if config.private_key is not None:
+        uapi.append(f"private_key={config.private_key.hex}")
+    if config.listen_port is not None:
+        uapi.append(f"listen_port={config.listen_port}")
+    if config.fwmark is not None:
+        uapi.append(f"fwmark={config.fwmark}")
+
+    uapi.append("replace_peers=true")
+    for peer in config.peers.values():
+        uapi.append(f"public_key={peer.public_key.hex}")
+        if peer.preshared_key is not None:
+            uapi.append(f"preshared_key={peer.preshared_key.hex}")
+        if peer.endpoint_host is not None:
+            uapi.append(_endpoint_line(peer.endpoint_host, peer.endpoint_port))
+        if peer.persistent_keepalive is not None:
+            uapi.append(f"persistent_keepalive_interval={peer.persistent_keepalive}")
+        uapi.append("replace_allowed_ips=true")
+        uapi.extend([f"allowed_ip={address}" for address in peer.allowed_ips])
+
+    uapi.append("\n")
+    return "\n".join(uapi).encode()
+
+
+class _ConnectionClosedError(RuntimeError):
+    """The userspace implementation closed the UAPI socket."""
+
+
+def _check_set_response(device_class: str, response: list[tuple[str, str]]) -> None:
+    assert len(response) == 1
+    assert response[0][0] == "errno"
+    errno = int(response[0][1])
+    if errno != 0:
+        msg = f"{device_class}.set_config failed with {errno}"
+        raise RuntimeError(msg)
+
+
+class WireguardUAPIDevice(WireguardDevice):
+    def __init__(
+        self,
+        uapi_path: str | os.PathLike[str],
+        timeout: float | None = None,
+    ) -> None:
+        self.uapi_path = _uapi_socket_path(uapi_path)
         super().__init__(self.uapi_path.stem)
 
+        self._recv_buffer = bytearray(UAPI_RECV_BUFFER_SIZE)
+        # bytes received over the lifetime of the device
+        self._received = 0
+        self._connect(timeout)
+
+    def _connect(self, timeout: float | None = None) -> None:
         self.uapi_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-        self.uapi_socket.connect(str(self.uapi_path.resolve()))
-        self._buffer = ""
+        self.uapi_socket.settimeout(timeout)
+        try:
+            self.uapi_socket.connect(str(self.uapi_path.resolve()))
+        except OSError:
+            self.uapi_socket.close()
+            raise
+        self._pending = b""
 
     def close(self) -> None:
         self.uapi_socket.close()
 
+    def set_timeout(self, timeout: float | None) -> None:
+        # a hung userspace implementation raises TimeoutError instead of blocking
+        self.uapi_socket.settimeout(timeout)
+
     def get_config(self) -> WireguardConfig:
+        return self._get(partial(_UAPIConfigParser, type(self).__name__))
+
+    def get_peer_stats(self) -> WireguardPeerStats:
+        return self._get(partial(_PeerStatsParser, type(self).__name__))
+
+    def _get(self, make_parser: Callable[[], _ResponseParser[_T]]) -> _T:
         self.uapi_socket.sendall(b"get=1\n\n")
-        response = self._recvmsg()
-
-        config = WireguardConfig()
-        peer = None
-        for key, value in response:
-            # interface
-            if key == "private_key":
-                config.private_key = WireguardKey(value)
-            elif key in ["listen_port", "fwmark"]:
-                setattr(config, key, int(value))
-
-            # peer
-            elif key == "public_key":
-                peer = WireguardPeer(public_key=value)
-                config.add_peer(peer)
-            elif key == "preshared_key":
-                assert peer is not None
-                peer.preshared_key = WireguardKey(value) if value else None
-            elif key == "endpoint":
-                assert peer is not None
-                addr, port = value.rsplit(":", 1)
-                peer.endpoint_host = ip_address(addr.lstrip("[").rstrip("]"))
-                peer.endpoint_port = int(port)
-            elif key == "persistent_keepalive_interval":
-                assert peer is not None
-                peer.persistent_keepalive = int(value)
-            elif key == "allowed_ip":
-                assert peer is not None
-                peer.allowed_ips.append(ip_interface(value))
-
-            # device statistics
-            elif key == "last_handshake_time_sec":
-                assert peer is not None
-                peer.last_handshake = int(value) * 1e0
-            elif key == "last_handshake_time_nsec":
-                assert peer is not None
-                if peer.last_handshake is not None:
-                    peer.last_handshake += int(value) * 1e-9
-            elif key in ["rx_bytes", "tx_bytes"]:
-                assert peer is not None
-                setattr(peer, key, int(value))
-
-            # misc
-            elif key == "protocol_version":
-                version = int(value)
-                if version != 1:
-                    msg = (
-                        f"WireguardUAPIDevice.get_config unexpected protocol {version}"
-                    )
-                    raise RuntimeError(msg)
-            elif key == "errno":
-                errno = int(value)
-                if errno != 0:
-                    msg = f"WireguardUAPIDevice.get_config failed with {errno}"
-                    raise RuntimeError(msg)
-        return config
+        return self._receive(make_parser())
 
-    def set_config(self, config: WireguardConfig) -> None:
-        uapi = ["set=1"]
-        if config.private_key is not None:
-            uapi.append(f"private_key={config.private_key.hex}")
-        if config.listen_port is not None:
-            uapi.append(f"listen_port={config.listen_port}")
-        if config.fwmark is not None:
-            uapi.append(f"fwmark={config.fwmark}")
+    def _receive(self, parser: _ResponseParser[_T]) -> _T:
+        """Feed a get response to the parser as it arrives."""
+        message = self._iter_message()
+        try:
+            for key, value in message:
+                parser.feed(key, value)
+        except Exception:
+            # skip the rest of the response, so the next one is read correctly
+            for _ in message:
+                pass
+            raise
+        return parser.finish()
 
-        uapi.append("replace_peers=true")
-        for peer in config.peers.values():
-            # should resolve hostname for endpoint here
-            assert not isinstance(peer.endpoint_host, str)
-            uapi.extend(
-                [
-                    f"public_key={peer.public_key.hex}",
-                    f"endpoint={peer.endpoint_host}:{peer.endpoint_port}",
-                ],
-            )
-            if peer.preshared_key is not None:
-                uapi.append(f"preshared_key={peer.preshared_key}")
-            if peer.persistent_keepalive is not None:
-                uapi.append(
-                    f"persistent_keepalive_interval={peer.persistent_keepalive}",
-                )
+    def set_config(self, config: WireguardConfig) -> None:
+        """Replace the device configuration, all peers are recreated."""
+        self.uapi_socket.sendall(_replace_request(config))
+        _check_set_response("WireguardUAPIDevice", self._recvmsg())
 
-            uapi.append("replace_allowed_ips=true")
-            uapi.extend([f"allowed_ip={address}" for address in peer.allowed_ips])
+    def sync_config(self, config: WireguardConfig) -> WireguardConfigDiff:
+        """Apply only the changes between the device and the new configuration.
 
-        uapi.append("\n")
-        self.uapi_socket.sendall("\n".join(uapi).encode())
+        Unchanged peers keep their handshake state and only the allowed IPs
+        that changed are sent. Returns a summary of the changes.
+        """
+        diff = diff_config(self.get_config(), config)
+        self.apply_diff(diff)
+        return diff
 
-        response = self._recvmsg()
-        assert len(response) == 1
-        assert response[0][0] == "errno"
-        errno = int(response[0][1])
-        if errno != 0:
-            msg = f"WireguardUAPIDevice.set_config failed with {errno}"
-            raise RuntimeError(msg)
+    def apply_diff(self, diff: WireguardConfigDiff) -> None:
+        """Send a set of changes to the device, nothing is sent if it is empty."""
+        if not diff:
+            return
+        self.uapi_socket.sendall(_set_request(diff))
+        _check_set_response("WireguardUAPIDevice", self._recvmsg())
 
     # a wireguard UAPI response message is a series of key=value lines
     # followed by an empty line
-    def _recvmsg(self) -> list[tuple[str, str]]:
-        message = []
+    def _iter_message(self) -> Iterator[tuple[str, str]]:
+        """Yield key/value pairs from a response message as they arrive.
+
+        Data is received into a reusable buffer and only the incomplete last
+        line is carried over between reads, anything received after the end
+        of the message is kept for the next call.
+        """
+        # the buffered data belongs to this message, none of it is left for the
+        # next one when reading fails halfway
+        buffer, self._pending = self._pending, b""
+        start = 0
         while True:
-            # read until we have at least a line
-            while "\n" not in self._buffer:
-                self._buffer += self.uapi_socket.recv(4096).decode("utf-8")
-            line, self._buffer = self._buffer.split("\n", maxsplit=1)
+            end = buffer.find(b"\n", start)
+            if end == -1:
+                nbytes = self.uapi_socket.recv_into(self._recv_buffer)
+                if not nbytes:
+                    msg = "WireguardUAPIDevice connection closed"
+                    raise _ConnectionClosedError(msg)
+                self._received += nbytes
+                buffer = buffer[start:] + self._recv_buffer[:nbytes]
+                start = 0
+                continue
+
+            line = buffer[start:end]
+            start = end + 1
             if not line:
-                break
-            key, value = line.split("=", maxsplit=1)
-            message.append((key, value))
-        return message
+                self._pending = bytes(buffer[start:])
+                return
+            key, _, value = line.partition(b"=")
+            yield key.decode("utf-8"), value.decode("utf-8")
+
+    def _recvmsg(self) -> list[tuple[str, str]]:
+        return list(self._iter_message())
+
+    @classmethod
+    def list_interfaces(cls) -> list[str]:
+        return _uapi_interfaces()
 
     @classmethod
     def list(cls) -> Iterator[WireguardUAPIDevice]:
-        for socket_path in WG_UAPI_SOCKET_DIR.glob("*.sock"):
-            yield cls(socket_path.stem)
+        for interface in _uapi_interfaces():
+            yield cls(interface)
+
+
+@define
+class UAPIStats:
+    """Counters for the requests sent through a WireguardUAPISession.
+
+    A flush writes all queued requests at once and waits for their responses,
+    its latency is the time of that whole round trip.
+    """
+
+    requests: int = 0
+    flushes: int = 0
+    reconnects: int = 0
+    bytes_sent: int = 0
+    bytes_received: int = 0
+    # seconds spent in flushes
+    busy_time: float = 0.0
+    last_latency: float = 0.0
+    max_latency: float = 0.0
+
+    @property
+    def mean_latency(self) -> float:
+        return self.busy_time / self.flushes if self.flushes else 0.0
+
+    @property
+    def throughput(self) -> float:
+        """Bytes sent and received per second spent in flushes."""
+        if not self.busy_time:
+            return 0.0
+        return (self.bytes_sent + self.bytes_received) / self.busy_time
+
+    def __str__(self) -> str:
+        return (
+            f"{self.requests} requests in {self.flushes} flushes, "
+            f"{self.reconnects} reconnects, "
+            f"latency mean {self.mean_latency * 1e3:.3f}ms "
+            f"max {self.max_latency * 1e3:.3f}ms, "
+            f"{self.throughput / 1e6:.2f} MB/s"
+        )
+
+
+class WireguardUAPISession(WireguardUAPIDevice):
+    """Long-lived UAPI connection that batches requests.
+
+    Set requests can be queued and are written together with the next flush,
+    get_config flushes any queued requests in the same write, so a poll cycle
+    that applies changes and reads back the state costs a single round trip.
+    When the userspace implementation closes the connection, i.e. because it
+    was restarted, the session reconnects and resends the batch once. That is
+    only safe for batches that can be applied twice, such as replacing the
+    configuration or updating peers. A batch that removes a peer and adds it
+    again may have been applied before the connection was lost, and resending
+    it resets that peer a second time.
+    """
+
+    def __init__(
+        self,
+        uapi_path: str | os.PathLike[str],
+        timeout: float | None = None,
+    ) -> None:
+        self.stats = UAPIStats()
+        self._queue: list[bytes] = []
+        self._timeout = timeout
+        super().__init__(uapi_path, timeout)
+
+    def set_timeout(self, timeout: float | None) -> None:
+        self._timeout = timeout
+        super().set_timeout(timeout)
+
+    def queue_config(self, config: WireguardConfig) -> None:
+        """Queue a request that replaces the device configuration."""
+        self._queue.append(_replace_request(config))
+
+    def queue_diff(self, diff: WireguardConfigDiff) -> None:
+        """Queue a request that applies a set of changes."""
+        if diff:
+            self._queue.append(_set_request(diff))
+
+    def flush(self, *, get: bool = False) -> WireguardConfig | None:
+        """Send all queued requests and wait for the responses.
+
+        With get, a get request is pipelined after the queued requests and
+        the resulting configuration is returned.
+        """
+        return self._flush(
+            partial(_UAPIConfigParser, "WireguardUAPISession") if get else None,
+        )
+
+    def _get(self, make_parser: Callable[[], _ResponseParser[_T]]) -> _T:
+        result = self._flush(make_parser)
+        assert result is not None
+        return result
+
+    def _flush(
+        self,
+        make_parser: Callable[[], _ResponseParser[_T]] | None,
+    ) -> _T | None:
+        requests = self._queue
+        self._queue = []
+        if make_parser is not None:
+            requests.append(b"get=1\n\n")
+        if not requests:
+            return None
+
+        data = b"".join(requests)
+        received = self._received
+        start = time.perf_counter()
+        try:
+            return self._exchange(data, len(requests), make_parser)
+        except (ConnectionError, _ConnectionClosedError):
+            self.uapi_socket.close()
+            self._connect(self._timeout)
+            self.stats.reconnects += 1
+            # the retry parses the new response with a fresh parser
+            return self._exchange(data, len(requests), make_parser)
+        finally:
+            # failed requests still count, they took a round trip
+            latency = time.perf_counter() - start
+            stats = self.stats
+            stats.requests += len(requests)
+            stats.flushes += 1
+            stats.bytes_sent += len(data)
+            stats.bytes_received += self._received - received
+            stats.busy_time += latency
+            stats.last_latency = latency
+            stats.max_latency = max(stats.max_latency, latency)
+
+    def _exchange(
+        self,
+        data: bytes,
+        nrequests: int,
+        make_parser: Callable[[], _ResponseParser[_T]] | None,
+    ) -> _T | None:
+        self.uapi_socket.sendall(data)
+
+        # read all responses before raising, so the next flush does not
+        # pick up the responses of this one
+        nsets = nrequests if make_parser is None else nrequests - 1
+        responses = [self._recvmsg() for _ in range(nsets)]
+        result = self._receive(make_parser()) if make_parser is not None else None
+
+        for response in responses:
+            _check_set_response("WireguardUAPISession", response)
+        return result
+
+    def set_config(self, config: WireguardConfig) -> None:
+        self.queue_config(config)
+        self.flush()
+
+    def apply_diff(self, diff: WireguardConfigDiff) -> None:
+        self.queue_diff(diff)
+        self.flush()
+
+
+class AsyncWireguardUAPIDevice(AsyncWireguardDevice):
+    """UAPI device that talks to the socket through asyncio streams."""
+
+    def __init__(
+        self,
+        uapi_path: Path,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ) -> None:
+        super().__init__(uapi_path.stem)
+        self.uapi_path = uapi_path
+        self._reader = reader
+        self._writer = writer
+        self._pending = b""
+        # requests and responses on the socket must not interleave
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    async def connect(
+        cls,
+        uapi_path: str | os.PathLike[str],
+    ) -> AsyncWireguardUAPIDevice:
+        path = _uapi_socket_path(uapi_path)
+        reader, writer = await asyncio.open_unix_connection(str(path.resolve()))
+        return cls(path, reader, writer)
+
+    async def close(self) -> None:
+        self._writer.close()
+        with suppress(ConnectionError):
+            await self._writer.wait_closed()
+
+    async def get_config(self) -> WireguardConfig:
+        return await self._get(_UAPIConfigParser("AsyncWireguardUAPIDevice"))
+
+    async def get_peer_stats(self) -> WireguardPeerStats:
+        return await self._get(_PeerStatsParser("AsyncWireguardUAPIDevice"))
+
+    async def _get(self, parser: _ResponseParser[_T]) -> _T:
+        async with self._lock:
+            self._writer.write(b"get=1\n\n")
+            await self._writer.drain()
+
+            message = self._iter_message()
+            try:
+                async for key, value in message:
+                    parser.feed(key, value)
+            except Exception:
+                # skip the rest of the response, so the next one is read correctly
+                async for _ in message:
+                    pass
+                raise
+            return parser.finish()
+
+    async def set_config(self, config: WireguardConfig) -> None:
+        await self._set(_replace_request(config))
+
+    async def sync_config(self, config: WireguardConfig) -> WireguardConfigDiff:
+        """Apply only the changes between the device and the new configuration."""
+        diff = diff_config(await self.get_config(), config)
+        await self.apply_diff(diff)
+        return diff
+
+    async def apply_diff(self, diff: WireguardConfigDiff) -> None:
+        if diff:
+            await self._set(_set_request(diff))
+
+    async def _set(self, request: bytes) -> None:
+        async with self._lock:
+            self._writer.write(request)
+            await self._writer.drain()
+            response = [item async for item in self._iter_message()]
+        _check_set_response("AsyncWireguardUAPIDevice", response)
+
+    async def _iter_message(self) -> AsyncIterator[tuple[str, str]]:
+        """Yield key/value pairs from a response message as they arrive."""
+        buffer, self._pending = self._pending, b""
+        start = 0
+        while True:
+            end = buffer.find(b"\n", start)
+            if end == -1:
+                data = await self._reader.read(UAPI_RECV_BUFFER_SIZE)
+                if not data:
+                    msg = "AsyncWireguardUAPIDevice connection closed"
+                    raise RuntimeError(msg)
+                buffer = buffer[start:] + data
+                start = 0
+                continue
+
+            line = buffer[start:end]
+            start = end + 1
+            if not line:
+                self._pending = buffer[start:]
+                return
+            key, _, value = line.partition(b"=")
+            yield key.decode("utf-8"), value.decode("utf-8")
+
+    @classmethod
+    async def list(cls) -> AsyncIterator[AsyncWireguardUAPIDevice]:
+        for interface in _uapi_interfaces():
+            yield await cls.connect(interface)
@@ -1,9 +1,55 @@
 # Copyright (c) 2022 Carnegie Mellon University
 # SPDX-License-Identifier: MIT
 
+from __future__ import annotations
+
+from typing import Any
+
 import pytest
 
+from wireguard_tools.wireguard_config import WireguardPeer
+from wireguard_tools.wireguard_key import WireguardKey
+
+
+def pytest_addoption(parser: pytest.Parser) -> None:
+    parser.addoption(
+        "--benchmark",
+        action="store_true",
+        help="run the timing benchmarks marked with @pytest.mark.benchmark",
+    )
+
+
+def pytest_configure(config: pytest.Config) -> None:
+    config.addinivalue_line(
+        "markers",
+        "benchmark: slow timing benchmark, only runs with --benchmark",
+    )
+
+
+def pytest_collection_modifyitems(
+    config: pytest.Config, items: list[pytest.Item]
+) -> None:
+    if config.getoption("--benchmark"):
+        return
+    skip_benchmark = pytest.mark.skip(reason="needs --benchmark to run")
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(skip_benchmark)
+
 
 @pytest.fixture(scope="session")
 def example_wgkey() -> str:
     return "YpdTsMtb/QCdYKzHlzKkLcLzEbdTK0vP4ILmdcIvnhc="
+
+
+def peer_key(index: int) -> WireguardKey:
+    """Public key of the index-th synthetic test peer."""
+    return WireguardKey(index.to_bytes(32, "little"))
+
+
+def make_peer(index: int, **kwargs: Any) -> WireguardPeer:
+    """Synthetic test peer, routing a /32 in 10.0.0.0/8 unless told otherwise."""
+    kwargs.setdefault(
+        "allowed_ips", [f"10.{index >> 16}.{index >> 8 & 255}.{index & 255}/32"]
+    )
+    return WireguardPeer(public_key=peer_key(index), **kwargs)
@@ -3,6 +3,7 @@
 
 from __future__ import annotations
 
+import timeit
 from binascii import hexlify, unhexlify
 from secrets import token_bytes
 from typing import ClassVar
@@ -11,10 +12,13 @@ import pytest
 
 from wireguard_tools.curve25519 import (
     RAW_KEY_LENGTH,
+    P,
     X25519PrivateKey,
+    _raw_curve25519,
     curve25519,
     curve25519_base,
 )
+from wireguard_tools.wireguard_key import WireguardKey
 
 
 class VectorTest:
@@ -216,3 +220,68 @@ class TestGcrypt(VectorTest):
             b"6989e2cb1cea159acf121b0af6bf77493189c9bd32c2dac71669b540f9488247",
         ),
     ]
+
+
+def _reference_curve25519(base: int, n: int) -> int:
+    """Previous ladder implementation, for comparison."""
+
+    def point_add(xn: int, zn: int, xm: int, zm: int) -> tuple[int, int]:
+        x = 4 * (xm * xn - zm * zn) ** 2
+        z = (base << 2) * (xm * zn - zm * xn) ** 2
+        return x % P, z % P
+
+    def point_double(xn: int, zn: int) -> tuple[int, int]:
+        xn2 = xn**2
+        zn2 = zn**2
+        xzn = xn * zn
+        return (xn2 - zn2) ** 2 % P, 4 * xzn * (xn2 + 486662 * xzn + zn2) % P
+
+    mp, m1p = (1, 0), (base, 1)
+    for i in reversed(range(256)):
+        if n & (1 << i):
+            mp, m1p = m1p, mp
+        mp, m1p = point_double(*mp), point_add(*mp, *m1p)
+        if n & (1 << i):
+            mp, m1p = m1p, mp
+    x, z = mp
+    return (x * pow(z, P - 2, P)) % P
+
+
+def random_secrets(count: int) -> list[int]:
+    return [
+        X25519PrivateKey.from_private_bytes(token_bytes(RAW_KEY_LENGTH)).a
+        for _ in range(count)
+    ]
+
+
+def test_ladder_reference() -> None:
+    for secret in random_secrets(20):
+        assert _raw_curve25519(9, secret) == _reference_curve25519(9, secret)
+
+
+@pytest.mark.benchmark
+def test_ladder_benchmark() -> None:
+    secrets = random_secrets(20)
+    current = min(
+        timeit.repeat(lambda: [_raw_curve25519(9, s) for s in secrets], number=1)
+    )
+    reference = min(
+        timeit.repeat(lambda: [_reference_curve25519(9, s) for s in secrets], number=1)
+    )
+    assert current < reference
+
+
+def test_public_key_backends() -> None:
+    x25519 = pytest.importorskip("cryptography.hazmat.primitives.asymmetric.x25519")
+    serialization = pytest.importorskip("cryptography.hazmat.primitives.serialization")
+
+    for _ in range(64):
+        private_bytes = token_bytes(RAW_KEY_LENGTH)
+        fast = (
+            x25519.X25519PrivateKey.from_private_bytes(private_bytes)
+            .public_key()
+            .public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+        )
+        pure = X25519PrivateKey.from_private_bytes(private_bytes).public_key()
+        assert fast == pure
+        assert WireguardKey(private_bytes).public_key().keydata == pure
@@ -0,0 +1,90 @@
+# Copyright (c) 2024 Carnegie Mellon University
+# SPDX-License-Identifier: MIT
+
+from __future__ import annotations
+
+import subprocess
+import sys
+from typing import TYPE_CHECKING
+
+import pytest
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+# modules that only specific code paths should load
+HEAVY_MODULES = ("segno", "pyroute2", "importlib.metadata", "concurrent.futures")
+
+CONFIG = """\
+[Interface]
+PrivateKey = KBbtgEcAZJgIJD5c8YJ3uSGCfBLHxaFTMaVdaNI7xGc=
+Address = 10.0.0.1/24
+
+[Peer]
+PublicKey = 2ZhM4WsrIM5bx9dgkn6cFSDGa/KGgU1xGr0D6cd/31g=
+AllowedIPs = 10.0.0.2/32
+"""
+
+# import wireguard_tools, optionally run `wg-py args...`, and list sys.modules
+LIST_MODULES = """\
+import sys
+
+import wireguard_tools
+
+args = sys.argv[1:]
+if args:
+    from wireguard_tools.cli import main
+
+    sys.argv = ["wg-py", *args]
+    try:
+        main()
+    except SystemExit:
+        pass
+sys.stderr.write("\\n".join(sys.modules))
+"""
+
+
+def loaded_heavy_modules(args: list[str], stdin: str = "") -> list[str]:
+    """Return the heavy modules in sys.modules after running `wg-py args`."""
+    result = subprocess.run(  # noqa: S603
+        [sys.executable, "-c", LIST_MODULES, *args],
+        input=stdin,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return [
+        module
+        for module in result.stderr.splitlines()
+        for heavy in HEAVY_MODULES
+        if module == heavy or module.startswith(f"{heavy}.")
+    ]
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        [],
+        ["genkey"],
+        ["genpsk"],
+        ["pubkey"],
+        ["strip"],
+    ],
+)
+def test_lazy_imports(args: list[str], tmp_path: Path) -> None:
+    stdin = ""
+    if args == ["pubkey"]:
+        stdin = "KBbtgEcAZJgIJD5c8YJ3uSGCfBLHxaFTMaVdaNI7xGc=\n"
+    elif args == ["strip"]:
+        configfile = tmp_path / "wg0.conf"
+        configfile.write_text(CONFIG)
+        args = [*args, str(configfile)]
+
+    assert not loaded_heavy_modules(args, stdin)
+
+
+def test_lazy_imports_version() -> None:
+    # only looking up the package version needs importlib.metadata
+    loaded = loaded_heavy_modules(["--version"])
+    assert "importlib.metadata" in loaded
+    assert all(module.startswith("importlib.metadata") for module in loaded)
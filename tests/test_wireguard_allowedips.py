@@ -0,0 +1,77 @@
+# Copyright (c) 2024 Carnegie Mellon University
+# SPDX-License-Identifier: MIT
+
+from __future__ import annotations
+
+from ipaddress import IPv4Interface, IPv6Interface, ip_interface
+
+import pytest
+
+from wireguard_tools.wireguard_allowedips import PackedAllowedIPs
+from wireguard_tools.wireguard_config import WireguardPeer
+from wireguard_tools.wireguard_diff import diff_peer
+from wireguard_tools.wireguard_key import WireguardKey
+
+ALLOWED_IPS = ["10.0.0.1/32", "10.2.0.1/16", "2001:db8:1::1/64", "0.0.0.0/0"]
+
+
+def test_sequence() -> None:
+    interfaces = [ip_interface(addr) for addr in ALLOWED_IPS]
+    packed = PackedAllowedIPs(ALLOWED_IPS)
+
+    assert len(packed) == 4
+    assert list(packed) == interfaces
+    assert packed == interfaces
+    assert packed[1] == IPv4Interface("10.2.0.1/16")
+    assert packed[-2] == IPv6Interface("2001:db8:1::1/64")
+    assert packed[1:3] == interfaces[1:3]
+    with pytest.raises(IndexError):
+        packed[4]
+
+    packed.append(IPv6Interface("::/0"))
+    packed.insert(0, IPv4Interface("192.0.2.1/24"))
+    del packed[2]
+    packed[-1] = IPv6Interface("fd00::/8")
+    assert [str(addr) for addr in packed] == [
+        "192.0.2.1/24",
+        "10.0.0.1/32",
+        "2001:db8:1::1/64",
+        "0.0.0.0/0",
+        "fd00::/8",
+    ]
+    del packed[1:3]
+    assert packed == PackedAllowedIPs(["192.0.2.1/24", "0.0.0.0/0", "fd00::/8"])
+    assert packed != PackedAllowedIPs(["192.0.2.1/24"])
+
+
+def test_networks() -> None:
+    packed = PackedAllowedIPs(ALLOWED_IPS)
+    # host bits are masked
+    assert packed.networks() == {
+        (4, 0x0A000001, 32),
+        (4, 0x0A020000, 16),
+        (6, 0x20010DB8000100000000000000000000, 64),
+        (4, 0, 0),
+    }
+
+
+def test_peer_allowed_ips() -> None:
+    public_key = WireguardKey(bytes(range(32)))
+    peer = WireguardPeer(public_key=public_key, allowed_ips=ALLOWED_IPS)
+    packed_peer = WireguardPeer(
+        public_key=public_key,
+        allowed_ips=PackedAllowedIPs(ALLOWED_IPS),
+    )
+    assert isinstance(packed_peer.allowed_ips, PackedAllowedIPs)
+    assert packed_peer == peer
+    assert packed_peer.asdict() == peer.asdict()
+    assert str(packed_peer) == str(peer)
+    assert packed_peer.to_bytes() == peer.to_bytes()
+    assert diff_peer(peer, packed_peer) is None
+    assert diff_peer(packed_peer, packed_peer) is None
+
+    packed_peer.allowed_ips.append(IPv4Interface("10.3.0.0/16"))
+    delta = diff_peer(peer, packed_peer)
+    assert delta is not None
+    assert not delta.replace_allowed_ips
+    assert delta.allowed_ips == [IPv4Interface("10.3.0.0/16")]
@@ -0,0 +1,106 @@
+# Copyright (c) 2024 Carnegie Mellon University
+# SPDX-License-Identifier: MIT
+
+from __future__ import annotations
+
+from io import StringIO
+
+import pytest
+
+from wireguard_tools import wireguard_binary
+from wireguard_tools.wireguard_allowedips import PackedAllowedIPs
+from wireguard_tools.wireguard_config import WireguardConfig, WireguardPeer
+
+CONFIG = """\
+[Interface]
+PrivateKey = DnLEmfJzVoCRJYXzdSXIhTqnjygnhh6O+I3ErMS6OUg=
+ListenPort = 51820
+FwMark = 4660
+Address = 10.0.0.2/32, 2001:db8:1::2/128
+DNS = 10.0.0.1, 2001:db8::53, test.svc.cluster.local
+MTU = 1420
+Table = off
+PreUp = echo preup
+PostDown = echo postdown
+SaveConfig = true
+
+[Peer]
+# friendly_name = Friendly Peer
+# friendly_json = {"mood": "happy", "attitude": 1}
+PublicKey = ba8AwcolBVDuhR/MKFU8O6CZrAjh7c20h6EOnQx0VRE=
+PresharedKey = YpdTsMtb/QCdYKzHlzKkLcLzEbdTK0vP4ILmdcIvnhc=
+Endpoint = [2001:db8::1]:51820
+PersistentKeepalive = 30
+AllowedIPs = 10.0.0.1/32, 10.2.0.1/16, 2001:db8:1::1/64
+
+[Peer]
+PublicKey = ZZ8AwcolBVDuhR/MKFU8O6CZrAjh7c20h6EOnQx0VRE=
+Endpoint = vpn.example.com:51820
+
+[Peer]
+PublicKey = YY8AwcolBVDuhR/MKFU8O6CZrAjh7c20h6EOnQx0VRE=
+Endpoint = 192.0.2.1:65535
+AllowedIPs = 0.0.0.0/0
+"""
+
+
+@pytest.fixture
+def wgconfig() -> WireguardConfig:
+    return WireguardConfig.from_wgconfig(StringIO(CONFIG))
+
+
+def test_config_roundtrip(wgconfig: WireguardConfig) -> None:
+    data = wgconfig.to_bytes()
+    assert data.startswith(wireguard_binary.BINARY_MAGIC)
+    assert len(data) < len(CONFIG) * 2 // 3
+
+    config = WireguardConfig.from_bytes(data)
+    assert config == wgconfig
+    assert config.to_wgconfig(wgquick_format=True) == wgconfig.to_wgconfig(
+        wgquick_format=True,
+    )
+
+
+def test_peer_roundtrip(wgconfig: WireguardConfig) -> None:
+    for peer in wgconfig.peers.values():
+        peer.last_handshake = 1700000000.5
+        peer.rx_bytes = 1 << 40
+        peer.tx_bytes = 0
+        decoded = WireguardPeer.from_bytes(peer.to_bytes())
+        assert decoded == peer
+        assert isinstance(decoded.allowed_ips, PackedAllowedIPs)
+        assert list(decoded.allowed_ips) == peer.allowed_ips
+        assert decoded.friendly_json == peer.friendly_json
+        assert decoded.last_handshake == peer.last_handshake
+        assert decoded.rx_bytes == peer.rx_bytes
+        assert decoded.tx_bytes == peer.tx_bytes
+
+
+def test_from_memoryview(wgconfig: WireguardConfig) -> None:
+    # records embedded in a larger buffer are decoded in place
+    data = wgconfig.to_bytes()
+    buffer = bytearray(b"header" + data + b"trailer")
+    view = memoryview(buffer)[6 : 6 + len(data)]
+    assert WireguardConfig.from_bytes(view) == wgconfig
+
+
+def test_invalid_data(wgconfig: WireguardConfig) -> None:
+    data = wgconfig.to_bytes()
+    with pytest.raises(ValueError, match="Not a binary"):
+        WireguardConfig.from_bytes(b"[Interface]\n")
+    with pytest.raises(ValueError, match="Unsupported binary format version"):
+        WireguardConfig.from_bytes(data[:4] + b"\xff" + data[5:])
+    with pytest.raises(ValueError, match="Unexpected binary record type"):
+        WireguardPeer.from_bytes(data)
+    with pytest.raises(ValueError, match="Truncated"):
+        WireguardConfig.from_bytes(data[:-1])
+    with pytest.raises(ValueError, match="trailing data"):
+        WireguardConfig.from_bytes(data + b"\0")
+
+    # an allowed IP with a prefix length that does not fit its family
+    peer = next(iter(wgconfig.peers.values()))
+    peer_data = bytearray(peer.to_bytes())
+    prefixlen = peer_data.index(bytes([4, 32, 10, 0, 0, 1])) + 1
+    peer_data[prefixlen] = 33
+    with pytest.raises(ValueError, match="Invalid allowed IP"):
+        WireguardPeer.from_bytes(peer_data)
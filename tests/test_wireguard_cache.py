@@ -0,0 +1,188 @@
+# Copyright (c) 2024 Carnegie Mellon University
+# SPDX-License-Identifier: MIT
+
+from __future__ import annotations
+
+import gc
+import os
+from io import StringIO
+from typing import TYPE_CHECKING, Any
+
+import pytest
+
+from wireguard_tools import wireguard_cache
+from wireguard_tools.wireguard_cache import _gc_paused, load_wgconfig
+from wireguard_tools.wireguard_config import WireguardConfig
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+CONFIG = """\
+[Interface]
+PrivateKey = DnLEmfJzVoCRJYXzdSXIhTqnjygnhh6O+I3ErMS6OUg=
+ListenPort = 51820
+Address = 10.0.0.2/32, 2001:db8:1::2/128
+DNS = 10.0.0.1, test.svc.cluster.local
+PostUp = echo up
+
+[Peer]
+# friendly_name = Friendly Peer
+# friendly_json = {"mood": "happy"}
+PublicKey = ba8AwcolBVDuhR/MKFU8O6CZrAjh7c20h6EOnQx0VRE=
+PresharedKey = YpdTsMtb/QCdYKzHlzKkLcLzEbdTK0vP4ILmdcIvnhc=
+Endpoint = [2001:db8::1]:51820
+PersistentKeepalive = 30
+AllowedIPs = 10.0.0.1/32, 2001:db8:1::1/64
+
+[Peer]
+PublicKey = ZZ8AwcolBVDuhR/MKFU8O6CZrAjh7c20h6EOnQx0VRE=
+Endpoint = vpn.example.com:51820
+AllowedIPs = 10.1.0.0/16
+"""
+
+
+class CountingParser:
+    """Count how often the text parser runs instead of the cached snapshot."""
+
+    def __init__(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        self.calls = 0
+        self.parse = WireguardConfig.from_wgconfig
+        monkeypatch.setattr(WireguardConfig, "from_wgconfig", self)
+
+    def __call__(self, *args: Any) -> WireguardConfig:
+        self.calls += 1
+        return self.parse(*args)
+
+
+@pytest.fixture
+def configfile(tmp_path: Path) -> Path:
+    path = tmp_path / "wg0.conf"
+    path.write_text(CONFIG)
+    return path
+
+
+@pytest.fixture
+def cache_dir(tmp_path: Path) -> Path:
+    return tmp_path / "cache"
+
+
+def test_cached_load(
+    configfile: Path,
+    cache_dir: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    expected = WireguardConfig.from_wgconfig(StringIO(CONFIG))
+    parser = CountingParser(monkeypatch)
+
+    assert load_wgconfig(configfile, cache_dir) == expected
+    assert parser.calls == 1
+
+    config = load_wgconfig(configfile, cache_dir)
+    assert parser.calls == 1
+    assert config == expected
+    assert config.to_wgconfig(wgquick_format=True) == expected.to_wgconfig(
+        wgquick_format=True,
+    )
+
+    (snapshot,) = cache_dir.iterdir()
+    assert cache_dir.stat().st_mode & 0o777 == 0o700
+    assert snapshot.stat().st_mode & 0o777 == 0o600
+
+
+def test_invalidation(
+    configfile: Path,
+    cache_dir: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    parser = CountingParser(monkeypatch)
+    load_wgconfig(configfile, cache_dir)
+
+    # same size and mtime, different content
+    stat = configfile.stat()
+    configfile.write_text(CONFIG.replace("51820", "51821", 1))
+    os.utime(configfile, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert load_wgconfig(configfile, cache_dir).listen_port == 51821
+    assert parser.calls == 2
+
+    monkeypatch.setattr(wireguard_cache, "CACHE_FORMAT_VERSION", 0)
+    load_wgconfig(configfile, cache_dir)
+    assert parser.calls == 3
+
+
+def test_ignore_untrusted_snapshot(
+    configfile: Path,
+    cache_dir: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    parser = CountingParser(monkeypatch)
+    load_wgconfig(configfile, cache_dir)
+
+    (snapshot,) = cache_dir.iterdir()
+    snapshot.chmod(0o666)
+    load_wgconfig(configfile, cache_dir)
+    assert parser.calls == 2
+
+
+def test_corrupt_snapshot(
+    configfile: Path,
+    cache_dir: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    parser = CountingParser(monkeypatch)
+    load_wgconfig(configfile, cache_dir)
+
+    (snapshot,) = cache_dir.iterdir()
+    data = snapshot.read_bytes()
+    snapshot.write_bytes(data[:-10])
+    assert load_wgconfig(configfile, cache_dir).listen_port == 51820
+    assert parser.calls == 2
+
+
+def test_open_configfile(
+    configfile: Path,
+    cache_dir: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    parser = CountingParser(monkeypatch)
+    load_wgconfig(configfile, cache_dir)
+
+    # the open file is read even when its path now names another file
+    replacement = configfile.with_name("wg0.conf.new")
+    replacement.write_text(CONFIG.replace("51820", "51821", 1))
+    with configfile.open("rb") as opened:
+        replacement.replace(configfile)
+        config = load_wgconfig(configfile, cache_dir, configfile=opened)
+    assert config.listen_port == 51820
+    assert parser.calls == 1
+
+    # pipes, such as /dev/fd/N arguments, bypass the cache
+    read_fd, write_fd = os.pipe()
+    os.write(write_fd, CONFIG.encode())
+    os.close(write_fd)
+    with os.fdopen(read_fd, "rb") as pipe:
+        config = load_wgconfig(f"/dev/fd/{read_fd}", cache_dir, configfile=pipe)
+    assert config.listen_port == 51820
+    assert parser.calls == 2
+    assert len(list(cache_dir.iterdir())) == 1
+
+
+def test_pause_gc(configfile: Path, cache_dir: Path) -> None:
+    expected = load_wgconfig(configfile, cache_dir)
+    assert load_wgconfig(configfile, cache_dir, pause_gc=True) == expected
+    assert gc.isenabled()
+
+    # only the outermost pause re-enables the collector
+    with _gc_paused():
+        with _gc_paused():
+            assert not gc.isenabled()
+        assert not gc.isenabled()
+    assert gc.isenabled()
+
+    # and a collector that was already disabled stays disabled
+    gc.disable()
+    try:
+        with _gc_paused():
+            pass
+        assert not gc.isenabled()
+    finally:
+        gc.enable()
@@ -1,12 +1,16 @@
 # Copyright (c) 2022-2024 Carnegie Mellon University
 # SPDX-License-Identifier: MIT
 
+import time
+import tracemalloc
+import weakref
 from io import StringIO
 from ipaddress import IPv4Address, IPv4Interface, IPv6Address, IPv6Interface
+from typing import Iterator
 
 import pytest
 
-from wireguard_tools.wireguard_config import WireguardConfig
+from wireguard_tools.wireguard_config import WireguardConfig, WireguardPeer
 from wireguard_tools.wireguard_key import WireguardKey
 
 IFNAME = "wg-test"
@@ -178,3 +182,227 @@ def test_wgconfig_ipv6_addresses() -> None:
     assert len(peer.allowed_ips) == 2
     assert IPv4Interface("10.0.0.1/32") in peer.allowed_ips
     assert IPv6Interface("2001:db8:1::1/64") in peer.allowed_ips
+
+
+def test_peer_from_trusted() -> None:
+    peer = WireguardPeer(
+        public_key="ba8AwcolBVDuhR/MKFU8O6CZrAjh7c20h6EOnQx0VRE=",
+        endpoint_host="2001:db8::1",
+        endpoint_port=51820,
+        persistent_keepalive=30,
+        allowed_ips=["10.0.0.1/32", "2001:db8:1::1/64"],
+        rx_bytes=1024,
+    )
+    trusted = WireguardPeer.from_trusted(
+        WireguardKey("ba8AwcolBVDuhR/MKFU8O6CZrAjh7c20h6EOnQx0VRE="),
+        endpoint_host=IPv6Address("2001:db8::1"),
+        endpoint_port=51820,
+        persistent_keepalive=30,
+        allowed_ips=[IPv4Interface("10.0.0.1/32"), IPv6Interface("2001:db8:1::1/64")],
+        rx_bytes=1024,
+    )
+    assert trusted == peer
+    assert trusted.rx_bytes == peer.rx_bytes
+    assert trusted.friendly_name is None
+
+    # later updates still go through the converters
+    trusted.endpoint_port = "51821"  # type: ignore[assignment]
+    assert trusted.endpoint_port == 51821
+
+    # peers can still be weakly referenced
+    assert weakref.ref(trusted)() is trusted
+
+
+def test_wgconfig_parser_edge_cases() -> None:
+    conffile = StringIO(
+        """\
+# leading comments and settings outside of a section are ignored
+ListenPort = 1
+
+[peer]
+PublicKey=ba8AwcolBVDuhR/MKFU8O6CZrAjh7c20h6EOnQx0VRE=
+# PersistentKeepalive = 25
+AllowedIPs = 10.0.0.1/32
+AllowedIPs = 10.1.0.0/16, 2001:db8:1::/64
+
+[INTERFACE]
+  ListenPort   =   51820
+""",
+    )
+    wgconfig = WireguardConfig.from_wgconfig(conffile)
+    assert wgconfig.listen_port == 51820
+
+    (peer,) = wgconfig.peers.values()
+    assert peer.persistent_keepalive is None
+    assert peer.allowed_ips == [
+        IPv4Interface("10.0.0.1/32"),
+        IPv4Interface("10.1.0.0/16"),
+        IPv6Interface("2001:db8:1::/64"),
+    ]
+
+
+def test_wgconfig_parser_errors() -> None:
+    with pytest.raises(ValueError, match="More than one"):
+        WireguardConfig.from_wgconfig(StringIO("[Interface]\n[Interface]\n"))
+    with pytest.raises(ValueError, match="without a PublicKey"):
+        WireguardConfig.from_wgconfig(StringIO("[Peer]\nAllowedIPs = 10.0.0.1/32\n"))
+
+
+def synthetic_wgconfig(npeers: int) -> str:
+    lines = [
+        "[Interface]",
+        "PrivateKey = DnLEmfJzVoCRJYXzdSXIhTqnjygnhh6O+I3ErMS6OUg=",
+        "ListenPort = 51820",
+    ]
+    for index in range(npeers):
+        public_key = WireguardKey(index.to_bytes(32, "little"))
+        lines.extend(
+            [
+                "",
+                "[Peer]",
+                f"# friendly_name = peer{index}",
+                f"PublicKey = {public_key}",
+                f"Endpoint = 192.0.2.{index % 256}:51820",
+                "PersistentKeepalive = 25",
+                (
+                    f"AllowedIPs = 10.{index >> 16}.{index >> 8 & 255}.{index & 255}/32"
+                    f", fd00::{index >> 16:x}:{index & 0xFFFF:x}/128"
+                ),
+            ],
+        )
+    return "\n".join(lines)
+
+
+def test_wgconfig_parser_synthetic() -> None:
+    # the single-pass parser builds the same peers as the converting constructor
+    wgconfig = WireguardConfig.from_wgconfig(StringIO(synthetic_wgconfig(300)))
+    assert len(wgconfig.peers) == 300
+    for index, peer in enumerate(wgconfig.peers.values()):
+        assert peer == WireguardPeer(
+            public_key=WireguardKey(index.to_bytes(32, "little")),
+            endpoint_host=f"192.0.2.{index % 256}",
+            endpoint_port=51820,
+            persistent_keepalive=25,
+            allowed_ips=[
+                f"10.{index >> 16}.{index >> 8 & 255}.{index & 255}/32",
+                f"fd00::{index >> 16:x}:{index & 0xFFFF:x}/128",
+            ],
+            friendly_name=f"peer{index}",
+        )
+
+
+@pytest.mark.benchmark
+def test_wgconfig_parser_benchmark() -> None:
+    # parse time per peer should not grow with the size of the file
+    per_peer = {}
+    for npeers in [1000, 10000, 100000]:
+        conffile = StringIO(synthetic_wgconfig(npeers))
+        start = time.perf_counter()
+        wgconfig = WireguardConfig.from_wgconfig(conffile)
+        per_peer[npeers] = (time.perf_counter() - start) / npeers
+        assert len(wgconfig.peers) == npeers
+    assert per_peer[100000] < 4 * per_peer[1000]
+
+
+def test_iter_wgconfig(wgconfig: WireguardConfig) -> None:
+    records = WireguardConfig.iter_wgconfig(StringIO(TUNNEL_WGQUICK))
+    interface = next(records)
+    assert isinstance(interface, WireguardConfig)
+    assert not interface.peers
+    assert interface.dns_servers == wgconfig.dns_servers
+
+    peers = [peer for peer in records if isinstance(peer, WireguardPeer)]
+    assert peers == list(wgconfig.peers.values())
+
+    output = StringIO()
+    interface.write_wgconfig(output, peers, wgquick_format=True)
+    assert output.getvalue() == TUNNEL_WGQUICK
+
+
+def test_iter_wgconfig_interface_last() -> None:
+    conffile = """\
+[Peer]
+PublicKey = AQAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA=
+AllowedIPs = 10.0.0.1/32
+
+[Interface]
+PrivateKey = KBbtgEcAZJgIJD5c8YJ3uSGCfBLHxaFTMaVdaNI7xGc=
+ListenPort = 51820
+"""
+    wgconfig = WireguardConfig.from_wgconfig(StringIO(conffile))
+    records = WireguardConfig.iter_wgconfig(StringIO(conffile))
+    interface = next(records)
+    assert isinstance(interface, WireguardConfig)
+    assert interface.private_key == wgconfig.private_key
+    assert interface.listen_port == 51820
+
+    peers = [peer for peer in records if isinstance(peer, WireguardPeer)]
+    assert peers == list(wgconfig.peers.values())
+
+    output = StringIO()
+    interface.write_wgconfig(output, peers)
+    assert output.getvalue() == wgconfig.to_wgconfig()
+
+
+def test_write_wgconfig(wgconfig: WireguardConfig) -> None:
+    output = StringIO()
+    wgconfig.write_wgconfig(output)
+    assert output.getvalue() == TUNNEL_WGCONFIG
+
+    chunks = list(wgconfig.iter_wgconfig_lines(wgquick_format=True))
+    assert len(chunks) == 1 + len(wgconfig.peers)
+    assert all(chunk.endswith("\n") for chunk in chunks)
+    assert "".join(chunks) == TUNNEL_WGQUICK
+
+
+def test_write_wgconfig_buffered() -> None:
+    wgconfig = WireguardConfig.from_wgconfig(StringIO(synthetic_wgconfig(1000)))
+
+    class RecordingWriter:
+        def __init__(self) -> None:
+            self.writes: list[str] = []
+
+        def write(self, data: str) -> None:
+            self.writes.append(data)
+
+    output = RecordingWriter()
+    wgconfig.write_wgconfig(output)  # type: ignore[arg-type]
+    assert "".join(output.writes) == wgconfig.to_wgconfig()
+    # a few large writes instead of one per line or per peer
+    assert 1 < len(output.writes) < len(wgconfig.peers) // 10
+
+
+def test_iter_wgconfig_constant_memory() -> None:
+    def conffile(npeers: int) -> Iterator[str]:
+        yield "[Interface]\n"
+        yield "ListenPort = 51820\n"
+        for index in range(npeers):
+            yield "[Peer]\n"
+            yield f"PublicKey = {WireguardKey(index.to_bytes(32, 'little'))}\n"
+            yield f"AllowedIPs = 10.{index >> 16}.{index >> 8 & 255}.{index & 255}/32\n"
+
+    class CountingWriter:
+        length = 0
+
+        def write(self, data: str) -> None:
+            self.length += len(data)
+
+    npeers = 3000
+    tracemalloc.start()
+    try:
+        records = WireguardConfig.iter_wgconfig(conffile(npeers))
+        interface = next(records)
+        assert isinstance(interface, WireguardConfig)
+        output = CountingWriter()
+        interface.write_wgconfig(
+            output,  # type: ignore[arg-type]
+            (peer for peer in records if isinstance(peer, WireguardPeer)),
+        )
+        _current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert output.length > npeers * 80
+    # a parsed peer takes close to a kilobyte, holding on to all of them would
+    # push the peak well past this per-peer bound
+    assert peak < npeers * 100
@@ -0,0 +1,139 @@
+# Copyright (c) 2024 Carnegie Mellon University
+# SPDX-License-Identifier: MIT
+
+from __future__ import annotations
+
+from ipaddress import IPv4Interface
+from typing import TYPE_CHECKING
+
+from wireguard_tools.wireguard_allowedips import PackedAllowedIPs
+from wireguard_tools.wireguard_config import WireguardConfig, WireguardPeer
+from wireguard_tools.wireguard_diff import ZERO_KEY, diff_config
+
+from .conftest import make_peer
+
+if TYPE_CHECKING:
+    import pytest
+
+PRIVATE_KEY = "DnLEmfJzVoCRJYXzdSXIhTqnjygnhh6O+I3ErMS6OUg="
+PRESHARED_KEY = "YpdTsMtb/QCdYKzHlzKkLcLzEbdTK0vP4ILmdcIvnhc="
+
+
+def make_config(*peers: WireguardPeer, listen_port: int = 51820) -> WireguardConfig:
+    config = WireguardConfig(private_key=PRIVATE_KEY, listen_port=listen_port)
+    for peer in peers:
+        config.add_peer(peer)
+    return config
+
+
+def test_identical_configs() -> None:
+    current = make_config(make_peer(1), make_peer(2))
+    new = make_config(make_peer(1), make_peer(2))
+    diff = diff_config(current, new)
+    assert not diff
+    assert str(diff) == (
+        "device unchanged, 0 peers added, 0 peers removed, 0 peers changed"
+    )
+
+
+def test_ignores_statistics_and_friendly_tags() -> None:
+    current = make_config(make_peer(1, rx_bytes=1000, last_handshake=1.5))
+    new = make_config(make_peer(1, friendly_name="Friendly Peer"))
+    assert not diff_config(current, new)
+
+
+def test_device_changes() -> None:
+    current = make_config(listen_port=51820)
+    new = make_config(listen_port=51821)
+    new.fwmark = None
+    diff = diff_config(current, new)
+    assert diff.device_changed
+    assert diff.private_key is None
+    assert diff.listen_port == 51821
+    assert diff.fwmark is None
+    assert not diff.peers
+
+
+def test_added_removed_changed() -> None:
+    current = make_config(make_peer(1), make_peer(2), make_peer(3))
+    new = make_config(
+        make_peer(2),
+        make_peer(3, persistent_keepalive=25),
+        make_peer(4),
+    )
+    diff = diff_config(current, new)
+
+    assert [delta.public_key for delta in diff.removed] == [make_peer(1).public_key]
+    assert [delta.public_key for delta in diff.added] == [make_peer(4).public_key]
+    assert [delta.public_key for delta in diff.changed] == [make_peer(3).public_key]
+    assert str(diff) == (
+        "device unchanged, 1 peers added, 1 peers removed, 1 peers changed"
+    )
+
+    (changed,) = diff.changed
+    assert changed.persistent_keepalive == 25
+    assert changed.preshared_key is None
+    assert changed.endpoint_host is None
+    assert not changed.replace_allowed_ips
+    assert not changed.allowed_ips
+
+
+def test_clear_preshared_key_and_keepalive() -> None:
+    current = make_config(
+        make_peer(1, preshared_key=PRESHARED_KEY, persistent_keepalive=25),
+    )
+    new = make_config(make_peer(1))
+    (delta,) = diff_config(current, new).changed
+    assert delta.preshared_key == ZERO_KEY
+    assert delta.persistent_keepalive == 0
+
+
+def test_allowed_ips_added() -> None:
+    current = make_config(make_peer(1, allowed_ips=["10.0.0.1/32"]))
+    new = make_config(make_peer(1, allowed_ips=["10.0.0.1/32", "10.1.0.0/16"]))
+    (delta,) = diff_config(current, new).changed
+    assert not delta.replace_allowed_ips
+    assert delta.allowed_ips == [IPv4Interface("10.1.0.0/16")]
+
+
+def test_allowed_ips_replaced() -> None:
+    current = make_config(make_peer(1, allowed_ips=["10.0.0.1/32", "10.1.0.0/16"]))
+    new = make_config(make_peer(1, allowed_ips=["10.0.0.1/32"]))
+    (delta,) = diff_config(current, new).changed
+    assert delta.replace_allowed_ips
+    assert delta.allowed_ips == [IPv4Interface("10.0.0.1/32")]
+
+
+def test_allowed_ips_compare_networks() -> None:
+    # the kernel reports masked networks, config files may contain host bits
+    current = make_config(make_peer(1, allowed_ips=["10.2.0.0/16"]))
+    new = make_config(make_peer(1, allowed_ips=["10.2.0.1/16"]))
+    assert not diff_config(current, new)
+
+
+def test_packed_allowed_ips(monkeypatch: pytest.MonkeyPatch) -> None:
+    allowed_ips = [f"10.{index // 256}.{index % 256}.0/24" for index in range(4096)]
+    current = make_config(make_peer(1, allowed_ips=PackedAllowedIPs(allowed_ips)))
+
+    # host bits are masked before comparing
+    same = PackedAllowedIPs(allowed_ips)
+    same[100] = IPv4Interface("10.0.100.1/24")
+    assert not diff_config(current, make_config(make_peer(1, allowed_ips=same)))
+
+    # one changed prefix replaces the allowed ips
+    changed = PackedAllowedIPs(allowed_ips)
+    changed[100] = IPv4Interface("10.0.100.0/25")
+    (delta,) = diff_config(
+        current, make_config(make_peer(1, allowed_ips=changed))
+    ).changed
+    assert delta.replace_allowed_ips
+    assert delta.allowed_ips == changed
+
+    # an addition only creates an object for the new entry
+    added = PackedAllowedIPs(allowed_ips)
+    added.append(IPv4Interface("10.16.0.0/24"))
+    new = make_config(make_peer(1, allowed_ips=added))
+    monkeypatch.setattr(PackedAllowedIPs, "__iter__", None)
+    (delta,) = diff_config(current, new).changed
+    assert not delta.replace_allowed_ips
+    assert delta.allowed_ips == [IPv4Interface("10.16.0.0/24")]
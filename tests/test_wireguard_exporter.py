@@ -0,0 +1,179 @@
+# Copyright (c) 2024 Carnegie Mellon University
+# SPDX-License-Identifier: MIT
+
+from __future__ import annotations
+
+import threading
+from io import StringIO
+from typing import ClassVar
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import pytest
+
+from wireguard_tools.wireguard_config import WireguardConfig
+from wireguard_tools.wireguard_device import WireguardDevice
+from wireguard_tools.wireguard_exporter import CONTENT_TYPE, WireguardExporter
+from wireguard_tools.wireguard_stats import WireguardPeerStats
+
+from .conftest import make_peer, peer_key
+
+CONFIG = """\
+[Interface]
+PrivateKey = KBbtgEcAZJgIJD5c8YJ3uSGCfBLHxaFTMaVdaNI7xGc=
+
+[Peer]
+# friendly_name = Peer "one"
+# friendly_json = {"user": "alice", "device-id": 7, "device_id": 8, "interface": "x"}
+PublicKey = AQAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA=
+AllowedIPs = 10.0.0.1/32
+"""
+
+
+class FakeDevice(WireguardDevice):
+    """Device that only answers get_peer_stats."""
+
+    stats: ClassVar[dict[str, WireguardPeerStats]] = {}
+
+    def get_config(self) -> WireguardConfig:
+        raise NotImplementedError
+
+    def set_config(self, config: WireguardConfig) -> None:
+        raise NotImplementedError
+
+    def get_peer_stats(self) -> WireguardPeerStats:
+        try:
+            return self.stats[self.interface]
+        except KeyError:
+            msg = f"Unable to access interface: {self.interface}"
+            raise RuntimeError(msg) from None
+
+
+def make_stats(npeers: int, rx_bytes: int = 0) -> WireguardPeerStats:
+    stats = WireguardPeerStats()
+    for index in range(npeers):
+        stats.append(peer_key(index).keydata, rx_bytes, 2 * index, 0.0)
+    return stats
+
+
+@pytest.fixture
+def devices(monkeypatch: pytest.MonkeyPatch) -> dict[str, WireguardPeerStats]:
+    devices = {"wg0": make_stats(3), "wg1": make_stats(2)}
+    monkeypatch.setattr(FakeDevice, "stats", devices)
+    monkeypatch.setattr(
+        WireguardDevice,
+        "list_interfaces",
+        classmethod(lambda _: list(devices)),
+    )
+    monkeypatch.setattr(
+        WireguardDevice,
+        "get",
+        classmethod(lambda _, interface, timeout=None: FakeDevice(interface)),  # noqa: ARG005
+    )
+    return devices
+
+
+def test_poll(devices: dict[str, WireguardPeerStats]) -> None:
+    configs = {"wg0": WireguardConfig.from_wgconfig(StringIO(CONFIG))}
+    exporter = WireguardExporter(configs=configs)
+    assert exporter.poll() == 5
+    lines = exporter.metrics().decode().splitlines()
+    assert lines[:2] == [
+        "# HELP wireguard_sent_bytes_total Bytes sent to the peer",
+        "# TYPE wireguard_sent_bytes_total counter",
+    ]
+    assert len(lines) == 3 * (2 + 5) + (2 + 2) + (2 + 1)
+    assert (
+        'wireguard_received_bytes_total{interface="wg0",'
+        f'public_key="{peer_key(1)}",friendly_name="Peer \\"one\\"",'
+        'user="alice",device_id="7"} 0'
+    ) in lines
+    assert (
+        f'wireguard_sent_bytes_total{{interface="wg1",public_key="{peer_key(1)}"}} 2'
+    ) in lines
+
+    # nothing changed, the cached text is kept
+    text = exporter.metrics()
+    assert exporter.poll() == 0
+    assert exporter.metrics() is text
+
+    # only the peers of wg0 changed and a peer of wg1 is gone
+    devices["wg0"] = make_stats(3, rx_bytes=100)
+    devices["wg1"] = make_stats(1)
+    assert exporter.poll() == 3
+    lines = exporter.metrics().decode().splitlines()
+    assert len(lines) == 3 * (2 + 4) + (2 + 2) + (2 + 1)
+    assert sum(line.endswith(" 100") for line in lines) == 3
+    assert not any(f'"wg1",public_key="{peer_key(1)}"' in line for line in lines)
+
+
+@pytest.mark.usefixtures("devices")
+def test_label_names() -> None:
+    config = WireguardConfig()
+    config.add_peer(
+        make_peer(
+            1,
+            friendly_json={"1st": "a", "__name__": "b", "__": "c", "": "d", "ok": "e"},
+        ),
+    )
+    exporter = WireguardExporter(["wg0"], configs={"wg0": config})
+    exporter.poll()
+    lines = exporter.metrics().decode().splitlines()
+    assert (
+        f'wireguard_sent_bytes_total{{interface="wg0",public_key="{peer_key(1)}",'
+        '_1st="a",ok="e"} 2'
+    ) in lines
+
+
+@pytest.mark.usefixtures("devices")
+def test_poll_errors(devices: dict[str, WireguardPeerStats]) -> None:
+    exporter = WireguardExporter(["wg1", "wg2"])
+    assert exporter.poll() == 2
+    assert list(exporter.errors) == ["wg2"]
+    lines = exporter.metrics().decode().splitlines()
+    assert not any('interface="wg0"' in line for line in lines)
+    assert 'wireguard_device_up{interface="wg1"} 1' in lines
+    assert 'wireguard_device_up{interface="wg2"} 0' in lines
+    assert "wireguard_poll_errors_total 0" in lines
+
+    # a device that starts failing drops its peers from the output
+    del devices["wg1"]
+    assert exporter.poll() == 0
+    lines = exporter.metrics().decode().splitlines()
+    assert 'wireguard_device_up{interface="wg1"} 0' in lines
+    assert not any(line.startswith("wireguard_sent_bytes_total{") for line in lines)
+
+
+def test_poll_list_error(monkeypatch: pytest.MonkeyPatch) -> None:
+    def list_interfaces(_: object) -> list[str]:
+        msg = "Unable to list interfaces"
+        raise RuntimeError(msg)
+
+    monkeypatch.setattr(
+        WireguardDevice, "list_interfaces", classmethod(list_interfaces)
+    )
+    exporter = WireguardExporter()
+    with pytest.raises(RuntimeError, match="Unable to list"):
+        exporter.poll()
+    assert exporter.poll_errors == 1
+    assert b"\nwireguard_poll_errors_total 1\n" in exporter.metrics()
+
+
+@pytest.mark.usefixtures("devices")
+def test_http() -> None:
+    exporter = WireguardExporter()
+    exporter.poll()
+    server = exporter.make_server("127.0.0.1", 0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        with urlopen(f"{url}/metrics") as response:  # noqa: S310
+            assert response.headers["Content-Type"] == CONTENT_TYPE
+            assert response.read() == exporter.metrics()
+        with pytest.raises(HTTPError, match="404"):
+            urlopen(f"{url}/")  # noqa: S310
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
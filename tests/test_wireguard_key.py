@@ -1,9 +1,17 @@
 # Copyright (c) 2022 Carnegie Mellon University
 # SPDX-License-Identifier: MIT
 
+from concurrent.futures import ProcessPoolExecutor
+
 import pytest
 
-from wireguard_tools.wireguard_key import WireguardKey
+from wireguard_tools import wireguard_key
+from wireguard_tools.wireguard_key import (
+    WireguardKey,
+    derive_public_keys,
+    derive_public_keys_parallel,
+    public_key_executor,
+)
 
 
 def urlsafe_encoding(key: str) -> str:
@@ -21,3 +29,71 @@ class TestWireguardKey:
 
         with pytest.raises(ValueError, match="Invalid WireGuard key length"):
             WireguardKey("foobar")
+
+    def test_cached_encodings(self, example_wgkey: str) -> None:
+        stored_key = WireguardKey(example_wgkey)
+        encoded = str(stored_key)
+        assert str(stored_key) is encoded
+        assert stored_key.hex is stored_key.hex
+        assert stored_key.urlsafe is stored_key.urlsafe
+        assert WireguardKey(stored_key.hex) == stored_key
+
+        # cached encodings do not affect equality or hashing
+        fresh_key = WireguardKey(example_wgkey)
+        assert fresh_key == stored_key
+        assert hash(fresh_key) == hash(stored_key)
+        assert repr(fresh_key) == f"WireguardKey('{example_wgkey}')"
+
+    def test_intern(self, example_wgkey: str) -> None:
+        interned = WireguardKey.intern(example_wgkey)
+        assert WireguardKey.intern(interned.hex) is interned
+        assert WireguardKey.intern(interned.keydata) is interned
+        assert WireguardKey.intern(WireguardKey(example_wgkey)) is interned
+
+    def test_generate_many(self) -> None:
+        keys = WireguardKey.generate_many(100)
+        assert len(keys) == 100
+        assert len(set(keys)) == 100
+        for key in keys:
+            # clamped curve25519 private keys
+            assert key.keydata[0] & 7 == 0
+            assert key.keydata[31] & 128 == 0
+            assert key.keydata[31] & 64 != 0
+
+    def test_derive_public_keys(self) -> None:
+        keys = WireguardKey.generate_many(8)
+        expected = [key.public_key() for key in keys]
+        assert list(derive_public_keys(keys)) == expected
+
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            derived = derive_public_keys(keys, executor=executor, chunksize=3)
+            assert list(derived) == expected
+
+    def test_derive_public_keys_parallel(
+        self,
+        monkeypatch: pytest.MonkeyPatch,
+    ) -> None:
+        keys = WireguardKey.generate_many(8)
+        expected = [key.public_key() for key in keys]
+        # small batches are derived serially
+        assert derive_public_keys_parallel(keys, max_workers=2) == expected
+
+        # force the process pool
+        monkeypatch.setattr(wireguard_key, "PARALLEL_DERIVE_MIN_KEYS", 1)
+        monkeypatch.setattr(wireguard_key, "PARALLEL_DERIVE_MIN_KEYS_FAST", 1)
+        assert derive_public_keys_parallel(keys, max_workers=2) == expected
+
+    def test_public_key_executor(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        assert public_key_executor(8, max_workers=2) is None
+        assert public_key_executor(1 << 20, max_workers=1) is None
+
+        monkeypatch.setattr(wireguard_key, "PARALLEL_DERIVE_MIN_KEYS", 1)
+        monkeypatch.setattr(wireguard_key, "PARALLEL_DERIVE_MIN_KEYS_FAST", 1)
+        executor = public_key_executor(8, max_workers=2)
+        assert executor is not None
+        # one pool is reused for several batches
+        with executor:
+            for _ in range(2):
+                keys = WireguardKey.generate_many(8)
+                expected = [key.public_key() for key in keys]
+                assert list(derive_public_keys(keys, executor)) == expected
@@ -0,0 +1,413 @@
+# Copyright (c) 2024 Carnegie Mellon University
+# SPDX-License-Identifier: MIT
+
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from ipaddress import ip_interface
+from typing import Any, AsyncIterator
+
+import pyroute2
+import pytest
+from pyroute2.netlink.generic.wireguard import (
+    WGPEER_F_REMOVE_ME,
+    WGPEER_F_REPLACE_ALLOWEDIPS,
+    WGPEER_F_UPDATE_ONLY,
+    wgmsg,
+)
+
+from wireguard_tools.wireguard_config import WireguardConfig, WireguardPeer
+from wireguard_tools.wireguard_diff import WireguardConfigDiff, diff_config
+from wireguard_tools.wireguard_netlink import (
+    NETLINK_MAX_MESSAGE_SIZE,
+    AsyncWireguardNetlinkDevice,
+    WireguardNetlinkDevice,
+)
+
+from .conftest import make_peer, peer_key
+
+PRIVATE_KEY = "DnLEmfJzVoCRJYXzdSXIhTqnjygnhh6O+I3ErMS6OUg="
+
+
+class FakeWireGuard:
+    """Stand-in for pyroute2.WireGuard that records the encoded requests."""
+
+    prid = 0x42
+
+    def __init__(self) -> None:
+        self.requests: list[wgmsg] = []
+        self.sizes: list[int] = []
+        self.closed = False
+
+    def close(self) -> None:
+        self.closed = True
+
+    def nlm_request(self, msg: Any, msg_type: int, msg_flags: int) -> tuple[()]:
+        msg["header"]["type"] = msg_type
+        msg["header"]["flags"] = msg_flags
+        msg.encode()
+        self.sizes.append(len(msg.data))
+
+        decoded = wgmsg(msg.data)
+        decoded.decode()
+        self.requests.append(decoded)
+        return ()
+
+
+@pytest.fixture
+def device() -> WireguardNetlinkDevice:
+    return WireguardNetlinkDevice("wg-test", FakeWireGuard())
+
+
+def test_shared_socket(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(pyroute2, "WireGuard", FakeWireGuard)
+    first = WireguardNetlinkDevice("wg0")
+    second = WireguardNetlinkDevice("wg1")
+    assert first.wg is second.wg
+
+    wg = first.wg
+    first.close()
+    first.close()
+    assert not wg.closed
+    second.close()
+    assert wg.closed
+
+    # a new socket is opened when needed again
+    third = WireguardNetlinkDevice("wg2")
+    assert third.wg is not wg
+
+    # pyroute2 sockets are bound to the thread that created them
+    devices: list[WireguardNetlinkDevice] = []
+    ready, done = threading.Event(), threading.Event()
+
+    def worker() -> None:
+        devices.append(WireguardNetlinkDevice("wg3"))
+        ready.set()
+        done.wait(timeout=10)
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    assert ready.wait(timeout=10)
+    worker_wg = devices[0].wg
+    assert worker_wg is not third.wg
+
+    # devices can be closed from any thread, but only the owning thread closes
+    # its socket, here when it ends
+    devices.pop().close()
+    assert not worker_wg.closed
+    done.set()
+    thread.join()
+    assert worker_wg.closed
+    third.close()
+    assert third.wg.closed
+
+    # a socket that was passed in belongs to the caller
+    own = FakeWireGuard()
+    WireguardNetlinkDevice("wg3", own).close()
+    assert not own.closed
+
+
+def make_config(peers: range) -> WireguardConfig:
+    config = WireguardConfig(private_key=PRIVATE_KEY, listen_port=51820)
+    for index in peers:
+        config.add_peer(
+            make_peer(
+                index,
+                endpoint_host="192.0.2.1",
+                endpoint_port=51820 + index % 1000,
+            ),
+        )
+    return config
+
+
+def sent_peers(wg: FakeWireGuard) -> list[dict[str, Any]]:
+    return [
+        dict(peer["attrs"])
+        for request in wg.requests
+        for peer in request.get_attr("WGDEVICE_A_PEERS") or []
+    ]
+
+
+def test_set_config_unchanged(
+    device: WireguardNetlinkDevice,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(device, "get_config", lambda: make_config(range(100)))
+    diff = device.set_config(make_config(range(100)))
+    assert not diff
+    assert not device.wg.requests
+
+
+def test_set_config_minimal_changes(
+    device: WireguardNetlinkDevice,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(device, "get_config", lambda: make_config(range(100)))
+    new_config = make_config(range(1, 101))
+    new_config.peers[make_peer(50).public_key].persistent_keepalive = 25
+
+    diff = device.set_config(new_config)
+    assert len(diff.removed) == 1
+    assert len(diff.added) == 1
+    assert len(diff.changed) == 1
+
+    # everything fits in a single message
+    assert len(device.wg.requests) == 1
+    request = device.wg.requests[0]
+    assert request.get_attr("WGDEVICE_A_IFNAME") == "wg-test"
+    assert request.get_attr("WGDEVICE_A_PRIVATE_KEY") is None
+    assert request.get_attr("WGDEVICE_A_LISTEN_PORT") is None
+
+    removed, changed, added = sent_peers(device.wg)
+    assert removed["WGPEER_A_FLAGS"] == WGPEER_F_REMOVE_ME
+    assert changed["WGPEER_A_FLAGS"] == WGPEER_F_UPDATE_ONLY
+    assert changed["WGPEER_A_PERSISTENT_KEEPALIVE_INTERVAL"] == 25
+    assert "WGPEER_A_ALLOWEDIPS" not in changed
+    assert "WGPEER_A_ENDPOINT" not in changed
+    assert added["WGPEER_A_FLAGS"] == 0
+    assert added["WGPEER_A_ENDPOINT"]["addr"] == "192.0.2.1"
+    assert [ip["addr"] for ip in added["WGPEER_A_ALLOWEDIPS"]] == ["10.0.0.100/32"]
+
+
+def test_set_config_device_only(
+    device: WireguardNetlinkDevice,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(device, "get_config", WireguardConfig)
+    device.set_config(make_config(range(0)))
+    (request,) = device.wg.requests
+    assert request.get_attr("WGDEVICE_A_LISTEN_PORT") == 51820
+    assert request.get_attr("WGDEVICE_A_PRIVATE_KEY") is not None
+    assert request.get_attr("WGDEVICE_A_PEERS") is None
+
+
+def test_set_config_splits_messages(
+    device: WireguardNetlinkDevice,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(device, "get_config", WireguardConfig)
+    diff = device.set_config(make_config(range(2000)))
+    assert len(diff.added) == 2000
+
+    assert 1 < len(device.wg.requests) < 10
+    assert all(size <= NETLINK_MAX_MESSAGE_SIZE for size in device.wg.sizes)
+    assert len(sent_peers(device.wg)) == 2000
+
+    # only the first message carries the device attributes
+    assert device.wg.requests[0].get_attr("WGDEVICE_A_LISTEN_PORT") == 51820
+    assert device.wg.requests[1].get_attr("WGDEVICE_A_LISTEN_PORT") is None
+
+
+def test_set_config_splits_allowed_ips(
+    device: WireguardNetlinkDevice,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    current = make_config(range(1))
+    monkeypatch.setattr(device, "get_config", lambda: current)
+
+    new_config = make_config(range(1))
+    peer = new_config.peers[peer_key(0)]
+    peer.allowed_ips = [
+        ip_interface(f"10.{i // 256}.{i % 256}.0/24") for i in range(5000)
+    ]
+    device.set_config(new_config)
+
+    assert len(device.wg.requests) > 1
+    assert all(size <= NETLINK_MAX_MESSAGE_SIZE for size in device.wg.sizes)
+
+    first, *rest = sent_peers(device.wg)
+    assert first["WGPEER_A_FLAGS"] == WGPEER_F_REPLACE_ALLOWEDIPS | WGPEER_F_UPDATE_ONLY
+    assert all(part["WGPEER_A_FLAGS"] == WGPEER_F_UPDATE_ONLY for part in rest)
+    allowed_ips = [
+        allowed_ip["addr"]
+        for part in (first, *rest)
+        for allowed_ip in part["WGPEER_A_ALLOWEDIPS"]
+    ]
+    assert allowed_ips == [str(addr) for addr in peer.allowed_ips]
+
+
+def test_bulk_load(
+    device: WireguardNetlinkDevice,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Loading peers into a fresh device batches them into a few requests."""
+    npeers = 800
+    monkeypatch.setattr(device, "get_config", WireguardConfig)
+    config = make_config(range(npeers))
+    device.set_config(config)
+
+    assert 1 < len(device.wg.requests) < 10
+    assert all(size <= NETLINK_MAX_MESSAGE_SIZE for size in device.wg.sizes)
+    assert len(sent_peers(device.wg)) == npeers
+
+    # compare against sending one request per peer
+    unbatched = WireguardNetlinkDevice("wg-test", FakeWireGuard())
+    for delta in diff_config(WireguardConfig(), config).peers:
+        unbatched.apply_diff(WireguardConfigDiff(peers=[delta]))
+    assert len(unbatched.wg.requests) == npeers
+    assert sum(unbatched.wg.sizes) > sum(device.wg.sizes)
+
+
+@pytest.mark.benchmark
+def test_bulk_load_benchmark(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Batching 10k peers is faster than sending one request per peer."""
+    config = make_config(range(10000))
+    deltas = diff_config(WireguardConfig(), config).peers
+
+    batched = WireguardNetlinkDevice("wg-test", FakeWireGuard())
+    monkeypatch.setattr(batched, "get_config", WireguardConfig)
+    start = time.perf_counter()
+    batched.set_config(config)
+    batched_time = time.perf_counter() - start
+
+    unbatched = WireguardNetlinkDevice("wg-test", FakeWireGuard())
+    start = time.perf_counter()
+    for delta in deltas:
+        unbatched.apply_diff(WireguardConfigDiff(peers=[delta]))
+    unbatched_time = time.perf_counter() - start
+
+    assert len(batched.wg.requests) <= 20
+    assert batched_time < unbatched_time
+
+
+class FakeAsyncWireGuard:
+    """Stand-in for pyroute2.AsyncWireGuard, reusing FakeWireGuard's encoder."""
+
+    prid = FakeWireGuard.prid
+
+    def __init__(self, info: list[wgmsg]) -> None:
+        self.sync = FakeWireGuard()
+        self.info_response = info
+
+    def close(self) -> None:
+        pass
+
+    async def info(self, _interface: str) -> AsyncIterator[wgmsg]:
+        return self._respond(self.info_response)
+
+    async def nlm_request(
+        self,
+        msg: Any,
+        msg_type: int,
+        msg_flags: int,
+    ) -> AsyncIterator[wgmsg]:
+        self.sync.nlm_request(msg, msg_type, msg_flags)
+        return self._respond([])
+
+    async def _respond(self, messages: list[wgmsg]) -> AsyncIterator[wgmsg]:
+        for message in messages:
+            yield message
+
+
+def info_response(config: WireguardConfig) -> list[wgmsg]:
+    """Encode a config the way pyroute2 decodes a WG_CMD_GET_DEVICE reply."""
+    msg = wgmsg()
+    msg["attrs"] = [
+        ["WGDEVICE_A_PRIVATE_KEY", str(config.private_key).encode()],
+        ["WGDEVICE_A_LISTEN_PORT", config.listen_port],
+        ["WGDEVICE_A_FWMARK", 0],
+        [
+            "WGDEVICE_A_PEERS",
+            [
+                {
+                    "attrs": [
+                        ["WGPEER_A_PUBLIC_KEY", str(peer.public_key).encode()],
+                        ["WGPEER_A_PRESHARED_KEY", b""],
+                        [
+                            "WGPEER_A_ENDPOINT",
+                            {
+                                "addr": str(peer.endpoint_host),
+                                "port": peer.endpoint_port,
+                            },
+                        ],
+                        ["WGPEER_A_PERSISTENT_KEEPALIVE_INTERVAL", 0],
+                        [
+                            "WGPEER_A_ALLOWEDIPS",
+                            [{"addr": str(addr)} for addr in peer.allowed_ips],
+                        ],
+                        # only every other peer had a handshake
+                        [
+                            "WGPEER_A_LAST_HANDSHAKE_TIME",
+                            {
+                                "tv_sec": 1700000000 if index % 2 else 0,
+                                "tv_nsec": 500000000 if index % 2 else 0,
+                            },
+                        ],
+                        ["WGPEER_A_RX_BYTES", index],
+                        ["WGPEER_A_TX_BYTES", 2 * index],
+                    ],
+                }
+                for index, peer in enumerate(config.peers.values())
+            ],
+        ],
+    ]
+    return [msg]
+
+
+def test_async_set_config() -> None:
+    wg = FakeAsyncWireGuard(info_response(make_config(range(100))))
+    device = AsyncWireguardNetlinkDevice("wg-test", wg)
+
+    async def update() -> WireguardConfigDiff:
+        async with device:
+            assert await device.get_config() == make_config(range(100))
+            return await device.set_config(make_config(range(1, 101)))
+
+    diff = asyncio.run(update())
+    assert len(diff.removed) == 1
+    assert len(diff.added) == 1
+    assert len(wg.sync.requests) == 1
+    assert len(sent_peers(wg.sync)) == 2
+
+
+def continued_peer(peer: WireguardPeer, addr: str) -> wgmsg:
+    """A second response part that continues the allowed IPs of a peer."""
+    continued = wgmsg()
+    continued["attrs"] = [
+        [
+            "WGDEVICE_A_PEERS",
+            [
+                {
+                    "attrs": [
+                        ["WGPEER_A_PUBLIC_KEY", str(peer.public_key).encode()],
+                        ["WGPEER_A_ALLOWEDIPS", [{"addr": addr}]],
+                    ],
+                },
+            ],
+        ],
+    ]
+    return continued
+
+
+def test_get_config_split_peer() -> None:
+    config = make_config(range(100))
+    info = info_response(config)
+    wg = FakeAsyncWireGuard([*info, continued_peer(make_peer(99), "10.1.0.0/16")])
+    device = AsyncWireguardNetlinkDevice("wg-test", wg)
+
+    device_config = asyncio.run(device.get_config())
+    assert len(device_config.peers) == 100
+    assert device_config.peers[make_peer(99).public_key].allowed_ips == [
+        *make_peer(99).allowed_ips,
+        ip_interface("10.1.0.0/16"),
+    ]
+
+
+def test_get_peer_stats() -> None:
+    config = make_config(range(100))
+    info = info_response(config)
+    # the allowed IPs of the last peer continue in a second part
+    continued = continued_peer(make_peer(99), "10.1.0.0/16")
+    wg = FakeAsyncWireGuard([*info, continued])
+    device = AsyncWireguardNetlinkDevice("wg-test", wg)
+
+    stats = asyncio.run(device.get_peer_stats())
+    assert len(stats) == 100
+    assert list(stats)[:2] == [
+        (make_peer(0).public_key, 0, 0, 0.0),
+        (make_peer(1).public_key, 1, 2, 1700000000.5),
+    ]
+    assert stats.public_key(-1) == make_peer(99).public_key
+    assert stats.rx_bytes[-1] == 99
@@ -0,0 +1,109 @@
+# Copyright (c) 2024 Carnegie Mellon University
+# SPDX-License-Identifier: MIT
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+import pytest
+
+from wireguard_tools.wireguard_key import WireguardKey
+from wireguard_tools.wireguard_peertable import WireguardPeerTable
+
+from .conftest import make_peer
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+    from wireguard_tools.wireguard_config import WireguardPeer
+
+
+@pytest.fixture
+def peers() -> list[WireguardPeer]:
+    # not in key order
+    indexes = [index * 7919 % 5000 for index in range(5000)]
+    return [
+        make_peer(
+            index,
+            endpoint_host=f"192.0.2.{index % 256}",
+            endpoint_port=51820,
+            friendly_name=f"peer{index}",
+        )
+        for index in indexes
+    ]
+
+
+def test_lookup(tmp_path: Path, peers: list[WireguardPeer]) -> None:
+    path = tmp_path / "peers.tbl"
+    WireguardPeerTable.write(path, peers)
+
+    with WireguardPeerTable(path) as table:
+        assert len(table) == 5000
+        for peer in peers[::97]:
+            assert peer.public_key in table
+            assert table[peer.public_key] == peer
+
+        missing = WireguardKey(b"\xff" * 32)
+        assert missing not in table
+        assert table.get(missing) is None
+        with pytest.raises(KeyError):
+            table[missing]
+
+        # lookups with anything other than a key are missing as well
+        not_a_key = str(peers[0].public_key)
+        assert not_a_key not in table
+        assert table.get(not_a_key) is None  # type: ignore[call-overload]
+        with pytest.raises(KeyError):
+            table[not_a_key]  # type: ignore[index]
+
+        keys = [key.keydata for key in table]
+        assert keys == sorted(peer.public_key.keydata for peer in peers)
+
+
+def test_duplicate_keys(tmp_path: Path) -> None:
+    path = tmp_path / "peers.tbl"
+    updated = make_peer(1)
+    updated.persistent_keepalive = 25
+    WireguardPeerTable.write(path, [make_peer(1), make_peer(2), updated])
+
+    with WireguardPeerTable(path) as table:
+        assert len(table) == 2
+        assert table[updated.public_key].persistent_keepalive == 25
+
+
+def test_empty_table(tmp_path: Path) -> None:
+    path = tmp_path / "peers.tbl"
+    WireguardPeerTable.write(path, [])
+    with WireguardPeerTable(path) as table:
+        assert len(table) == 0
+        assert make_peer(1).public_key not in table
+
+
+def test_invalid_table(tmp_path: Path, peers: list[WireguardPeer]) -> None:
+    path = tmp_path / "peers.tbl"
+    path.write_text("[Interface]\n")
+    with pytest.raises(ValueError, match="not a WireGuard peer table"):
+        WireguardPeerTable(path)
+
+    WireguardPeerTable.write(path, peers)
+    path.write_bytes(path.read_bytes()[:-1])
+    with pytest.raises(ValueError, match="truncated"):
+        WireguardPeerTable(path)
+
+
+def test_corrupt_record(tmp_path: Path) -> None:
+    path = tmp_path / "peers.tbl"
+    peer = make_peer(1)
+    WireguardPeerTable.write(path, [peer])
+    with WireguardPeerTable(path) as table:
+        data_offset = table._data_offset  # noqa: SLF001
+    data = bytearray(path.read_bytes())
+    data[data_offset : data_offset + 4] = b"xxxx"
+    path.write_bytes(data)
+
+    table = WireguardPeerTable(path)
+    with pytest.raises(ValueError, match="Not a binary") as excinfo:
+        table[peer.public_key]
+    # the traceback does not keep the table mapped
+    assert excinfo.traceback
+    table.close()
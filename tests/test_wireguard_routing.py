@@ -0,0 +1,106 @@
+# Copyright (c) 2024 Carnegie Mellon University
+# SPDX-License-Identifier: MIT
+
+from __future__ import annotations
+
+from ipaddress import ip_address
+
+import pytest
+
+from wireguard_tools.wireguard_config import WireguardConfig
+from wireguard_tools.wireguard_routing import AllowedIPsIndex
+
+from .conftest import make_peer
+
+DEFAULT = make_peer(1, allowed_ips=["0.0.0.0/0"])
+SITE = make_peer(2, allowed_ips=["10.0.0.0/8", "2001:db8::/32"])
+HOST = make_peer(3, allowed_ips=["10.1.2.3/32", "2001:db8:1::1/128"])
+
+
+def test_longest_prefix_match() -> None:
+    index = AllowedIPsIndex([DEFAULT, SITE, HOST])
+
+    assert index.lookup("10.1.2.3") == HOST.public_key
+    assert index.lookup("10.1.2.4") == SITE.public_key
+    assert index.lookup("192.0.2.1") == DEFAULT.public_key
+    assert index.lookup(ip_address("2001:db8:1::1")) == HOST.public_key
+    assert index.lookup(ip_address("2001:db8:1::2")) == SITE.public_key
+    assert index.lookup("2001:db9::1") is None
+
+    assert index.lookup_many(
+        ["10.1.2.3", ip_address("10.9.9.9"), "198.51.100.7", "::1"],
+    ) == [HOST.public_key, SITE.public_key, DEFAULT.public_key, None]
+
+    with pytest.raises(ValueError, match="does not appear to be an IPv4 or IPv6"):
+        index.lookup("10.1.2")
+
+
+def test_add_del_peer() -> None:
+    index = AllowedIPsIndex([SITE, HOST])
+    index.del_peer(HOST)
+    assert index.lookup("10.1.2.3") == SITE.public_key
+    index.del_peer(SITE)
+    assert index.lookup("10.1.2.3") is None
+
+    # the last peer to claim a prefix owns it
+    other = make_peer(4, allowed_ips=["10.0.0.0/8"])
+    index = AllowedIPsIndex([SITE, other])
+    assert index.lookup("10.0.0.1") == other.public_key
+    index.del_peer(SITE)
+    assert index.lookup("10.0.0.1") == other.public_key
+
+
+def test_config_index() -> None:
+    config = WireguardConfig(peers={SITE.public_key: SITE})
+    index = config.allowed_ips_index()
+    assert config.allowed_ips_index() is index
+    assert index.lookup("10.1.2.3") == SITE.public_key
+
+    config.add_peer(HOST)
+    assert index.lookup("10.1.2.3") == HOST.public_key
+
+    # replacing a peer drops the prefixes it no longer has
+    config.add_peer(make_peer(2, allowed_ips=["2001:db8::/32"]))
+    assert index.lookup("10.9.9.9") is None
+    assert index.lookup("2001:db8::1") == SITE.public_key
+
+    config.del_peer(HOST.public_key)
+    assert index.lookup("10.1.2.3") is None
+
+    assert "_allowed_ips_index" not in config.asdict()
+    assert config == WireguardConfig.from_dict(config.asdict())
+
+
+def test_find_conflicts() -> None:
+    other_host = make_peer(4, allowed_ips=["10.1.2.3/32"])
+    config = WireguardConfig()
+    for peer in (
+        DEFAULT,
+        SITE,
+        HOST,
+        other_host,
+        make_peer(5, allowed_ips=["10.2.0.0/16"]),
+    ):
+        config.add_peer(peer)
+
+    conflicts = config.find_allowed_ips_conflicts()
+    assert [
+        (str(conflict.allowed_ip), conflict.duplicate) for conflict in conflicts
+    ] == [
+        ("10.0.0.0/8", False),
+        ("10.1.2.3/32", False),
+        ("10.1.2.3/32", True),
+        ("10.2.0.0/16", False),
+        ("2001:db8:1::1/128", False),
+    ]
+    duplicate = conflicts[2]
+    assert duplicate.public_key == other_host.public_key
+    assert duplicate.other_public_key == HOST.public_key
+    assert "duplicates 10.1.2.3/32 of peer" in str(duplicate)
+
+    # nested prefixes of the same peer are not a conflict
+    assert not WireguardConfig(
+        peers={
+            SITE.public_key: make_peer(2, allowed_ips=["10.0.0.0/8", "10.1.0.0/16"])
+        },
+    ).find_allowed_ips_conflicts()
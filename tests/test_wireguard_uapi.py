@@ -0,0 +1,475 @@
+# Copyright (c) 2024 Carnegie Mellon University
+# SPDX-License-Identifier: MIT
+
+from __future__ import annotations
+
+import asyncio
+import socket
+import threading
+import time
+from ipaddress import IPv4Address, IPv4Interface, IPv6Address
+from typing import TYPE_CHECKING
+
+import pytest
+
+from wireguard_tools import wireguard_uapi
+from wireguard_tools.wireguard_config import WireguardConfig, WireguardPeer
+from wireguard_tools.wireguard_device import WireguardDevice
+from wireguard_tools.wireguard_diff import diff_config
+from wireguard_tools.wireguard_key import WireguardKey
+from wireguard_tools.wireguard_netlink import WireguardNetlinkDevice
+from wireguard_tools.wireguard_stats import WireguardPeerStats
+from wireguard_tools.wireguard_uapi import (
+    AsyncWireguardUAPIDevice,
+    WireguardUAPIDevice,
+    WireguardUAPISession,
+)
+
+from .conftest import make_peer, peer_key
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+PRIVATE_KEY = WireguardKey("DnLEmfJzVoCRJYXzdSXIhTqnjygnhh6O+I3ErMS6OUg=")
+
+
+def uapi_dump(npeers: int) -> bytes:
+    lines = [
+        f"private_key={PRIVATE_KEY.hex}",
+        "listen_port=51820",
+    ]
+    for index in range(npeers):
+        lines.extend(
+            [
+                f"public_key={peer_key(index).hex}",
+                f"preshared_key={bytes(32).hex()}",
+                f"endpoint=192.0.2.1:{51820 + index % 1000}",
+                "persistent_keepalive_interval=25",
+                f"allowed_ip=10.{index // 65536}.{index // 256 % 256}.{index % 256}/32",
+                "last_handshake_time_sec=1700000000",
+                "last_handshake_time_nsec=500000000",
+                f"rx_bytes={index}",
+                f"tx_bytes={2 * index}",
+            ],
+        )
+    lines.extend(["protocol_version=1", "errno=0", "", ""])
+    return "\n".join(lines).encode()
+
+
+class FakeUAPIServer:
+    """Answer UAPI requests with canned responses, sent in small chunks."""
+
+    def __init__(self, path: Path, responses: list[bytes], chunk_size: int) -> None:
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(str(path))
+        self.listener.listen(1)
+        self.responses = responses
+        self.chunk_size = chunk_size
+        self.requests: list[bytes] = []
+        self.accepted = threading.Event()
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def serve(self) -> None:
+        conn, _ = self.listener.accept()
+        self.accepted.set()
+        with conn:
+            buffer = b""
+            for response in self.responses:
+                while b"\n\n" not in buffer:
+                    buffer += conn.recv(4096)
+                request, buffer = buffer.split(b"\n\n", 1)
+                self.requests.append(request)
+                for offset in range(0, len(response), self.chunk_size):
+                    conn.sendall(response[offset : offset + self.chunk_size])
+
+    def close(self) -> None:
+        self.thread.join(timeout=10)
+        self.listener.close()
+
+
+@pytest.fixture
+def uapi_path(tmp_path: Path) -> Path:
+    return tmp_path / "wg-test.sock"
+
+
+def test_get_config_streaming(uapi_path: Path) -> None:
+    server = FakeUAPIServer(uapi_path, [uapi_dump(2000)], chunk_size=1000)
+    device = WireguardUAPIDevice(uapi_path)
+    try:
+        config = device.get_config()
+    finally:
+        device.close()
+        server.close()
+
+    assert server.requests == [b"get=1"]
+    assert config.private_key == PRIVATE_KEY
+    assert config.listen_port == 51820
+    assert len(config.peers) == 2000
+
+    peer = config.peers[peer_key(258)]
+    assert not peer.preshared_key
+    assert peer.endpoint_host == IPv4Address("192.0.2.1")
+    assert peer.endpoint_port == 52078
+    assert peer.persistent_keepalive == 25
+    assert peer.allowed_ips == [IPv4Interface("10.0.1.2/32")]
+    assert peer.last_handshake == 1700000000.5
+    assert peer.rx_bytes == 258
+    assert peer.tx_bytes == 516
+
+
+def test_get_peer_stats(uapi_path: Path) -> None:
+    server = FakeUAPIServer(uapi_path, [uapi_dump(300)] * 2, chunk_size=1000)
+    device = WireguardUAPIDevice(uapi_path)
+    try:
+        stats = device.get_peer_stats()
+        config = device.get_config()
+    finally:
+        device.close()
+        server.close()
+
+    assert stats == WireguardPeerStats.from_config(config)
+    assert len(stats) == 300
+    assert stats.public_key(258) == peer_key(258)
+    assert list(stats)[258] == (peer_key(258), 258, 516, 1700000000.5)
+
+
+def test_back_to_back_messages(uapi_path: Path) -> None:
+    # both responses arrive in a single read, the second must not get lost
+    server = FakeUAPIServer(
+        uapi_path,
+        [uapi_dump(1) + b"errno=0\n\n"],
+        chunk_size=65536,
+    )
+    device = WireguardUAPIDevice(uapi_path)
+    try:
+        config = device.get_config()
+        assert device._recvmsg() == [("errno", "0")]  # noqa: SLF001
+    finally:
+        device.close()
+        server.close()
+    assert len(config.peers) == 1
+
+
+def test_get_config_errno(uapi_path: Path) -> None:
+    server = FakeUAPIServer(uapi_path, [b"errno=19\n\n"], chunk_size=3)
+    device = WireguardUAPIDevice(uapi_path)
+    try:
+        with pytest.raises(RuntimeError, match="failed with 19"):
+            device.get_config()
+    finally:
+        device.close()
+        server.close()
+
+
+# fail to parse on the first line, with more than one receive buffer after it
+BAD_RESPONSES = [
+    (b"listen_port=x\n" + uapi_dump(1000), ValueError),
+    # a peer attribute without a peer
+    (b"allowed_ip=10.0.0.1/32\n" + uapi_dump(1000), AssertionError),
+]
+
+
+@pytest.mark.parametrize(("bad_response", "error"), BAD_RESPONSES)
+def test_get_config_parse_error(
+    uapi_path: Path,
+    bad_response: bytes,
+    error: type[Exception],
+) -> None:
+    server = FakeUAPIServer(uapi_path, [bad_response, uapi_dump(1)], 1000)
+    device = WireguardUAPIDevice(uapi_path)
+    try:
+        with pytest.raises(error):
+            device.get_config()
+        # the rest of the failed response does not end up in the next one
+        config = device.get_config()
+    finally:
+        device.close()
+        server.close()
+    assert len(config.peers) == 1
+
+
+def dump_peer(index: int) -> WireguardPeer:
+    """The peer as it is listed by uapi_dump."""
+    return make_peer(
+        index,
+        endpoint_host=IPv4Address("192.0.2.1"),
+        endpoint_port=51820 + index % 1000,
+        persistent_keepalive=25,
+    )
+
+
+def dump_config(npeers: int) -> WireguardConfig:
+    config = WireguardConfig(private_key=PRIVATE_KEY, listen_port=51820)
+    for index in range(npeers):
+        config.add_peer(dump_peer(index))
+    return config
+
+
+def test_sync_config(uapi_path: Path) -> None:
+    server = FakeUAPIServer(
+        uapi_path,
+        [uapi_dump(3), b"errno=0\n\n", uapi_dump(3)],
+        chunk_size=1000,
+    )
+    config = dump_config(2)
+    config.peers[peer_key(1)].allowed_ips.append(IPv4Interface("10.1.0.0/16"))
+    config.add_peer(
+        WireguardPeer(
+            public_key=peer_key(3),
+            endpoint_host=IPv6Address("2001:db8::1"),
+            endpoint_port=51820,
+            allowed_ips=["10.0.0.3/32"],
+        ),
+    )
+
+    device = WireguardUAPIDevice(uapi_path)
+    try:
+        diff = device.sync_config(config)
+        # nothing changed, only the current state is requested
+        unchanged = device.sync_config(dump_config(3))
+    finally:
+        device.close()
+        server.close()
+
+    assert str(diff) == (
+        "device unchanged, 1 peers added, 1 peers removed, 1 peers changed"
+    )
+    assert not unchanged
+    assert server.requests[::2] == [b"get=1", b"get=1"]
+    assert server.requests[1].decode().split("\n") == [
+        "set=1",
+        f"public_key={peer_key(2).hex}",
+        "remove=true",
+        f"public_key={peer_key(1).hex}",
+        "update_only=true",
+        "allowed_ip=10.1.0.0/16",
+        f"public_key={peer_key(3).hex}",
+        "endpoint=[2001:db8::1]:51820",
+        "allowed_ip=10.0.0.3/32",
+    ]
+
+
+def test_set_config(uapi_path: Path) -> None:
+    server = FakeUAPIServer(uapi_path, [b"errno=0\n\n"], chunk_size=1000)
+    config = WireguardConfig(private_key=PRIVATE_KEY, listen_port=51820, fwmark=0)
+    config.add_peer(
+        WireguardPeer(
+            public_key=peer_key(1),
+            endpoint_host=IPv6Address("2001:db8::1"),
+            endpoint_port=51820,
+            persistent_keepalive=0,
+            allowed_ips=["10.0.0.1/32"],
+        ),
+    )
+
+    device = WireguardUAPIDevice(uapi_path)
+    try:
+        device.set_config(config)
+    finally:
+        device.close()
+        server.close()
+
+    # zero values clear the current settings and are sent as well
+    assert server.requests[0].decode().split("\n") == [
+        "set=1",
+        f"private_key={PRIVATE_KEY.hex}",
+        "listen_port=51820",
+        "fwmark=0",
+        "replace_peers=true",
+        f"public_key={peer_key(1).hex}",
+        "endpoint=[2001:db8::1]:51820",
+        "persistent_keepalive_interval=0",
+        "replace_allowed_ips=true",
+        "allowed_ip=10.0.0.1/32",
+    ]
+
+
+def test_session_pipelining(uapi_path: Path) -> None:
+    server = FakeUAPIServer(
+        uapi_path,
+        [b"errno=0\n\n", b"errno=22\n\n", uapi_dump(2), uapi_dump(2)],
+        chunk_size=1000,
+    )
+    session = WireguardUAPISession(uapi_path)
+    try:
+        session.queue_diff(diff_config(dump_config(1), dump_config(2)))
+        session.queue_diff(diff_config(dump_config(2), dump_config(1)))
+        # an empty diff is not sent
+        session.queue_diff(diff_config(dump_config(2), dump_config(2)))
+        # the failed set is reported after all responses were read
+        with pytest.raises(RuntimeError, match="set_config failed with 22"):
+            session.get_config()
+        config = session.get_config()
+    finally:
+        session.close()
+        server.close()
+
+    assert len(server.requests) == 4
+    assert server.requests[2:] == [b"get=1", b"get=1"]
+    assert len(config.peers) == 2
+    assert session.stats.requests == 4
+    assert session.stats.flushes == 2
+    assert session.stats.reconnects == 0
+    assert session.stats.bytes_sent == sum(len(r) + 2 for r in server.requests)
+    assert session.stats.bytes_received == 2 * len(uapi_dump(2)) + 19
+    assert session.stats.max_latency >= session.stats.mean_latency > 0
+
+
+def test_session_reconnect(uapi_path: Path) -> None:
+    server = FakeUAPIServer(uapi_path, [uapi_dump(1)], chunk_size=1000)
+    session = WireguardUAPISession(uapi_path)
+    try:
+        assert len(session.get_config().peers) == 1
+        # the userspace implementation restarts
+        server.close()
+        uapi_path.unlink()
+        server = FakeUAPIServer(
+            uapi_path,
+            [b"errno=0\n\n", uapi_dump(2)],
+            chunk_size=1000,
+        )
+        session.queue_diff(diff_config(dump_config(1), dump_config(2)))
+        config = session.get_config()
+    finally:
+        session.close()
+        server.close()
+
+    assert len(config.peers) == 2
+    assert server.requests[1] == b"get=1"
+    assert session.stats.reconnects == 1
+    assert session.stats.flushes == 2
+
+
+def test_session_reconnect_partial_response(uapi_path: Path) -> None:
+    # the connection is lost halfway through a response
+    response = uapi_dump(5)
+    server = FakeUAPIServer(uapi_path, [response[: len(response) * 3 // 4]], 1000)
+    session = WireguardUAPISession(uapi_path)
+    assert server.accepted.wait(timeout=10)
+    server.listener.close()
+    uapi_path.unlink()
+    restarted = FakeUAPIServer(uapi_path, [uapi_dump(2)], chunk_size=1000)
+    try:
+        config = session.get_config()
+    finally:
+        session.close()
+        server.close()
+        restarted.close()
+
+    # none of the peers from the lost response remain
+    assert list(config.peers) == [peer_key(0), peer_key(1)]
+    assert session.stats.reconnects == 1
+
+
+def test_async_get_set_config(uapi_path: Path) -> None:
+    server = FakeUAPIServer(
+        uapi_path,
+        [uapi_dump(2000), uapi_dump(1), b"errno=0\n\n"],
+        chunk_size=1000,
+    )
+
+    async def concurrent_requests() -> list[WireguardConfig]:
+        async with await AsyncWireguardUAPIDevice.connect(uapi_path) as device:
+            # concurrent requests on one connection are serialized
+            configs = await asyncio.gather(device.get_config(), device.get_config())
+            await device.set_config(configs[1])
+        return list(configs)
+
+    try:
+        large, small = asyncio.run(concurrent_requests())
+    finally:
+        server.close()
+
+    assert server.requests[:2] == [b"get=1", b"get=1"]
+    assert server.requests[2].startswith(b"set=1\nprivate_key=")
+    assert b"\nreplace_peers=true\n" in server.requests[2]
+    assert len(large.peers) == 2000
+    assert large.peers[peer_key(258)].allowed_ips == [IPv4Interface("10.0.1.2/32")]
+    assert len(small.peers) == 1
+
+
+def test_async_set_config_errno(uapi_path: Path) -> None:
+    server = FakeUAPIServer(uapi_path, [b"errno=22\n\n"], chunk_size=3)
+
+    async def set_config() -> None:
+        device = await AsyncWireguardUAPIDevice.connect(uapi_path)
+        try:
+            await device.set_config(WireguardConfig())
+        finally:
+            await device.close()
+
+    try:
+        with pytest.raises(RuntimeError, match="set_config failed with 22"):
+            asyncio.run(set_config())
+    finally:
+        server.close()
+
+
+@pytest.mark.parametrize(("bad_response", "error"), BAD_RESPONSES)
+def test_async_get_config_parse_error(
+    uapi_path: Path,
+    bad_response: bytes,
+    error: type[Exception],
+) -> None:
+    server = FakeUAPIServer(uapi_path, [bad_response, uapi_dump(1)], 1000)
+
+    async def get_configs() -> WireguardConfig:
+        async with await AsyncWireguardUAPIDevice.connect(uapi_path) as device:
+            with pytest.raises(error):
+                await device.get_config()
+            return await device.get_config()
+
+    try:
+        config = asyncio.run(get_configs())
+    finally:
+        server.close()
+    assert len(config.peers) == 1
+
+
+def test_get_all_configs(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(wireguard_uapi, "WG_UAPI_SOCKET_DIR", tmp_path)
+    monkeypatch.setattr(
+        WireguardNetlinkDevice,
+        "list_interfaces",
+        classmethod(lambda _: []),
+    )
+
+    servers = [
+        FakeUAPIServer(tmp_path / f"wg{index}.sock", [uapi_dump(index)], 1000)
+        for index in range(1, 6)
+    ]
+    # answers with a response that does not parse
+    servers.append(
+        FakeUAPIServer(tmp_path / "wg6.sock", [b"listen_port=x\nerrno=0\n\n"], 1000),
+    )
+    # accepts the connection but never answers
+    hung = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    hung.bind(str(tmp_path / "wg0.sock"))
+    hung.listen(1)
+    # left behind by a userspace implementation that is gone
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(str(tmp_path / "wg7.sock"))
+    stale.close()
+
+    try:
+        start = time.monotonic()
+        configs = WireguardDevice.get_all_configs(timeout=0.5)
+        elapsed = time.monotonic() - start
+    finally:
+        hung.close()
+        for server in servers:
+            server.close()
+
+    # a hung device only costs the timeout, the others are queried meanwhile
+    assert elapsed < 5
+    expected = sorted(f"wg{index}" for index in range(8))
+    assert sorted(configs) == expected
+    assert list(configs) == [device.stem for device in tmp_path.glob("*.sock")]
+    assert isinstance(configs["wg0"], socket.timeout)
+    assert isinstance(configs["wg6"], ValueError)
+    assert isinstance(configs["wg7"], ConnectionRefusedError)
+    for index in range(1, 6):
+        config = configs[f"wg{index}"]
+        assert isinstance(config, WireguardConfig)
+        assert len(config.peers) == index